@@ -0,0 +1,496 @@
+# asgi.py
+# ⚡ ASGI entry point ที่ให้บริการ route เดียวกับ main.py ด้วยสัญญา request/response เดียวกัน
+# (outbox + 202 / Idempotency-Key / auth ของ /notifications และ /fcm-tokens / /jobs / /metrics / /notifications/batch)
+# รันด้วย: uvicorn asgi:app --host 0.0.0.0 --port 5001
+# ใช้ service ชุดเดียวกับ main.py (import main): outbox และ worker, idempotency store, reminder scheduler, listener ของเจ้าหน้าที่
+# ต่างกันเฉพาะงานที่ทำทันที (NOTIFICATION_OUTBOX_ENABLED=0) ของแจ้งเตือนรายคน ที่อ่าน Firestore ด้วย AsyncClient
+# และส่ง FCM ด้วย httpx บน event loop; งานที่ผ่าน staff topic / digest / batch ใช้ handler ของ main.py บน thread
+import asyncio
+import contextlib
+import functools
+import math
+import time
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import main
+from services import registry
+from services.common.auth import AuthError, verify_bearer_token
+from services.common.circuit_breaker import CircuitOpenError, breakers_snapshot
+from services.common.fan_out import FANOUT_BRANCH_TIMEOUT, BranchResult, BranchTimeout
+from services.common.idempotency import IdempotencyConflict, IdempotencyInProgress
+from services.common.metrics import CONTENT_TYPE, REQUEST_LATENCY, render_metrics
+from services.notification.async_notification_service import AsyncNotificationService
+from services.notification.batch_notification import BATCH_MAX_ITEMS
+from services.notification.notification_history import InvalidHistoryRequest, etag_matches, parse_page_args
+from services.notification.messages import (
+    appointment_status_message,
+    payment_due_message,
+    payment_status_message,
+    schedule_updated_message,
+)
+
+async_db = registry.async_firestore_client()
+
+with registry.timed("async_notification_service"):
+    notification_service = AsyncNotificationService(async_db, main.db, main.service_account_path)
+
+# งานย่อยที่เกิน timeout แต่ยังส่งอยู่ (เก็บ reference ไว้ไม่ให้ task ถูกเก็บกวาดก่อนเสร็จ)
+_background = set()
+
+# =================== Helpers ===================
+
+def _error(message, status):
+    return JSONResponse({"success": False, "error": message}, status_code=status)
+
+def _unavailable(error):
+    """⛔ dependency ล่ม (circuit เปิด): ตอบ 503 ทันทีพร้อม Retry-After แทนการค้างรอ"""
+    response = _error(str(error), 503)
+    response.headers["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+async def _json(request):
+    """📥 body แบบ JSON หรือ None ถ้าอ่านไม่ได้ (route จะตอบ 500 / 400 เหมือน request.json ของ Flask)"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def _user_tokens(user_id):
+    """👤 คืน (exists, tokens, data) ของผู้ใช้"""
+    doc = await notification_service.get_document('User', user_id)
+    if not doc.exists:
+        return False, [], {}
+    data = doc.to_dict()
+    return True, await notification_service.get_user_tokens(user_id, data), data
+
+async def _notify_user_about_appointment_status(user_id, role, status, appointment_date, appointment_time):
+    exists, tokens, _ = await _user_tokens(user_id)
+    if not exists:
+        print(f"❌ ไม่พบข้อมูล {role} ใน Firestore: {user_id}")
+        return
+    if not tokens:
+        print(f"⚠️ ไม่มี Token สำหรับ {role} นี้")
+        return
+    title, body, data = appointment_status_message(status, appointment_date, appointment_time)
+    await notification_service.send_fcm_notification(tokens, title, body, data, role=role, recipient_id=user_id)
+
+def _forget(task):
+    _background.discard(task)
+    # อ่านผลทิ้งไว้ กัน warning "exception was never retrieved" (ผู้เรียกตามผลผ่าน done callback ของตัวเองแล้ว)
+    if not task.cancelled():
+        task.exception()
+
+# =================== Job Handlers ===================
+# สัญญาเดียวกับ handler ใน main.py (payload -> (response_dict, http_status)) แต่เป็น coroutine
+# ใช้เฉพาะตอนทำทันที; งานใน outbox ยังทำโดย handler ของ main.py
+
+async def handle_appointment_status(payload):
+    # ผู้ป่วยและแพทย์ไม่ขึ้นต่อกัน จึงส่งพร้อมกัน รอแต่ละฝั่งไม่เกิน FANOUT_BRANCH_TIMEOUT เหมือน FanOut
+    recipients = payload.get('recipients') or main.APPOINTMENT_STATUS_RECIPIENTS
+    users = {"patient": ("Patient", payload['patient_id']), "doctor": ("Doctor", payload['doctor_id'])}
+    tasks = {}
+    for recipient in recipients:
+        role, user_id = users[recipient]
+        tasks[recipient] = asyncio.ensure_future(_notify_user_about_appointment_status(
+            user_id, role, payload['status'], payload['appointment_date'], payload['appointment_time']
+        ))
+    started = time.perf_counter()
+    await asyncio.wait(tasks.values(), timeout=FANOUT_BRANCH_TIMEOUT)
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name, task in tasks.items():
+        if not task.done():
+            _background.add(task)
+            task.add_done_callback(_forget)
+            results[name] = BranchResult(name, error=BranchTimeout(name, FANOUT_BRANCH_TIMEOUT),
+                                         elapsed=elapsed, future=task)
+        else:
+            results[name] = BranchResult(name, value=task.result() if task.exception() is None else None,
+                                         error=task.exception(), elapsed=elapsed)
+    return main.appointment_status_response(payload, results)
+
+async def handle_payment_due(payload):
+    patient_id = payload['patient_id']
+    exists, tokens, _ = await _user_tokens(patient_id)
+    if not exists:
+        print(f"❌ ไม่พบผู้ป่วย ID: {patient_id}")
+    elif not tokens:
+        print("⚠️ ไม่มี FCM Token สำหรับผู้ป่วยนี้")
+    else:
+        title, body, data = payment_due_message(payload['amount'])
+        await notification_service.send_fcm_notification(
+            tokens, title, body, data, role="Patient", recipient_id=patient_id
+        )
+    return {"success": True, "message": "Payment due notification sent to patient"}, 200
+
+async def handle_payment_status(payload):
+    patient_id = payload['patient_id']
+    appointment_id = payload['appointment_id']
+    appointment_doc, (exists, tokens, _) = await asyncio.gather(
+        notification_service.get_document('Appointments', appointment_id),
+        _user_tokens(patient_id),
+    )
+    if appointment_doc.exists and exists and tokens:
+        title, body, data = payment_status_message(appointment_id, appointment_doc.to_dict(), payload['status'])
+        await notification_service.send_fcm_notification(
+            tokens, title, body, data, role="Patient", recipient_id=patient_id
+        )
+    return {"success": True, "message": "Notification sent to patient"}, 200
+
+async def handle_doctor_schedule_updated(payload):
+    doctor_id = payload['doctor_id']
+    exists, tokens, _ = await _user_tokens(doctor_id)
+    if not exists:
+        return {"success": False, "error": "Doctor not found"}, 404
+    if not tokens:
+        print(f"⚠️ ไม่มี FCM token สำหรับแพทย์ {doctor_id}")
+        return {"success": False, "error": "No FCM tokens found"}, 400
+
+    title, body, data = schedule_updated_message(
+        datetime.fromisoformat(payload['schedule_date']), payload['start_time'], payload['end_time']
+    )
+    await notification_service.send_fcm_notification(tokens, title, body, data, role="Doctor", recipient_id=doctor_id)
+    return {"success": True, "message": "Notification sent to doctor"}, 200
+
+ASYNC_JOB_HANDLERS = {
+    "appointment_status": handle_appointment_status,
+    "payment_due": handle_payment_due,
+    "payment_status": handle_payment_status,
+    "doctor_schedule_updated": handle_doctor_schedule_updated,
+}
+
+async def submit_job(kind, payload):
+    """📮 เหมือน main.submit_job: ส่งงานเข้า outbox แล้วตอบ 202 (หรือทำทันทีถ้าปิด outbox)"""
+    if not main.OUTBOX_ENABLED:
+        try:
+            handler = ASYNC_JOB_HANDLERS.get(kind)
+            if handler is not None:
+                result, status = await handler(payload)
+            else:
+                result, status = await asyncio.to_thread(main.JOB_HANDLERS[kind], payload)
+        except CircuitOpenError as e:
+            return _unavailable(e)
+        return JSONResponse(result, status_code=status)
+
+    job_id = await asyncio.to_thread(main.outbox.enqueue, kind, payload)
+    response = JSONResponse({"success": True, "job_id": job_id, "status": "queued"}, status_code=202)
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response
+
+def idempotent(view):
+    """🔁 เหมือน main.idempotent และใช้ IdempotencyStore ตัวเดียวกัน (key ที่ส่งผ่าน Flask หรือ ASGI ก็กันซ้ำกันได้)
+
+    การถือ key ใน Firestore ทำบน thread ส่วน view ยังทำบน event loop
+    """
+    @functools.wraps(view)
+    async def wrapper(request):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return await view(request)
+        body = await request.body()
+        loop = asyncio.get_running_loop()
+
+        def handler():
+            response = asyncio.run_coroutine_threadsafe(view(request), loop).result()
+            headers = {name: response.headers[name] for name in main.REPLAYED_HEADERS if name in response.headers}
+            return response.body, response.status_code, headers
+
+        try:
+            (body, status, headers), replayed = await asyncio.to_thread(
+                main.idempotency_store.run, request.url.path, key, body, handler
+            )
+        except IdempotencyConflict as e:
+            return _error(str(e), 422)
+        except IdempotencyInProgress as e:
+            response = _error(str(e), 409)
+            response.headers["Retry-After"] = "1"
+            return response
+        except CircuitOpenError as e:
+            return _unavailable(e)
+
+        response = Response(body, status_code=status, headers=headers)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    return wrapper
+
+# =================== Routes ===================
+
+@idempotent
+async def new_appointment_notification(request):
+    try:
+        data = await _json(request)
+        return await submit_job("new_appointment", {
+            "appointment_id": data.get('appointment_id'),
+            "title": data.get('title'),
+            "body": data.get('body'),
+        })
+    except Exception as e:
+        print(f"❌ Exception: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def appointment_status_notification(request):
+    try:
+        data = await _json(request)
+        patient_id = data.get('patient_id')
+        doctor_id = data.get('doctor_id')
+        status = data.get('status')
+        appointment_date = data.get('appointment_date')
+        appointment_time = data.get('appointment_time')
+
+        if not patient_id or not doctor_id or not appointment_date or not appointment_time:
+            return _error("Missing required fields", 400)
+
+        return await submit_job("appointment_status", {
+            "patient_id": patient_id,
+            "doctor_id": doctor_id,
+            "status": status,
+            "appointment_date": appointment_date,
+            "appointment_time": appointment_time,
+        })
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def payment_due_notification(request):
+    try:
+        data = await _json(request)
+        patient_id = data.get('patient_id')
+        amount = data.get('amount')
+
+        if not patient_id or not amount:
+            return _error("Missing required fields", 400)
+
+        return await submit_job("payment_due", {"patient_id": patient_id, "amount": amount})
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def notify_staff_payment_upload(request):
+    try:
+        data = await _json(request)
+        appointment_id = data.get('appointment_id')
+        patient_id = data.get('patient_id')
+        slip_url = data.get('slip_url')
+
+        if not appointment_id or not patient_id or not slip_url:
+            return _error("Missing required fields", 400)
+
+        return await submit_job("staff_payment_upload", {
+            "patient_id": patient_id,
+            "appointment_id": appointment_id,
+            "slip_url": slip_url,
+        })
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def notify_payment_status(request):
+    try:
+        data = await _json(request)
+        return await submit_job("payment_status", {
+            "patient_id": data.get('patient_id'),
+            "appointment_id": data.get('appointment_id'),
+            "status": data.get('status'),
+        })
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def notify_schedule_change_request(request):
+    try:
+        data = await _json(request)
+        doctor_id = data.get('doctor_id')
+        schedule_date_str = data.get('schedule_date')
+        schedule_time = data.get('schedule_time')
+        reason = data.get('reason')
+
+        if not doctor_id or not schedule_date_str or not schedule_time or not reason:
+            return _error("Missing required fields", 400)
+
+        try:
+            datetime.fromisoformat(schedule_date_str)
+        except ValueError:
+            return _error("Invalid date format", 400)
+
+        return await submit_job("schedule_change_request", {
+            "doctor_id": doctor_id,
+            "schedule_date": schedule_date_str,
+            "schedule_time": schedule_time,
+            "reason": reason,
+        })
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def notify_doctor_schedule_updated(request):
+    try:
+        data = await _json(request)
+        doctor_id = data.get('doctor_id')
+        schedule_date_str = data.get('schedule_date')
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+
+        if not doctor_id or not schedule_date_str or not start_time or not end_time:
+            return _error("Missing required fields", 400)
+
+        try:
+            datetime.fromisoformat(schedule_date_str)
+        except ValueError:
+            return _error("Invalid date format", 400)
+
+        return await submit_job("doctor_schedule_updated", {
+            "doctor_id": doctor_id,
+            "schedule_date": schedule_date_str,
+            "start_time": start_time,
+            "end_time": end_time,
+        })
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+@idempotent
+async def notifications_batch(request):
+    """📦 แจ้งเตือนหลายรายการ (ต่างชนิดกันได้) ในครั้งเดียว"""
+    try:
+        data = await _json(request)
+        items = data.get('items') if isinstance(data, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return _error("items must be a non-empty list", 400)
+        if len(items) > BATCH_MAX_ITEMS:
+            return _error(f"Too many items (max {BATCH_MAX_ITEMS})", 400)
+
+        return await submit_job("notification_batch", {"items": items})
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+async def notifications_history(request):
+    """📜 ประวัติแจ้งเตือนของผู้รับทีละหน้า (ต้องแนบ Firebase ID token ดูได้เฉพาะของตัวเอง ยกเว้น Staff)"""
+    try:
+        caller = await asyncio.to_thread(verify_bearer_token, request.headers.get('Authorization'))
+    except AuthError as e:
+        return _error(str(e), 401)
+
+    try:
+        recipient_id, role, limit, cursor = parse_page_args(request.query_params)
+        if recipient_id != caller:
+            caller_doc = await notification_service.get_document('User', caller)
+            if not caller_doc.exists or caller_doc.to_dict().get('role') != 'Staff':
+                return _error("Cannot read another user's notifications", 403)
+        page = await asyncio.to_thread(main.notification_history.page, recipient_id, role, limit, cursor)
+    except InvalidHistoryRequest as e:
+        return _error(str(e), 400)
+    except CircuitOpenError as e:
+        return _unavailable(e)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+    headers = {"ETag": page['etag'], "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get('If-None-Match'), page['etag']):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(
+        {"success": True, "notifications": page['items'], "next_cursor": page['next_cursor']}, headers=headers
+    )
+
+async def register_fcm_token(request):
+    """📲 ลงทะเบียน FCM token ของเครื่อง ({user_id, token, platform?}) ต้องแนบ Firebase ID token ของ user_id เอง"""
+    try:
+        caller = await asyncio.to_thread(verify_bearer_token, request.headers.get('Authorization'))
+    except AuthError as e:
+        return _error(str(e), 401)
+
+    try:
+        data = await _json(request) or {}
+        user_id = data.get('user_id')
+        token = data.get('token')
+        platform = data.get('platform')
+
+        if not user_id or not isinstance(token, str) or not token.strip():
+            return _error("Missing required fields", 400)
+        if '/' in token:
+            return _error("Invalid token", 400)
+        if user_id != caller:
+            return _error("Cannot register tokens for another user", 403)
+
+        user_doc = await notification_service.get_document('User', user_id)
+        if not user_doc.exists:
+            return _error("User not found", 404)
+
+        await asyncio.to_thread(
+            notification_service.token_index.register,
+            user_id, [token], role=user_doc.to_dict().get('role'), platform=platform,
+        )
+        return JSONResponse({"success": True})
+    except CircuitOpenError as e:
+        return _unavailable(e)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return _error(str(e), 500)
+
+async def circuit_breakers(request):
+    """🔌 สถานะ circuit breaker ของแต่ละ dependency"""
+    return JSONResponse({"success": True, "breakers": breakers_snapshot()})
+
+async def job_status(request):
+    """📮 ดูสถานะงานแจ้งเตือนใน outbox"""
+    job = await asyncio.to_thread(main.outbox.get, request.path_params['job_id'])
+    if job is None:
+        return _error("Job not found", 404)
+    return JSONResponse({"success": True, "job": job})
+
+async def metrics(request):
+    """📊 metrics ในรูปแบบ Prometheus"""
+    body, status = render_metrics()
+    return Response(body, status_code=status, media_type=CONTENT_TYPE)
+
+# =================== End Routes ===================
+
+def _route(path, endpoint, methods):
+    """🛣️ Route ที่จับเวลาลง REQUEST_LATENCY (label เป็น path ของ route เหมือนฝั่ง Flask)"""
+    @functools.wraps(endpoint)
+    async def timed(request):
+        started = time.perf_counter()
+        response = await endpoint(request)
+        REQUEST_LATENCY.labels(request.method, path, str(response.status_code)).observe(time.perf_counter() - started)
+        return response
+    return Route(path, timed, methods=methods)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # listener / outbox / scheduler เริ่มแล้วตอน import main (และหยุดผ่าน atexit ของ main)
+    yield
+    await notification_service.aclose()
+    notification_service.notification_log.flush()
+
+app = Starlette(
+    routes=[
+        _route('/metrics', metrics, ['GET']),
+        _route('/new-appointment-notification', new_appointment_notification, ['POST']),
+        _route('/appointment-status-notification', appointment_status_notification, ['POST']),
+        _route('/payment-due-notification', payment_due_notification, ['POST']),
+        _route('/notify-staff-payment-upload', notify_staff_payment_upload, ['POST']),
+        _route('/notify-payment-status', notify_payment_status, ['POST']),
+        _route('/notify-schedule-change-request', notify_schedule_change_request, ['POST']),
+        _route('/notify-doctor-schedule-updated', notify_doctor_schedule_updated, ['POST']),
+        _route('/notifications/batch', notifications_batch, ['POST']),
+        _route('/notifications', notifications_history, ['GET']),
+        _route('/fcm-tokens', register_fcm_token, ['POST']),
+        _route('/health/breakers', circuit_breakers, ['GET']),
+        _route('/jobs/{job_id}', job_status, ['GET']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,150 @@
+"""⚖️ เปรียบเทียบ throughput ของ Flask (main.py) กับ ASGI (asgi.py) บน FCM / Firestore ปลอม
+
+รันจากโฟลเดอร์ backend:
+    python -m benchmarks.compare_servers --requests 2000 --concurrency 200 --fcm-latency 0.05
+
+ผลลัพธ์เป็น JSON (stdout หรือ --output) เพื่อเทียบระหว่างเวอร์ชันได้
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+
+import httpx
+
+from benchmarks.fake_fcm import start_fake_fcm
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.notification_bench import percentile
+from benchmarks.stubs import install_stubs, seed_users
+
+ROUTES = {
+    "appointment-status": lambda n: ("/appointment-status-notification", {
+        "patient_id": f"patient-{n % 1000}",
+        "doctor_id": f"doctor-{n % 50}",
+        "status": "รอชำระเงิน",
+        "appointment_date": "2025-02-22",
+        "appointment_time": "10:00",
+    }),
+    "new-appointment": lambda n: ("/new-appointment-notification", {
+        "appointment_id": f"appointment-{n}",
+        "title": "🔔 แจ้งเตือน: นัดหมายใหม่",
+        "body": "มีนัดหมายใหม่",
+    }),
+}
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round((len(latencies) + errors) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        },
+    }
+
+
+async def drive(base_url, route, total, concurrency):
+    """🏎️ ยิง request ทั้งหมด total ครั้ง โดยมีค้างพร้อมกันไม่เกิน concurrency"""
+    build = ROUTES[route]
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    # แบ่ง client ละ 16 connection เหมือน AsyncFCMDispatcher (pool ใหญ่ของ httpcore กิน CPU จนบิดผลวัด)
+    limits = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    clients = [httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0)
+               for _ in range(-(-concurrency // 16))]
+    next_client = itertools.cycle(clients)
+
+    try:
+        async def one(n):
+            nonlocal errors
+            path, payload = build(n)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await next(next_client).post(path, json=payload)
+                    ok = response.status_code < 500
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(total)))
+        return summarize(latencies, errors, time.perf_counter() - started)
+    finally:
+        for client in clients:
+            await client.aclose()
+
+
+def start_flask(port):
+    from werkzeug.serving import make_server
+    import main
+
+    server = make_server("127.0.0.1", port, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-flask", daemon=True).start()
+    return server
+
+
+def start_asgi(port):
+    import uvicorn
+    import asgi
+
+    config = uvicorn.Config(asgi.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="bench-asgi", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--route", choices=sorted(ROUTES), default="appointment-status")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--fcm-latency", type=float, default=0.05, help="seconds per fake FCM call")
+    parser.add_argument("--firestore-latency", type=float, default=0.005, help="seconds per fake Firestore RPC")
+    parser.add_argument("--flask-port", type=int, default=5101)
+    parser.add_argument("--asgi-port", type=int, default=5102)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    random.seed(0)
+    fcm = start_fake_fcm(latency=args.fcm_latency)
+    store = FakeFirestore(latency=args.firestore_latency)
+    seed_users(store)
+    install_stubs(store, fcm.url)
+
+    flask_server = start_flask(args.flask_port)
+    asgi_server = start_asgi(args.asgi_port)
+
+    results = {"route": args.route, "requests": args.requests, "concurrency": args.concurrency,
+               "fcm_latency": args.fcm_latency, "firestore_latency": args.firestore_latency}
+    for name, port in (("flask", args.flask_port), ("asgi", args.asgi_port)):
+        fcm.reset_counters()
+        results[name] = asyncio.run(drive(f"http://127.0.0.1:{port}", args.route, args.requests, args.concurrency))
+        results[name]["fcm_calls"] = fcm.requests
+
+    flask_server.shutdown()
+    asgi_server.should_exit = True
+    fcm.shutdown()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""🧪 FCM v1 ปลอมบน HTTP ในเครื่อง ใช้วัดประสิทธิภาพโดยไม่ยิง Google จริง
+
+ตอบ messages:send ด้วย latency ที่กำหนด และสุ่มตอบ error ตาม error_rate
+(404 UNREGISTERED) เพื่อจำลอง token ที่หมดอายุ; ตั้ง quota (request / วินาที) เพื่อจำลอง
+429 QUOTA_EXCEEDED พร้อม Retry-After เมื่อยิงเกิน
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_UNREGISTERED = {
+    "error": {
+        "code": 404,
+        "message": "Requested entity was not found.",
+        "status": "NOT_FOUND",
+        "details": [{
+            "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+            "errorCode": "UNREGISTERED",
+        }],
+    }
+}
+
+_QUOTA_EXCEEDED = {
+    "error": {
+        "code": 429,
+        "message": "Quota exceeded for quota metric 'Messages'.",
+        "status": "RESOURCE_EXHAUSTED",
+        "details": [{
+            "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+            "errorCode": "QUOTA_EXCEEDED",
+        }],
+    }
+}
+
+
+class FakeFCMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # รองรับ connection พร้อมกันจำนวนมากตอนยิงโหลด
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.05, error_rate=0.0, dead_tokens=(), quota=None, retry_after=1):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dead_tokens = set(dead_tokens)
+        self.quota = quota
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._window = (0, 0)
+
+    def over_quota(self):
+        """🚫 นับ request ในวินาทีปัจจุบัน แล้วบอกว่าเกิน quota หรือไม่"""
+        if not self.quota:
+            return False
+        second = int(time.monotonic())
+        with self.lock:
+            window, count = self._window
+            count = count + 1 if window == second else 1
+            self._window = (second, count)
+            if count > self.quota:
+                self.throttled += 1
+                return True
+        return False
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/projects/medi-bridge-app/messages:send"
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.throttled = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ปิด Nagle ไม่ให้ header กับ body ถูกหน่วงแยกกัน (delayed ACK ~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        token = body.get("message", {}).get("token")
+
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.over_quota():
+            self._respond(_QUOTA_EXCEEDED, 429, {"Retry-After": str(server.retry_after)})
+            return
+
+        failed = token in server.dead_tokens or (server.error_rate and random.random() < server.error_rate)
+        with server.lock:
+            server.requests += 1
+            if failed:
+                server.errors += 1
+
+        if failed:
+            payload, status = _UNREGISTERED, 404
+        else:
+            payload, status = {"name": f"projects/medi-bridge-app/messages/{random.getrandbits(48)}"}, 200
+
+        self._respond(payload, status)
+
+    def _respond(self, payload, status, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_fake_fcm(latency=0.05, error_rate=0.0, dead_tokens=(), host="127.0.0.1", port=0, quota=None):
+    """▶️ เปิด FCM ปลอมใน thread เบื้องหลังแล้วคืน server (ใช้ server.url เป็น FCM_ENDPOINT)"""
+    server = FakeFCMServer((host, port), latency=latency, error_rate=error_rate, dead_tokens=dead_tokens, quota=quota)
+    threading.Thread(target=server.serve_forever, name="fake-fcm", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local fake FCM v1 endpoint")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, help="requests per second before answering 429")
+    args = parser.parse_args()
+
+    fake = start_fake_fcm(latency=args.latency, error_rate=args.error_rate, port=args.port, quota=args.quota)
+    print(f"🧪 Fake FCM listening on {fake.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.shutdown()
@@ -0,0 +1,450 @@
+"""🧪 Firestore ปลอมในหน่วยความจำ สำหรับ benchmark / load test (ไม่ใช้ในโค้ดจริง)
+
+รองรับเฉพาะส่วนที่ backend ใช้: document get/set/update/delete, where/select/order_by/limit/
+start_after/stream, get_all, batch, transaction, on_snapshot และ AsyncClient แบบง่าย
+ตั้ง latency (วินาที) เพื่อจำลองเวลา RPC ของ Firestore จริง
+"""
+import asyncio
+import copy
+import datetime
+import threading
+import time
+import uuid
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import transforms
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _apply_value(current, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(v for v in value.values if v not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (current if isinstance(current, list) else []) if v not in value.values]
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if value is transforms.DELETE_FIELD:
+        return _DELETE
+    return copy.deepcopy(value)
+
+
+_DELETE = object()
+
+
+class _ChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+ADDED = _ChangeType('ADDED')
+MODIFIED = _ChangeType('MODIFIED')
+REMOVED = _ChangeType('REMOVED')
+
+
+class FakeChange:
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, read_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.read_time = read_time or _now()
+        self.update_time = self.read_time
+        self.create_time = self.read_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data or {}
+        for part in field.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+
+class FakeDocumentReference:
+    def __init__(self, store, collection_path, doc_id):
+        self._store = store
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, name):
+        return FakeCollection(self._store, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        return self._store.snapshot(self, field_paths)
+
+    def set(self, data, merge=False, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        self._store.write([('set', self, data, merge)])
+
+    def create(self, data, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        self._store.write([('create', self, data, False)])
+
+    def update(self, data, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        self._store.write([('update', self, data, False)])
+
+    def delete(self, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        self._store.write([('delete', self, None, False)])
+
+
+class FakeQuery:
+    def __init__(self, store, collection_path, filters=(), projection=None, orders=(), limit=None, cursor=None):
+        self._store = store
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._projection = projection
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        fields = dict(
+            filters=self._filters, projection=self._projection, orders=self._orders,
+            limit=self._limit, cursor=self._cursor,
+        )
+        fields.update(changes)
+        return FakeQuery(self._store, self._collection_path, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self._filters:
+            if field == '__name__':
+                # เทียบ document id (ค่าอาจเป็น DocumentReference หรือ string)
+                current, value = doc_id, getattr(value, 'id', value)
+            else:
+                current = data
+                for part in field.split('.'):
+                    current = current.get(part) if isinstance(current, dict) else None
+            try:
+                if not _OPS[op](current, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    @staticmethod
+    def _order_value(doc_id, data, field):
+        if field == '__name__':
+            return doc_id
+        return data.get(field)
+
+    def _after_cursor(self, doc_id, data):
+        """cursor แบบ dict {field: value} (ค่า __name__ เป็น DocumentReference) เทียบตามลำดับ order_by"""
+        for field, direction in self._orders:
+            if field not in self._cursor:
+                break
+            value = self._order_value(doc_id, data, field)
+            bound = self._cursor[field]
+            bound = getattr(bound, 'id', bound) if field == '__name__' else bound
+            if value == bound:
+                continue
+            descending = str(direction).upper().endswith('DESCENDING')
+            try:
+                return value < bound if descending else value > bound
+            except TypeError:
+                return False
+        return False
+
+    def _run(self):
+        items = [
+            (doc_id, data) for doc_id, data in self._store.collection_items(self._collection_path)
+            if self._matches(doc_id, data)
+        ]
+        for field, direction in reversed(self._orders):
+            descending = str(direction).upper().endswith('DESCENDING')
+            items.sort(key=lambda item, f=field: (self._order_value(*item, f) is None, self._order_value(*item, f)),
+                       reverse=descending)
+        if isinstance(self._cursor, dict):
+            items = [(doc_id, data) for doc_id, data in items if self._after_cursor(doc_id, data)]
+        elif self._cursor is not None:
+            cursor_id = getattr(self._cursor, 'id', None)
+            ids = [doc_id for doc_id, _ in items]
+            if cursor_id in ids:
+                items = items[ids.index(cursor_id) + 1:]
+        if self._limit is not None:
+            items = items[:self._limit]
+        return [
+            self._store.snapshot(FakeDocumentReference(self._store, self._collection_path, doc_id), self._projection)
+            for doc_id, _ in items
+        ]
+
+    def stream(self, transaction=None, timeout=None, **kwargs):
+        self._store.simulate_latency()
+        return iter(self._run())
+
+    def get(self, transaction=None, timeout=None, **kwargs):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._store.watch(self, callback)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, store, collection_path):
+        super().__init__(store, collection_path)
+        self.id = collection_path.rsplit('/', 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._store, self._collection_path, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, timeout=None, **kwargs):
+        ref = self.document()
+        ref.set(data)
+        return _now(), ref
+
+
+class FakeWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(('create', reference, data, False))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self, timeout=None, **kwargs):
+        if len(self._writes) > 500:
+            raise ValueError("maximum 500 writes allowed per request")
+        self._store.simulate_latency()
+        self._store.write(self._writes)
+        return [None] * len(self._writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """การเขียนทั้งหมดใน transaction ถูก commit พร้อมกันภายใต้ lock ของ store"""
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._id = None
+
+
+class FakeFirestore:
+    """🧪 Firestore Client ปลอม (sync)"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._data = {}
+        self._lock = threading.RLock()
+        self._watches = []
+        self.reads = 0
+        self.writes = 0
+
+    # ---------- internals ----------
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection_items(self, collection_path):
+        with self._lock:
+            docs = self._data.get(collection_path, {})
+            self.reads += len(docs)
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in docs.items()]
+
+    def snapshot(self, reference, field_paths=None):
+        with self._lock:
+            self.reads += 1
+            data = self._data.get(reference._collection_path, {}).get(reference.id)
+            data = copy.deepcopy(data)
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeSnapshot(reference, data)
+
+    def write(self, writes):
+        touched = set()
+        with self._lock:
+            for kind, reference, data, merge in writes:
+                docs = self._data.setdefault(reference._collection_path, {})
+                current = docs.get(reference.id)
+                if kind == 'delete':
+                    docs.pop(reference.id, None)
+                elif kind == 'create' and current is not None:
+                    raise api_exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+                elif kind == 'update' and current is None:
+                    raise api_exceptions.NotFound(f"No document to update: {reference.path}")
+                else:
+                    base = dict(current) if (current is not None and (merge or kind == 'update')) else {}
+                    for key, value in data.items():
+                        new_value = _apply_value(base.get(key), value)
+                        if new_value is _DELETE:
+                            base.pop(key, None)
+                        else:
+                            base[key] = new_value
+                    docs[reference.id] = base
+                self.writes += 1
+                touched.add(reference._collection_path)
+            watches = [w for w in self._watches if w.query._collection_path in touched]
+        for watch in watches:
+            watch.refresh()
+
+    def watch(self, query, callback):
+        watch = _FakeWatch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+        watch.refresh()
+        return watch
+
+    def unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    # ---------- public API ----------
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        collection_path, doc_id = path.rsplit('/', 1)
+        return FakeDocumentReference(self, collection_path, doc_id)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None, timeout=None, **kwargs):
+        self.simulate_latency()
+        for reference in references:
+            yield self.snapshot(reference, field_paths)
+
+    def seed(self, collection, documents):
+        """🌱 ใส่ข้อมูลตั้งต้น {doc_id: data} แบบไม่คิด latency"""
+        with self._lock:
+            self._data.setdefault(collection, {}).update(copy.deepcopy(documents))
+
+
+class _FakeWatch:
+    def __init__(self, store, query, callback):
+        self.store = store
+        self.query = query
+        self.callback = callback
+        self._known = {}
+        self._delivered = False
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            current = {snap.id: snap for snap in self.query._run()}
+            changes = []
+            for doc_id, snap in current.items():
+                if doc_id not in self._known:
+                    changes.append(FakeChange(ADDED, snap))
+                elif self._known[doc_id] != snap._data:
+                    changes.append(FakeChange(MODIFIED, snap))
+            for doc_id in self._known:
+                if doc_id not in current:
+                    ref = FakeDocumentReference(self.store, self.query._collection_path, doc_id)
+                    changes.append(FakeChange(REMOVED, FakeSnapshot(ref, None)))
+            self._known = {doc_id: snap._data for doc_id, snap in current.items()}
+        if changes or not self._delivered:
+            self._delivered = True
+            self.callback(list(current.values()), changes, _now())
+
+    def unsubscribe(self):
+        self.store.unwatch(self)
+
+
+def run_transactional(transaction, fn, *args):
+    """🔁 จำลอง firestore.transactional: รัน fn ภายใต้ lock แล้ว commit"""
+    store = transaction._store
+    with store._lock:
+        result = fn(transaction, *args)
+        transaction.commit()
+    return result
+
+
+# ---------------------------------------------------------------------------
+# AsyncClient ปลอม (ใช้ข้อมูลชุดเดียวกับ FakeFirestore)
+# ---------------------------------------------------------------------------
+
+class FakeAsyncDocumentReference:
+    def __init__(self, sync_ref):
+        self._ref = sync_ref
+        self.id = sync_ref.id
+
+    async def get(self, field_paths=None, **kwargs):
+        if self._ref._store.latency:
+            await asyncio.sleep(self._ref._store.latency)
+        return self._ref._store.snapshot(self._ref, field_paths)
+
+
+class FakeAsyncCollection:
+    def __init__(self, store, name):
+        self._sync = FakeCollection(store, name)
+
+    def document(self, doc_id=None):
+        return FakeAsyncDocumentReference(self._sync.document(doc_id))
+
+
+class FakeAsyncFirestore:
+    """🧪 Firestore AsyncClient ปลอม ใช้ข้อมูลร่วมกับ FakeFirestore ตัวที่ส่งเข้ามา"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def collection(self, name):
+        return FakeAsyncCollection(self._store, name)
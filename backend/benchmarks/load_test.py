@@ -0,0 +1,471 @@
+"""🚦 Load test แบบ end-to-end ของ route ใน main.py (Flask) ด้วยสัดส่วน route ที่กำหนด ที่ RPS เป้าหมาย
+
+รันจากโฟลเดอร์ backend:
+    python -m benchmarks.load_test --rps 50,100,200,400 --duration 20
+    python -m benchmarks.load_test --mix appointment-status=70,payment=20,schedule=10 --workers 4 --threads 16
+    python -m benchmarks.load_test --base-url http://127.0.0.1:5001 --rps 100   # ยิงแอปที่รันไว้เอง
+
+โหมดเริ่มต้นจะเปิด FCM ปลอม (fake_fcm) ใน process นี้ แล้วเปิดแอป --workers process
+(แต่ละตัวมี Firestore ปลอมของตัวเองและรับ request พร้อมกันได้ --threads ตัว) และกระจาย request แบบ round-robin
+ถ้าจะใช้ Firestore emulator ให้รัน main.py เองโดยตั้ง FIRESTORE_EMULATOR_HOST และ FCM_ENDPOINT
+(ชี้ไปที่ `python -m benchmarks.fake_fcm`) แล้วใช้ --base-url
+
+ยิงแบบ open-loop: request ที่ n ออกตามเวลาที่กำหนดไว้ไม่ว่าคำตอบก่อนหน้าจะกลับมาหรือยัง
+latency นับจากเวลาที่ควรส่ง (รวมเวลาที่รอคิว) จึงไม่ซ่อนความช้าตอนระบบอิ่มตัว (coordinated omission)
+แต่ละขั้นของ --rps รายงาน throughput ที่ทำได้จริง, p50 / p95 / p99, อัตรา error ต่อ route
+และสรุป saturation_rps = ขั้นสูงสุดที่ยังผ่านเกณฑ์ (--min-throughput-ratio / --slo-p99-ms / --max-error-rate)
+ผลลัพธ์เป็น JSON (stdout หรือ --output)
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.notification_bench import git_revision, percentile
+
+DEFAULT_MIX = "appointment-status=70,payment=20,schedule=10"
+DEFAULT_PATIENTS = 1000
+DEFAULT_DOCTORS = 50
+DEFAULT_STAFF = 20
+
+# route ที่ยิงได้: ชื่อ -> fn(n, rnd) -> (method, path, json_body หรือ query params)
+ROUTES = {
+    "appointment-status": lambda n, rnd: ("POST", "/appointment-status-notification", {
+        "patient_id": f"patient-{rnd.randrange(DEFAULT_PATIENTS)}",
+        "doctor_id": f"doctor-{rnd.randrange(DEFAULT_DOCTORS)}",
+        "status": rnd.choice(("รอชำระเงิน", "ยกเลิก")),
+        "appointment_date": "2025-02-22",
+        "appointment_time": f"{9 + n % 8:02d}:00",
+    }),
+    "new-appointment": lambda n, rnd: ("POST", "/new-appointment-notification", {
+        "appointment_id": f"appt-{n}",
+        "title": "🔔 แจ้งเตือน: นัดหมายใหม่",
+        "body": "มีนัดหมายใหม่",
+    }),
+    "payment-due": lambda n, rnd: ("POST", "/payment-due-notification", {
+        "patient_id": f"patient-{rnd.randrange(DEFAULT_PATIENTS)}",
+        "amount": 100 + n % 900,
+    }),
+    "payment-upload": lambda n, rnd: ("POST", "/notify-staff-payment-upload", {
+        "patient_id": f"patient-{n % DEFAULT_PATIENTS}",
+        "appointment_id": f"appt-{n % DEFAULT_PATIENTS}",
+        "slip_url": f"https://example.invalid/slips/{n}.jpg",
+    }),
+    "payment-status": lambda n, rnd: ("POST", "/notify-payment-status", {
+        "patient_id": f"patient-{n % DEFAULT_PATIENTS}",
+        "appointment_id": f"appt-{n % DEFAULT_PATIENTS}",
+        "status": rnd.choice(("ชำระเงินแล้ว", "สลิปไม่ถูกต้อง")),
+    }),
+    "schedule-change": lambda n, rnd: ("POST", "/notify-schedule-change-request", {
+        "doctor_id": f"doctor-{rnd.randrange(DEFAULT_DOCTORS)}",
+        "schedule_date": "2025-03-01",
+        "schedule_time": f"{8 + n % 10:02d}:00",
+        "reason": f"load-test {n}",
+    }),
+    "schedule-updated": lambda n, rnd: ("POST", "/notify-doctor-schedule-updated", {
+        "doctor_id": f"doctor-{rnd.randrange(DEFAULT_DOCTORS)}",
+        "schedule_date": "2025-03-01",
+        "start_time": f"{8 + n % 10:02d}:00",
+        "end_time": f"{9 + n % 10:02d}:00",
+    }),
+    "history": lambda n, rnd: ("GET", "/notifications", {
+        "recipient_id": f"patient-{rnd.randrange(DEFAULT_PATIENTS)}",
+        "limit": 20,
+    }),
+}
+
+# ชื่อกลุ่มใน --mix ที่แบ่งน้ำหนักให้ route ในกลุ่มเท่า ๆ กัน
+ROUTE_GROUPS = {
+    "payment": ("payment-due", "payment-upload", "payment-status"),
+    "schedule": ("schedule-change", "schedule-updated"),
+}
+
+
+def parse_mix(text):
+    """🥣 "appointment-status=70,payment=20" -> [(route, weight), ...] (กลุ่มถูกแตกเป็น route ย่อย)"""
+    weights = collections.OrderedDict()
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        try:
+            weight = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight in --mix: {part}")
+        routes = ROUTE_GROUPS.get(name, (name,))
+        for route in routes:
+            if route not in ROUTES:
+                raise argparse.ArgumentTypeError(
+                    f"unknown route in --mix: {name} (choose from {', '.join(sorted(ROUTES) + sorted(ROUTE_GROUPS))})"
+                )
+            weights[route] = weights.get(route, 0.0) + weight / len(routes)
+    if not weights or sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError("--mix must give at least one route a positive weight")
+    return list(weights.items())
+
+
+def parse_rps(text):
+    """📈 "50,100,200" หรือ "50:400:50" (start:stop:step) -> [50.0, 100.0, ...]"""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        steps = []
+        value = start
+        while value <= stop + 1e-9:
+            steps.append(value)
+            value += step
+        return steps
+    return [float(v) for v in text.split(",") if v.strip()]
+
+
+# =================== Worker (แอปบน Firestore ปลอม) ===================
+
+def serve_worker(port, threads, fcm_url, firestore_latency):
+    """🧪 รัน main.app บน Firestore ปลอม ให้รับ request พร้อมกันได้ไม่เกิน threads ตัว (ทำงานใน subprocess)"""
+    from werkzeug.serving import BaseWSGIServer
+
+    from benchmarks.fake_firestore import FakeFirestore
+    from benchmarks.stubs import install_stubs, seed_users
+
+    store = FakeFirestore(latency=firestore_latency)
+    seed_users(store, staff=DEFAULT_STAFF, patients=DEFAULT_PATIENTS, doctors=DEFAULT_DOCTORS)
+    store.seed("Appointments", {
+        f"appt-{i}": {"patient_id": f"patient-{i}", "appointment_time": "10:00"} for i in range(DEFAULT_PATIENTS)
+    })
+    install_stubs(store, fcm_url)
+    import main
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """werkzeug server ที่ใช้ thread pool ขนาดคงที่ (threaded=True ของ werkzeug เปิด thread ใหม่ไม่จำกัด)"""
+
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="load-worker")
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, main.app).serve_forever()
+
+
+def start_workers(count, base_port, threads, fcm_url, firestore_latency, outbox, log_path=None):
+    """🚀 เปิดแอป count process (พอร์ต base_port ขึ้นไป) แล้วรอจนทุกตัวตอบ /health/breakers"""
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "ERROR"),
+               NOTIFICATION_OUTBOX_ENABLED="1" if outbox else "0")
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    processes = []
+    for i in range(count):
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.load_test", "--worker-port", str(base_port + i),
+             "--threads", str(threads), "--fcm-url", fcm_url, "--firestore-latency", str(firestore_latency)],
+            env=env, stdout=log, stderr=log,
+        ))
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(count)]
+
+    deadline = time.monotonic() + 120
+    pending = set(urls)
+    while pending:
+        for url, process in zip(urls, processes):
+            if process.poll() is not None:
+                stop_workers(processes)
+                raise RuntimeError(f"worker {url} exited with code {process.returncode}")
+        for url in list(pending):
+            with contextlib.suppress(httpx.HTTPError):
+                if httpx.get(f"{url}/health/breakers", timeout=1.0).status_code == 200:
+                    pending.discard(url)
+        if pending and time.monotonic() > deadline:
+            stop_workers(processes)
+            raise RuntimeError(f"workers did not start: {', '.join(sorted(pending))}")
+        if pending:
+            time.sleep(0.2)
+    return urls, processes
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# =================== Load generator ===================
+
+
+def summarize_step(target_rps, duration, samples, dropped, send_window, drain, send_lag):
+    """📋 สรุปหนึ่งขั้น: samples คือ list ของ (route, status หรือ None ถ้าเชื่อมต่อไม่ได้, latency วินาที)
+
+    achieved_rps คิดจากช่วงที่ยิง (send_window) ไม่รวมเวลารอ response ที่ค้างหลังยิงครบ (drain)
+    และเวลาปิด client ซึ่งไม่ได้สะท้อนความสามารถของ server
+    """
+    def latency_block(latencies):
+        return {
+            "p50": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            "max": round(max(latencies) * 1000, 2) if latencies else None,
+        }
+
+    def is_error(status):
+        return status is None or status >= 500
+
+    completed = len(samples)
+    errors = sum(1 for _, status, _ in samples if is_error(status))
+    by_route = {}
+    for route in sorted({route for route, _, _ in samples}):
+        route_samples = [s for s in samples if s[0] == route]
+        route_errors = sum(1 for _, status, _ in route_samples if is_error(status))
+        by_route[route] = {
+            "requests": len(route_samples),
+            "error_rate": round(route_errors / len(route_samples), 4),
+            "latency_ms": latency_block([latency for _, status, latency in route_samples if not is_error(status)]),
+        }
+    statuses = collections.Counter("error" if status is None else str(status) for _, status, _ in samples)
+    return {
+        "target_rps": target_rps,
+        "duration_seconds": duration,
+        "achieved_rps": round((completed - errors) / send_window, 1) if send_window else None,
+        "send_window_seconds": round(send_window, 3),
+        # รอ response ที่ยังค้างหลังส่ง request สุดท้ายนานเท่าไร (ไม่นับใน achieved_rps)
+        "drain_seconds": round(drain, 3),
+        "requests": completed + dropped,
+        "completed": completed,
+        "errors": errors,
+        # request ที่ไม่ได้ส่งเพราะค้างอยู่ครบ --max-inflight แล้ว (ฝั่งผู้ยิงอิ่มตัว) นับเป็น error ด้วย
+        "dropped": dropped,
+        "error_rate": round((errors + dropped) / (completed + dropped), 4) if completed + dropped else 0.0,
+        "status_counts": dict(sorted(statuses.items())),
+        "latency_ms": latency_block([latency for _, status, latency in samples if not is_error(status)]),
+        # ส่งช้ากว่าเวลาที่กำหนดมากสุดเท่าไร (ถ้าสูง ตัวยิงเองเป็นคอขวด ผลของขั้นนี้เชื่อไม่ได้)
+        "max_send_lag_ms": round(send_lag * 1000, 2),
+        "routes": by_route,
+    }
+
+
+async def run_step(urls, mix, rps, duration, max_inflight, arrival, seed, run_id, timeout):
+    """🏎️ ยิง request แบบ open-loop ที่ rps ต่อวินาทีเป็นเวลา duration วินาที"""
+    rnd = random.Random(seed)
+    routes = [route for route, _ in mix]
+    weights = [weight for _, weight in mix]
+    total = max(1, int(round(rps * duration)))
+
+    # เวลาส่งของแต่ละ request (constant = ห่างเท่ากัน, poisson = สุ่มแบบ exponential)
+    offsets = []
+    at = 0.0
+    for _ in range(total):
+        offsets.append(at)
+        at += rnd.expovariate(rps) if arrival == "poisson" else 1.0 / rps
+    if arrival == "poisson":
+        # ย่อ/ขยายให้ total ครั้งอยู่ในช่วง duration พอดี (เท่ากับ Poisson ที่รู้จำนวนครั้งแล้ว)
+        # ไม่เช่นนั้นช่วงยิงจริงอาจยาวกว่า duration และอัตราที่ยิงจริงต่ำกว่า rps ที่ตั้งไว้
+        offsets = [offset * duration / at for offset in offsets]
+
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=min(max_inflight, 256))
+    clients = [httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) for url in urls]
+    next_client = itertools.cycle(clients)
+
+    samples = []
+    dropped = 0
+    inflight = 0
+    send_lag = 0.0
+    tasks = []
+
+    async def one(client, route, n, scheduled):
+        nonlocal inflight
+        method, path, body = ROUTES[route](n, rnd)
+        headers = {"Idempotency-Key": f"load-{run_id}-{rps:g}-{n}"}
+        try:
+            if method == "GET":
+                # route แบบ GET อ่านข้อมูลของผู้รับเอง (stub ถือว่า bearer token คือ uid)
+                headers = {"Authorization": f"Bearer {body['recipient_id']}"}
+                response = await client.get(path, params=body, headers=headers)
+            else:
+                response = await client.post(path, json=body, headers=headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        finally:
+            inflight -= 1
+        samples.append((route, status, time.perf_counter() - scheduled))
+
+    started = time.perf_counter()
+    try:
+        for n, offset in enumerate(offsets):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            send_lag = max(send_lag, time.perf_counter() - scheduled)
+            if inflight >= max_inflight:
+                dropped += 1
+                continue
+            inflight += 1
+            route = rnd.choices(routes, weights)[0]
+            tasks.append(asyncio.create_task(one(next(next_client), route, n, scheduled)))
+        # ช่วงยิงคือ duration หรือจนถึงตอนที่ส่งตัวสุดท้ายจริง (ถ้าตัวยิงส่งช้ากว่ากำหนด)
+        send_window = max(duration, time.perf_counter() - started)
+        sent_at = time.perf_counter()
+        await asyncio.gather(*tasks)
+        drain = time.perf_counter() - sent_at
+    finally:
+        for client in clients:
+            await client.aclose()
+    return summarize_step(rps, duration, samples, dropped, send_window, drain, send_lag)
+
+
+def saturated(step, min_throughput_ratio, slo_p99_ms, max_error_rate):
+    """🧱 เหตุผลที่ขั้นนี้ไม่ผ่านเกณฑ์ (list ว่าง = ยังไม่อิ่มตัว)"""
+    reasons = []
+    if step["achieved_rps"] is None or step["achieved_rps"] < step["target_rps"] * min_throughput_ratio:
+        reasons.append("throughput")
+    p99 = step["latency_ms"]["p99"]
+    if p99 is None or p99 > slo_p99_ms:
+        reasons.append("p99")
+    if step["error_rate"] > max_error_rate:
+        reasons.append("errors")
+    return reasons
+
+
+def fetch_breakers(urls):
+    """🔌 สถานะ circuit breaker ของทุก worker หลังจบขั้น (breaker ที่เปิดแปลว่า dependency ปลอมรับไม่ไหว)"""
+    states = {}
+    for url in urls:
+        with contextlib.suppress(httpx.HTTPError, ValueError):
+            breakers = httpx.get(f"{url}/health/breakers", timeout=2.0).json().get("breakers", {})
+            for name, snapshot in breakers.items():
+                if snapshot.get("state") != "closed" or snapshot.get("rejected"):
+                    states.setdefault(name, []).append({"worker": url, **snapshot})
+    return states
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"route weights, routes: {', '.join(sorted(ROUTES))}; groups: {', '.join(sorted(ROUTE_GROUPS))}")
+    parser.add_argument("--rps", default="25,50,100,200", help='target RPS steps, "50,100,200" or "50:400:50"')
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per RPS step")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load at the first step before measuring")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="poisson")
+    parser.add_argument("--workers", type=int, default=1, help="app processes (requests are spread round-robin)")
+    parser.add_argument("--threads", type=int, default=32, help="request threads per app process")
+    parser.add_argument("--max-inflight", type=int, default=2000, help="outstanding requests before new ones are dropped")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (seconds)")
+    parser.add_argument("--outbox", action="store_true", help="enable the SQLite outbox (routes answer 202)")
+    parser.add_argument("--fcm-latency", type=float, default=0.05, help="seconds per fake FCM call")
+    parser.add_argument("--fcm-error-rate", type=float, default=0.0, help="random error rate of the fake FCM server")
+    parser.add_argument("--fcm-quota", type=int, help="fake FCM requests per second before answering 429")
+    parser.add_argument("--firestore-latency", type=float, default=0.005, help="seconds per fake Firestore RPC")
+    parser.add_argument("--base-port", type=int, default=5201)
+    parser.add_argument("--base-url", action="append",
+                        help="target an already running app instead of starting workers (repeatable)")
+    parser.add_argument("--slo-p99-ms", type=float, default=1000.0)
+    parser.add_argument("--min-throughput-ratio", type=float, default=0.9)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--stop-on-saturation", action="store_true", help="skip the remaining steps once saturated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker-log", help="append worker stdout / stderr to this file")
+    parser.add_argument("--output", help="write JSON results to this file")
+    # ใช้ภายใน: รันตัวเองเป็น worker
+    parser.add_argument("--worker-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--fcm-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_port:
+        serve_worker(args.worker_port, args.threads, args.fcm_url, args.firestore_latency)
+        return
+
+    try:
+        mix = parse_mix(args.mix)
+        steps = parse_rps(args.rps)
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+    if not steps or any(step <= 0 for step in steps):
+        parser.error("--rps must contain positive values")
+
+    fcm = None
+    processes = []
+    if args.base_url:
+        urls = [url.rstrip("/") for url in args.base_url]
+    else:
+        from benchmarks.fake_fcm import start_fake_fcm
+
+        fcm = start_fake_fcm(latency=args.fcm_latency, error_rate=args.fcm_error_rate, quota=args.fcm_quota)
+        urls, processes = start_workers(args.workers, args.base_port, args.threads, fcm.url,
+                                        args.firestore_latency, args.outbox, args.worker_log)
+
+    total_weight = sum(weight for _, weight in mix)
+    results = {
+        "commit": git_revision(),
+        "mix": {route: round(weight / total_weight, 4) for route, weight in mix},
+        "arrival": args.arrival,
+        "workers": len(urls),
+        "threads": args.threads if not args.base_url else None,
+        "outbox": args.outbox,
+        "fcm_latency": args.fcm_latency if fcm else None,
+        "firestore_latency": args.firestore_latency if fcm else None,
+        "criteria": {"slo_p99_ms": args.slo_p99_ms, "min_throughput_ratio": args.min_throughput_ratio,
+                     "max_error_rate": args.max_error_rate},
+        "steps": [],
+    }
+    run_id = f"{int(time.time())}-{os.getpid()}"
+    try:
+        if args.warmup > 0:
+            asyncio.run(run_step(urls, mix, steps[0], args.warmup, args.max_inflight, args.arrival,
+                                 args.seed, f"{run_id}-warmup", args.timeout))
+
+        for i, rps in enumerate(steps):
+            if fcm is not None:
+                fcm.reset_counters()
+            step = asyncio.run(run_step(urls, mix, rps, args.duration, args.max_inflight, args.arrival,
+                                        args.seed + i, run_id, args.timeout))
+            if fcm is not None:
+                step["fcm_calls"] = fcm.requests
+            step["open_breakers"] = fetch_breakers(urls)
+            step["saturated"] = saturated(step, args.min_throughput_ratio, args.slo_p99_ms, args.max_error_rate)
+            results["steps"].append(step)
+            print(f"🚦 {rps:g} rps -> {step['achieved_rps']} rps, p50 {step['latency_ms']['p50']} ms, "
+                  f"p99 {step['latency_ms']['p99']} ms, errors {step['error_rate']:.2%}"
+                  f"{' (saturated: ' + ', '.join(step['saturated']) + ')' if step['saturated'] else ''}",
+                  file=sys.stderr)
+            if step["saturated"] and args.stop_on_saturation:
+                break
+    finally:
+        stop_workers(processes)
+        if fcm is not None:
+            fcm.shutdown()
+
+    passing = [step["target_rps"] for step in results["steps"] if not step["saturated"]]
+    failing = [step["target_rps"] for step in results["steps"] if step["saturated"]]
+    results["saturation"] = {
+        # ขั้นสูงสุดที่ผ่านเกณฑ์ก่อนขั้นแรกที่ไม่ผ่าน
+        "saturation_rps": max([rps for rps in passing if not failing or rps < failing[0]], default=None),
+        "first_saturated_rps": failing[0] if failing else None,
+    }
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
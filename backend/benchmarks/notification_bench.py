@@ -0,0 +1,265 @@
+"""⏱️ Microbenchmark ของ NotificationService บน FCM / Firestore ปลอมในเครื่อง
+
+รันจากโฟลเดอร์ backend:
+    python -m benchmarks.notification_bench --output bench.json
+    python -m benchmarks.notification_bench --suite send --sizes 1,10,100 --fcm-latency 0.02
+
+วัด 3 ชุด:
+- send      : send_fcm_notification กับ token 1 / 10 / 100 / 1k / 10k ตัว
+- cleanup   : ต้นทุนการลบ token ที่ใช้ไม่ได้ (เวลา + จำนวน read / write ของ Firestore)
+- reminders : notify_appointments_tomorrow กับนัดหมาย 10k รายการ
+             (messaging.send_each ถูกแทนด้วยตัวปลอมที่หน่วง --fcm-latency ต่อ batch)
+
+ผลลัพธ์เป็น JSON (stdout หรือ --output) พร้อม commit / ค่าพารามิเตอร์ เพื่อเทียบข้ามเวอร์ชัน
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_fcm import start_fake_fcm
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.stubs import SERVICE_ACCOUNT_PATH, install_stubs, seed_users
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """🔇 ปิด print ระหว่างจับเวลา (print ต่อ token ทำให้ terminal กลายเป็นคอขวด)"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timings_summary(samples):
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples) * 1000, 2),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_send(service, fcm, sizes, repeat, silent):
+    """📨 send_fcm_notification กับ token หลายขนาด (token ทั้งหมดใช้ได้)"""
+    results = []
+    for size in sizes:
+        tokens = [f"bench-token-{size}-{i}" for i in range(size)]
+        samples = []
+        fcm.reset_counters()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with quiet(silent):
+                service.send_fcm_notification(tokens, "bench", "bench", {"type": "BENCH"}, role="Bench", recipient_id="bench")
+            samples.append(time.perf_counter() - started)
+        summary = timings_summary(samples)
+        summary.update({
+            "tokens": size,
+            "tokens_per_second": round(size / percentile(samples, 50), 1),
+            "fcm_calls": fcm.requests,
+        })
+        results.append(summary)
+        print(f"📨 send {size:>6} tokens: p50 {summary['p50_ms']} ms ({summary['tokens_per_second']} tokens/s)", file=sys.stderr)
+    return results
+
+
+def bench_cleanup(service, store, fcm, size, dead_ratio, repeat, silent):
+    """🧹 ส่งไปยัง token ที่มีบางส่วนใช้ไม่ได้ แล้ววัดต้นทุนการลบออกจาก User + ดัชนี FcmTokens"""
+    dead_count = max(1, int(size * dead_ratio))
+    samples = []
+    cleanup_samples = []
+    reads = writes = 0
+    for run in range(repeat):
+        tokens = [f"cleanup-{run}-{i}" for i in range(size)]
+        dead = tokens[:dead_count]
+        # ผู้ใช้ละ 5 token เพื่อให้ ArrayRemove ต่อผู้ใช้มีหลาย token
+        users = {}
+        for i, token in enumerate(dead):
+            users.setdefault(f"cleanup-user-{run}-{i // 5}", []).append(token)
+        store.seed("User", {uid: {"role": "Patient", "fcm_token": ts} for uid, ts in users.items()})
+        store.seed("FcmTokens", {t: {"user_ids": [uid]} for uid, ts in users.items() for t in ts})
+        fcm.dead_tokens = set(dead)
+
+        reads_before, writes_before = store.reads, store.writes
+        started = time.perf_counter()
+        with quiet(silent):
+            service.send_fcm_notification(tokens, "bench", "bench", role="Bench", recipient_id="bench")
+        samples.append(time.perf_counter() - started)
+        reads += store.reads - reads_before
+        writes += store.writes - writes_before
+
+        # วัดเฉพาะขั้นตอนลบแยกอีกครั้ง (token ชุดเดิมถูกลบไปแล้ว จึงใส่กลับก่อน)
+        store.seed("User", {uid: {"role": "Patient", "fcm_token": ts} for uid, ts in users.items()})
+        store.seed("FcmTokens", {t: {"user_ids": [uid]} for uid, ts in users.items() for t in ts})
+        started = time.perf_counter()
+        with quiet(silent):
+            service.token_index.remove_tokens(dead)
+        cleanup_samples.append(time.perf_counter() - started)
+
+    fcm.dead_tokens = set()
+    result = {
+        "tokens": size,
+        "dead_tokens": dead_count,
+        "send_with_cleanup": timings_summary(samples),
+        "cleanup_only": timings_summary(cleanup_samples),
+        "firestore_reads_per_run": reads // repeat,
+        "firestore_writes_per_run": writes // repeat,
+    }
+    print(
+        f"🧹 cleanup {dead_count} dead / {size} tokens: send+cleanup p50 {result['send_with_cleanup']['p50_ms']} ms, "
+        f"cleanup p50 {result['cleanup_only']['p50_ms']} ms",
+        file=sys.stderr,
+    )
+    return result
+
+
+class _FakeSendResponse:
+    def __init__(self, success):
+        self.success = success
+        self.exception = None
+
+
+class _FakeBatchResponse:
+    def __init__(self, responses):
+        self.responses = responses
+        self.success_count = sum(1 for r in responses if r.success)
+        self.failure_count = len(responses) - self.success_count
+
+
+def fake_send_each(latency, error_rate):
+    def send_each(messages, dry_run=False, app=None):
+        if latency:
+            time.sleep(latency)
+        return _FakeBatchResponse([_FakeSendResponse(random.random() >= error_rate) for _ in messages])
+    return send_each
+
+
+def bench_reminders(store, appointments, shards, fcm_latency, error_rate, repeat, silent):
+    """⏰ notify_appointments_tomorrow กับนัดหมายจำนวนมาก (ผู้ป่วย 1 คนต่อ 2 นัด)"""
+    from firebase_admin import messaging
+    from services.notification import notify_upcoming_appointments as reminders
+
+    messaging.send_each = fake_send_each(fcm_latency, error_rate)
+
+    tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+    day = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 9, 0)
+    patients = max(1, appointments // 2)
+    store.seed("User", {
+        f"reminder-patient-{i}": {"role": "Patient", "fcm_token": [f"reminder-token-{i}"]} for i in range(patients)
+    })
+    rnd = random.Random(0)
+    alphabet = reminders.AUTO_ID_ALPHABET
+    store.seed("Appointments", {
+        "".join(rnd.choice(alphabet) for _ in range(20)): {
+            "patient_id": f"reminder-patient-{i % patients}",
+            "appointment_date": day,
+            "appointment_time": f"{8 + i % 8:02d}:00",
+        }
+        for i in range(appointments)
+    })
+
+    samples = []
+    stats = None
+    for _ in range(repeat):
+        # ลบ lease ของรอบก่อน ไม่งั้นทุก shard จะถูกข้ามเพราะเสร็จไปแล้ว
+        with store._lock:
+            store._data.pop("Leases", None)
+        started = time.perf_counter()
+        with quiet(silent):
+            stats = reminders.notify_appointments_tomorrow(shards=shards)
+        samples.append(time.perf_counter() - started)
+
+    result = timings_summary(samples)
+    result.update({"appointments": appointments, "shards": shards, "last_run": stats})
+    print(f"⏰ reminders {appointments} appointments / {shards} shards: p50 {result['p50_ms']} ms", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=("all", "send", "cleanup", "reminders"), default="all")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="token counts for the send suite")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fcm-latency", type=float, default=0.02, help="seconds per fake FCM call / send_each batch")
+    parser.add_argument("--fcm-error-rate", type=float, default=0.0, help="random error rate of the fake FCM server")
+    parser.add_argument("--firestore-latency", type=float, default=0.002, help="seconds per fake Firestore RPC")
+    parser.add_argument("--cleanup-tokens", type=int, default=1000)
+    parser.add_argument("--dead-ratio", type=float, default=0.1)
+    parser.add_argument("--appointments", type=int, default=10000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true", help="keep the service's print output")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    random.seed(0)
+    silent = not args.verbose
+    if silent:
+        # log ของ service เขียนจาก thread เบื้องหลังลง stdout โดยตรง (quiet() ปิดไม่ได้) จึงเหลือไว้เฉพาะที่ผิดพลาด
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+    fcm = start_fake_fcm(latency=args.fcm_latency, error_rate=args.fcm_error_rate)
+    store = FakeFirestore(latency=args.firestore_latency)
+    seed_users(store)
+    install_stubs(store, fcm.url)
+
+    from services.notification.notification_service import NotificationService
+    with quiet(silent):
+        service = NotificationService(store, SERVICE_ACCOUNT_PATH)
+
+    results = {
+        "benchmark": "notification_service",
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+    }
+    if args.suite in ("all", "send"):
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        results["send"] = bench_send(service, fcm, sizes, args.repeat, silent)
+    if args.suite in ("all", "cleanup"):
+        results["cleanup"] = bench_cleanup(service, store, fcm, args.cleanup_tokens, args.dead_ratio, args.repeat, silent)
+    if args.suite in ("all", "reminders"):
+        results["reminders"] = bench_reminders(
+            store, args.appointments, args.shards, args.fcm_latency, args.fcm_error_rate, args.repeat, silent
+        )
+
+    with quiet(silent):
+        service.notification_log.flush()
+    fcm.shutdown()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
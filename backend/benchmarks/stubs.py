@@ -0,0 +1,81 @@
+"""🧪 ต่อ main.py / asgi.py เข้ากับ Firestore และ FCM ปลอม (ต้องเรียกก่อน import แอป)"""
+import os
+import tempfile
+
+from benchmarks.fake_firestore import FakeAsyncFirestore, run_transactional
+from services import registry
+
+SERVICE_ACCOUNT_PATH = registry.SERVICE_ACCOUNT_PATH
+
+
+class StaticTokenProvider:
+    """🔑 token provider ที่คืน token คงที่ (ไม่เรียก Google)"""
+
+    credentials = None
+
+    def cached_token(self):
+        return "fake-access-token"
+
+    def get_token(self):
+        return "fake-access-token"
+
+
+class _TopicManagementResponse:
+    success_count = 0
+    failure_count = 0
+    errors = ()
+
+
+def _fake_topic_management(tokens, topic, app=None):
+    return _TopicManagementResponse()
+
+
+def _fake_verify_id_token(id_token, app=None, check_revoked=False):
+    # ID token ปลอมคือ uid ของผู้เรียกตรง ๆ (ส่ง Authorization: Bearer <uid>)
+    return {"uid": id_token}
+
+
+def install_stubs(store, fcm_url):
+    """🔌 ให้แอปใช้ store (FakeFirestore) และ FCM ปลอมที่ fcm_url แทนบริการจริง"""
+    os.environ["FCM_ENDPOINT"] = fcm_url
+    os.environ.setdefault("NOTIFICATION_OUTBOX_ENABLED", "0")
+    os.environ.setdefault(
+        "NOTIFICATION_OUTBOX_PATH", os.path.join(tempfile.mkdtemp(prefix="medibridge-bench-"), "outbox.sqlite3")
+    )
+
+    from firebase_admin import auth
+    from firebase_admin import firestore as admin_firestore
+    from firebase_admin import messaging
+
+    # ทุก module ได้ client จาก registry จึงแทนที่ที่ registry ที่เดียว
+    registry.override("credentials", None)
+    registry.override("firebase_app", None)
+    registry.override("firestore", store)
+    registry.override("async_firestore", FakeAsyncFirestore(store))
+    registry.override("token_provider", StaticTokenProvider())
+
+    admin_firestore.transactional = lambda fn: (lambda transaction, *args: run_transactional(transaction, fn, *args))
+    auth.verify_id_token = _fake_verify_id_token
+    messaging.subscribe_to_topic = _fake_topic_management
+    messaging.unsubscribe_from_topic = _fake_topic_management
+
+
+def seed_users(store, staff=20, patients=1000, doctors=50, tokens_per_user=1):
+    """🌱 สร้างผู้ใช้ตัวอย่างพร้อม FCM token และนัดหมายหนึ่งรายการต่อผู้ป่วย"""
+    users = {}
+    for role, count, prefix in (("Staff", staff, "staff"), ("Patient", patients, "patient"), ("Doctor", doctors, "doctor")):
+        for i in range(count):
+            user_id = f"{prefix}-{i}"
+            users[user_id] = {
+                "role": role,
+                "first_name": f"{prefix}{i}",
+                "last_name": "bench",
+                "fcm_token": [f"token-{user_id}-{n}" for n in range(tokens_per_user)],
+            }
+    store.seed("User", users)
+    # ทะเบียน token ที่ backfill จาก User.fcm_token แล้ว
+    store.seed("FcmTokens", {
+        token: {"user_id": user_id, "user_ids": [user_id], "role": data["role"]}
+        for user_id, data in users.items() for token in data["fcm_token"]
+    })
+    return users
@@ -1,76 +1,391 @@
 # main.py
-from flask import Flask, request, jsonify
-from firebase_admin import credentials, firestore, messaging
+from services import registry
+from flask import Flask, Response, g, request, jsonify, make_response
+from firebase_admin import firestore, messaging
 from services.notification.schedule_notification import ScheduleNotification
 from services.notification.payment_notification import PaymentNotification
 from services.notification.notification_service import NotificationService
 from services.notification.appointment_notification import AppointmentNotification
+from services.notification.batch_notification import BATCH_MAX_ITEMS, BatchNotification
+from services.notification.notification_history import (
+    InvalidHistoryRequest, NotificationHistory, etag_matches, parse_page_args,
+)
+from services.notification.notification_retention import NOTIFICATION_RETENTION_DAYS, archive_old_notifications
 from datetime import datetime
-import firebase_admin
 from apscheduler.schedulers.background import BackgroundScheduler
+from services.notification.outbox import NotificationOutbox
+from services.notification.staff_digest import get_staff_digest
+from services.notification.messages import schedule_updated_message
+from services.common.auth import AuthError, verify_bearer_token
+from services.common.circuit_breaker import CircuitOpenError, breakers_snapshot
+from services.common.fan_out import FanOut, first_error
+from services.common.idempotency import IdempotencyConflict, IdempotencyInProgress, get_idempotency_store
+from services.common.metrics import CONTENT_TYPE, REQUEST_LATENCY, register_cache, register_gauge, render_metrics
+from functools import wraps
 import atexit
+import math
+import os
+import time
 
-# ✅ Initialize Firebase
-service_account_path = "config/medi-bridge-app-firebase-adminsdk-iew3q-c1f0b31f28.json"
-cred = credentials.Certificate(service_account_path)
-firebase_admin.initialize_app(cred)
-# ใช้ firestore.Client.from_service_account_json เพื่อเชื่อมต่อ (ตรวจสอบ path ให้ถูกต้อง)
-db = firestore.Client.from_service_account_json(service_account_path)
+# ✅ Firebase app / Firestore client / credentials มาจาก registry กลาง (โหลดไฟล์ service account ครั้งเดียว)
+service_account_path = registry.SERVICE_ACCOUNT_PATH
+db = registry.firestore_client()
 
 # ✅ สร้าง Notification Services
-notification_service = NotificationService(db, service_account_path)
-appointment_notification = AppointmentNotification(db, service_account_path)
-payment_notification = PaymentNotification(db, service_account_path)
-schedule_notification = ScheduleNotification(db, service_account_path)
+with registry.timed("notification_services"):
+    notification_service = NotificationService(db, service_account_path)
+    appointment_notification = AppointmentNotification(db, service_account_path, notification_service)
+    payment_notification = PaymentNotification(db, service_account_path, notification_service)
+    schedule_notification = ScheduleNotification(db, service_account_path, notification_service)
+    batch_notification = BatchNotification(notification_service)
+    notification_history = NotificationHistory(db)
+
+# ✅ เริ่มฟัง token ของเจ้าหน้าที่ไว้ล่วงหน้า เพื่อให้ broadcast ไม่ต้องอ่าน Firestore
+with registry.timed("staff_listeners"):
+    notification_service.staff_directory.start()
+    # ✅ ให้ token ของเจ้าหน้าที่ subscribe topic ไว้ เพื่อส่ง broadcast ด้วยข้อความเดียว (STAFF_BROADCAST_MODE=topic)
+    if notification_service.staff_topic is not None:
+        notification_service.staff_topic.start()
+        atexit.register(notification_service.staff_topic.stop)
+    # ✅ แจ้งเตือนเจ้าหน้าที่ที่รอรวมเป็น digest: รับเหตุการณ์ที่ค้างจาก process ก่อนหน้ามาส่งต่อ และส่งทันทีตอนปิด process
+    get_staff_digest(notification_service).start()
+    atexit.register(get_staff_digest(notification_service).stop)
+
+# ✅ คิวงานแจ้งเตือน (SQLite) ให้ route ตอบ 202 ได้ทันทีแล้วให้ worker ส่งต่อ
+# ตั้ง NOTIFICATION_OUTBOX_ENABLED=0 เพื่อให้ route ทำงานแบบเดิม (รอส่งเสร็จก่อนตอบ)
+OUTBOX_ENABLED = os.environ.get("NOTIFICATION_OUTBOX_ENABLED", "1") == "1"
+outbox = NotificationOutbox()
 
 # นำเข้าฟังก์ชันสำหรับแจ้งเตือนนัดหมายล่วงหน้า (Background Job)
 from services.notification.notify_upcoming_appointments import notify_appointments_tomorrow
+from services.notification.reminder_scheduler import ReminderScheduler
 
 app = Flask(__name__)
 
-# ตั้งค่า APScheduler ให้รัน notify_appointments_tomorrow ทุกวันตอน 8:00 AM
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=notify_appointments_tomorrow, trigger='cron', hour=8, minute=0)
-scheduler.start()
-atexit.register(lambda: scheduler.shutdown())
+# =================== Metrics ===================
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # ใช้ rule ของ route (เช่น /jobs/<job_id>) เป็น label เพื่อไม่ให้จำนวน series โตตาม id
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """📊 metrics ในรูปแบบ Prometheus"""
+    body, status = render_metrics()
+    return Response(body, status=status, content_type=CONTENT_TYPE)
+
+# =================== End Metrics ===================
+
+# ✅ แจ้งเตือนนัดหมายล่วงหน้า
+# REMINDER_MODE=scheduler (ค่าเริ่มต้น): เตือนรายนัดก่อนเวลานัด REMINDER_LEAD_HOURS ชั่วโมง ตามการเปลี่ยนแปลงของ Appointments
+# REMINDER_MODE=batch: แบบเดิม รัน notify_appointments_tomorrow ทุกวันตอน 8:00 AM
+REMINDER_MODE = os.environ.get("REMINDER_MODE", "scheduler")
+with registry.timed("reminders"):
+    if REMINDER_MODE == "batch":
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(func=notify_appointments_tomorrow, trigger='cron', hour=8, minute=0)
+        scheduler.start()
+        atexit.register(lambda: scheduler.shutdown())
+    else:
+        reminder_scheduler = ReminderScheduler(db)
+        reminder_scheduler.start()
+        atexit.register(reminder_scheduler.stop)
+        register_gauge('medibridge_reminders_pending', 'Appointment reminders waiting in the scheduler', reminder_scheduler.pending)
+
+# ✅ ย้ายบันทึกแจ้งเตือนที่เก่ากว่า NOTIFICATION_RETENTION_DAYS วันไป NotificationsArchive ทุกวันตอน 3:30 AM
+# (ทุก replica ตั้งเวลาไว้ได้ มีเพียงตัวเดียวที่ได้ lease ของวันนั้น)
+if NOTIFICATION_RETENTION_DAYS > 0:
+    retention_scheduler = BackgroundScheduler()
+    retention_scheduler.add_job(func=archive_old_notifications, trigger='cron', hour=3, minute=30)
+    retention_scheduler.start()
+    atexit.register(lambda: retention_scheduler.shutdown())
+
+# =================== Job Handlers ===================
+# แต่ละ handler รับ payload แล้วคืน (response_dict, http_status)
+# ใช้ได้ทั้งตอนทำทันทีใน route และตอน worker ของ outbox ดึงงานไปทำ
+
+def handle_new_appointment(payload):
+    # ✅ ดึง FCM Tokens ของ Staff
+    tokens = notification_service.get_staff_tokens()
+
+    if not tokens:
+        return {"success": False, "error": "No valid FCM tokens found"}, 400
+
+    # ✅ ส่ง Notification และบันทึกลง Firestore (ผ่าน topic ของเจ้าหน้าที่ ถ้าพร้อม)
+    notification_service.send_staff_broadcast(
+        payload['title'],
+        payload['body'],
+        {"appointment_id": payload['appointment_id'], "type": "NEW_APPOINTMENT"},
+        tokens=tokens
+    )
+    return {"success": True, "message": "Notification sent to staff"}, 200
+
+APPOINTMENT_STATUS_RECIPIENTS = ("patient", "doctor")
+
+def retry_appointment_status(payload, recipient):
+    """🔁 ส่งแจ้งเตือนสถานะนัดหมายซ้ำเฉพาะผู้รับที่ล้มเหลว (เป็นงานใหม่ใน outbox) -> job id หรือ None
+
+    ไม่ส่งซ้ำเมื่อปิด outbox หรือส่งซ้ำครบ outbox.max_attempts รอบแล้ว (นับใน payload['retries'])
+    """
+    retries = payload.get('retries', 0) + 1
+    if not OUTBOX_ENABLED:
+        return None
+    if retries > outbox.max_attempts:
+        print(f"❌ เลิกส่งแจ้งเตือนสถานะนัดหมายถึง {recipient} ซ้ำ (ครบ {outbox.max_attempts} รอบ)")
+        return None
+    job_id = outbox.enqueue("appointment_status", {**payload, "recipients": [recipient], "retries": retries})
+    print(f"🔁 แจ้งเตือนสถานะนัดหมายถึง {recipient} ล้มเหลว ส่งซ้ำเป็นงาน {job_id}")
+    return job_id
+
+def retry_appointment_status_when_failed(payload, result):
+    """⏱️ ฝั่งที่เกิน timeout อาจยังส่งอยู่ จึงไม่นับว่าล้มเหลว รอผลจริงแล้วค่อยส่งซ้ำถ้าล้ม"""
+    def done(future):
+        if future.cancelled() or future.exception() is not None:
+            print(f"❌ แจ้งเตือน {result.name} ล้มเหลวหลังเกินเวลา: {None if future.cancelled() else future.exception()}")
+            retry_appointment_status(payload, result.name)
+    result.future.add_done_callback(done)
+
+def handle_appointment_status(payload):
+    # ผู้ป่วยและแพทย์ไม่ขึ้นต่อกัน จึงส่งพร้อมกัน (ใช้เวลาเท่าฝั่งที่ช้ากว่า)
+    # payload['recipients'] (ถ้ามี) คือฝั่งที่ต้องส่ง ใช้ตอนส่งซ้ำเฉพาะฝั่งที่ล้มเหลว
+    recipients = payload.get('recipients') or APPOINTMENT_STATUS_RECIPIENTS
+    senders = {
+        "patient": (appointment_notification.notify_patient_about_appointment_status, payload['patient_id']),
+        "doctor": (appointment_notification.notify_doctor_about_appointment_status, payload['doctor_id']),
+    }
+    fan_out = FanOut()
+    for recipient in recipients:
+        sender, recipient_id = senders[recipient]
+        fan_out.submit(recipient, sender, recipient_id, payload['status'],
+                       payload['appointment_date'], payload['appointment_time'])
+    return appointment_status_response(payload, fan_out.wait())
+
+def appointment_status_response(payload, results):
+    """📋 สรุปผลต่อฝั่ง ({name: BranchResult}) เป็น (response_dict, http_status) ใช้ร่วมกับ asgi.py"""
+    sent = [result.name for result in results.values() if result.ok]
+    failed = [result for result in results.values() if not result.ok and not result.timed_out]
+    timed_out = [result for result in results.values() if result.timed_out]
+    for result in failed:
+        print(f"❌ แจ้งเตือน {result.name} ล้มเหลว: {result.error}")
+    if failed and len(failed) == len(results):
+        # ล้มทุกฝั่ง: raise เหมือนเดิม (route ตอบ 500 / 503, outbox ลองทั้งงานใหม่)
+        raise first_error(results)
+    if not sent and timed_out:
+        # ไม่มีฝั่งใดเสร็จเลย: ตอบ 504 ให้ outbox / client ลองทั้งงานใหม่ (จึงไม่แยกส่งซ้ำรายฝั่งอีก)
+        print(f"⏱️ แจ้งเตือนสถานะนัดหมายไม่เสร็จทันเวลา: {', '.join(result.name for result in timed_out)}")
+        return {
+            "success": False,
+            "message": "No notification finished in time",
+            "failed": [result.name for result in failed],
+            "timed_out": [result.name for result in timed_out],
+        }, 504
+
+    for result in timed_out:
+        retry_appointment_status_when_failed(payload, result)
+    retry_jobs = {result.name: retry_appointment_status(payload, result.name) for result in failed}
+    if not failed and not timed_out:
+        return {"success": True, "message": f"Notification sent to {' and '.join(results)}"}, 200
+    response = {
+        "success": not failed,
+        "sent": sent,
+        "failed": [result.name for result in failed],
+        # ฝั่งที่เกินเวลาอาจยังส่งอยู่ ถ้าล้มภายหลังจะถูกส่งซ้ำเป็นงานแยก
+        "timed_out": [result.name for result in timed_out],
+    }
+    if any(retry_jobs.values()):
+        response["retry_jobs"] = retry_jobs
+    # ฝั่งที่ล้มถูกส่งซ้ำเป็นงานแยกแล้ว งานนี้จึงจบได้โดยไม่ส่งฝั่งที่สำเร็จซ้ำ
+    return response, 207 if failed else 202
+
+def handle_payment_due(payload):
+    payment_notification.notify_patient_about_payment_due(payload['patient_id'], payload['amount'])
+    return {"success": True, "message": "Payment due notification sent to patient"}, 200
+
+def handle_staff_payment_upload(payload):
+    payment_notification.notify_staff_about_patient_payment(
+        payload['patient_id'], payload['appointment_id'], payload['slip_url']
+    )
+    return {"success": True, "message": "Notification sent to staff"}, 200
+
+def handle_payment_status(payload):
+    payment_notification.notify_patient_about_payment_status(
+        payload['patient_id'], payload['appointment_id'], payload['status']
+    )
+    return {"success": True, "message": "Notification sent to patient"}, 200
+
+def handle_schedule_change_request(payload):
+    doctor_id = payload['doctor_id']
+    schedule_date = datetime.fromisoformat(payload['schedule_date'])
+    schedule_time = payload['schedule_time']
+
+    # เจ้าหน้าที่และแพทย์ไม่ขึ้นต่อกัน จึงส่งพร้อมกัน
+    results = FanOut().submit(
+        "staff", schedule_notification.notify_staff_about_schedule_change_request,
+        doctor_id, schedule_date, schedule_time, payload['reason']
+    ).submit(
+        "doctor", schedule_notification.notify_doctor_about_request_submission,
+        doctor_id, schedule_date.strftime('%d %B %Y'), schedule_time
+    ).wait()
+    staff_success = results["staff"].ok and results["staff"].value
+    doctor_success = results["doctor"].ok and results["doctor"].value
+
+    if staff_success and doctor_success:
+        return {"success": True, "message": "Notification sent to staff and doctor"}, 200
+    elif staff_success:
+        return {"success": False, "message": "Sent to staff only, doctor notification failed"}, 207
+    elif doctor_success:
+        return {"success": False, "message": "Sent to doctor only, staff notification failed"}, 207
+
+    error = first_error(results)
+    if isinstance(error, CircuitOpenError):
+        raise error
+    if error is not None:
+        print(f"❌ แจ้งเตือนคำร้องขอเปลี่ยนตารางเวรล้มเหลว: {error}")
+    return {"success": False, "message": "Failed to send notifications"}, 500
+
+def handle_doctor_schedule_updated(payload):
+    doctor_id = payload['doctor_id']
+    schedule_date = datetime.fromisoformat(payload['schedule_date'])
+    start_time = payload['start_time']
+    end_time = payload['end_time']
+
+    doctor_doc = notification_service.get_document('User', doctor_id)
+    if not doctor_doc.exists:
+        return {"success": False, "error": "Doctor not found"}, 404
+
+    doctor_data = doctor_doc.to_dict()
+    fcm_tokens = notification_service.get_user_tokens(doctor_id, doctor_data)
+    if not fcm_tokens:
+        print(f"⚠️ ไม่มี FCM token สำหรับแพทย์ {doctor_id}")
+        return {"success": False, "error": "No FCM tokens found"}, 400
+
+    title, body, data = schedule_updated_message(schedule_date, start_time, end_time)
+
+    notification_service.send_fcm_notification(
+        fcm_tokens,
+        title,
+        body,
+        data,
+        role="Doctor",
+        recipient_id=doctor_id
+    )
+
+    print(f"✅ แจ้งเตือนแพทย์ {doctor_id} สำเร็จ และบันทึกใน Firestore")
+    return {"success": True, "message": "Notification sent to doctor"}, 200
+
+def handle_notification_batch(payload):
+    results = batch_notification.notify(payload['items'])
+    succeeded = sum(1 for result in results if result['success'])
+    summary = {"total": len(results), "succeeded": succeeded, "failed": len(results) - succeeded}
+    # ผลรวมไม่ใช่ 5xx แม้ทุกรายการล้ม เพื่อไม่ให้ outbox ลองทั้งงานใหม่ (รายการที่ส่งแล้วจะถูกส่งซ้ำ)
+    status = 200 if succeeded == len(results) else 207
+    return {"success": status == 200, "summary": summary, "results": results}, status
+
+JOB_HANDLERS = {
+    "new_appointment": handle_new_appointment,
+    "appointment_status": handle_appointment_status,
+    "payment_due": handle_payment_due,
+    "staff_payment_upload": handle_staff_payment_upload,
+    "payment_status": handle_payment_status,
+    "schedule_change_request": handle_schedule_change_request,
+    "doctor_schedule_updated": handle_doctor_schedule_updated,
+    "notification_batch": handle_notification_batch,
+}
+
+for job_kind, job_handler in JOB_HANDLERS.items():
+    outbox.register(job_kind, job_handler)
+
+if OUTBOX_ENABLED:
+    outbox.start()
+    atexit.register(outbox.stop)
+    register_gauge('medibridge_outbox_depth', 'Notification jobs pending or running in the outbox', outbox.depth)
+
+def submit_job(kind, payload):
+    """📮 ส่งงานเข้า outbox แล้วตอบ 202 พร้อม job id (หรือทำทันทีถ้าปิด outbox)"""
+    if not OUTBOX_ENABLED:
+        try:
+            result, status = JOB_HANDLERS[kind](payload)
+        except CircuitOpenError as e:
+            # ⛔ FCM / Firestore ล่มอยู่: ตอบ 503 ทันทีแทนการให้ thread ค้างรอ timeout
+            response = jsonify({"success": False, "error": str(e)})
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+            return response, 503
+        return jsonify(result), status
+
+    job_id = outbox.enqueue(kind, payload)
+    response = jsonify({"success": True, "job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+# =================== End Job Handlers ===================
+
+# ✅ กันแจ้งเตือนซ้ำเมื่อแอป retry POST เดิมด้วย header Idempotency-Key (จำผลไว้ใน Firestore ใช้ร่วมกันทุก replica)
+idempotency_store = get_idempotency_store(db)
+register_cache('documents', notification_service.document_cache.stats)
+register_cache('idempotency', idempotency_store.stats)
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+def idempotent(view):
+    """🔁 request ที่ Idempotency-Key ซ้ำจะได้คำตอบเดิมโดยไม่ส่งแจ้งเตือนอีกรอบ (ผล 5xx ไม่ถูกจำ, ไม่มี key = ไม่กันซ้ำ)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def handler():
+            response = make_response(view(*args, **kwargs))
+            headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            return response.get_data(), response.status_code, headers
+
+        try:
+            (body, status, headers), replayed = idempotency_store.run(
+                request.path, request.headers.get('Idempotency-Key'), request.get_data(), handler
+            )
+        except IdempotencyConflict as e:
+            return jsonify({"success": False, "error": str(e)}), 422
+        except IdempotencyInProgress as e:
+            response = jsonify({"success": False, "error": str(e)})
+            response.headers["Retry-After"] = "1"
+            return response, 409
+        except CircuitOpenError as e:
+            # ⛔ Firestore ล่มอยู่ อ่าน / ถือ key ไม่ได้: ตอบ 503 ให้ client ลองใหม่ (ยังไม่ได้ส่งแจ้งเตือน)
+            response = jsonify({"success": False, "error": str(e)})
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+            return response, 503
+
+        response = Response(body, status=status, headers=headers)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    return wrapper
 
 # =================== Routes ===================
 
 @app.route('/new-appointment-notification', methods=['POST'])
+@idempotent
 def new_appointment_notification():
     try:
         data = request.json
-        appointment_id = data.get('appointment_id')
-        title = data.get('title')
-        body = data.get('body')
-
-        # ✅ ดึง FCM Tokens ของ Staff
-        staff_docs = db.collection('User').where('role', '==', 'Staff').stream()
-        tokens = []
-        for doc in staff_docs:
-            user_data = doc.to_dict()
-            tokens.extend(user_data.get('fcm_token', []))
-
-        if not tokens:
-            return jsonify({"success": False, "error": "No valid FCM tokens found"}), 400
-
-        # ✅ ส่ง Notification และบันทึกลง Firestore
-        notification_service.send_fcm_notification(
-            tokens,
-            title,
-            body,
-            {"appointment_id": appointment_id, "type": "NEW_APPOINTMENT"},
-            role="Staff",
-            recipient_id="all_staff"
-        )
-
-        return jsonify({"success": True, "message": "Notification sent to staff"}), 200
+        return submit_job("new_appointment", {
+            "appointment_id": data.get('appointment_id'),
+            "title": data.get('title'),
+            "body": data.get('body'),
+        })
 
     except Exception as e:
         print(f"❌ Exception: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/appointment-status-notification', methods=['POST'])
+@idempotent
 def appointment_status_notification():
     try:
         data = request.json
@@ -83,21 +398,20 @@ def appointment_status_notification():
         if not patient_id or not doctor_id or not appointment_date or not appointment_time:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
-        # ส่งแจ้งเตือนและบันทึก
-        appointment_notification.notify_patient_about_appointment_status(
-            patient_id, status, appointment_date, appointment_time
-        )
-        appointment_notification.notify_doctor_about_appointment_status(
-            doctor_id, status, appointment_date, appointment_time
-        )
-
-        return jsonify({"success": True, "message": "Notification sent to patient and doctor"}), 200
+        return submit_job("appointment_status", {
+            "patient_id": patient_id,
+            "doctor_id": doctor_id,
+            "status": status,
+            "appointment_date": appointment_date,
+            "appointment_time": appointment_time,
+        })
 
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/payment-due-notification', methods=['POST'])
+@idempotent
 def payment_due_notification():
     try:
         data = request.json
@@ -107,14 +421,14 @@ def payment_due_notification():
         if not patient_id or not amount:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
-        payment_notification.notify_patient_about_payment_due(patient_id, amount)
-        return jsonify({"success": True, "message": "Payment due notification sent to patient"}), 200
+        return submit_job("payment_due", {"patient_id": patient_id, "amount": amount})
 
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/notify-staff-payment-upload', methods=['POST'])
+@idempotent
 def notify_staff_payment_upload():
     try:
         data = request.json
@@ -125,28 +439,32 @@ def notify_staff_payment_upload():
         if not appointment_id or not patient_id or not slip_url:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
-        payment_notification.notify_staff_about_patient_payment(patient_id, appointment_id, slip_url)
-        return jsonify({"success": True, "message": "Notification sent to staff"}), 200
+        return submit_job("staff_payment_upload", {
+            "patient_id": patient_id,
+            "appointment_id": appointment_id,
+            "slip_url": slip_url,
+        })
 
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/notify-payment-status', methods=['POST'])
+@idempotent
 def notify_payment_status():
     try:
         data = request.json
-        patient_id = data.get('patient_id')
-        appointment_id = data.get('appointment_id')
-        status = data.get('status')
-
-        payment_notification.notify_patient_about_payment_status(patient_id, appointment_id, status)
-        return jsonify({"success": True, "message": "Notification sent to patient"}), 200
+        return submit_job("payment_status", {
+            "patient_id": data.get('patient_id'),
+            "appointment_id": data.get('appointment_id'),
+            "status": data.get('status'),
+        })
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/notify-schedule-change-request', methods=['POST'])
+@idempotent
 def notify_schedule_change_request():
     try:
         data = request.json
@@ -159,31 +477,23 @@ def notify_schedule_change_request():
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
         try:
-            schedule_date = datetime.fromisoformat(schedule_date_str)
+            datetime.fromisoformat(schedule_date_str)
         except ValueError:
             return jsonify({"success": False, "error": "Invalid date format"}), 400
 
-        staff_success = schedule_notification.notify_staff_about_schedule_change_request(
-            doctor_id, schedule_date, schedule_time, reason
-        )
-        doctor_success = schedule_notification.notify_doctor_about_request_submission(
-            doctor_id, schedule_date.strftime('%d %B %Y'), schedule_time
-        )
-
-        if staff_success and doctor_success:
-            return jsonify({"success": True, "message": "Notification sent to staff and doctor"}), 200
-        elif staff_success:
-            return jsonify({"success": False, "message": "Sent to staff only, doctor notification failed"}), 207
-        elif doctor_success:
-            return jsonify({"success": False, "message": "Sent to doctor only, staff notification failed"}), 207
-        else:
-            return jsonify({"success": False, "message": "Failed to send notifications"}), 500
+        return submit_job("schedule_change_request", {
+            "doctor_id": doctor_id,
+            "schedule_date": schedule_date_str,
+            "schedule_time": schedule_time,
+            "reason": reason,
+        })
 
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/notify-doctor-schedule-updated', methods=['POST'])
+@idempotent
 def notify_doctor_schedule_updated():
     try:
         data = request.json
@@ -196,61 +506,136 @@ def notify_doctor_schedule_updated():
             return jsonify({"success": False, "error": "Missing required fields"}), 400
 
         try:
-            schedule_date = datetime.fromisoformat(schedule_date_str)
+            datetime.fromisoformat(schedule_date_str)
         except ValueError:
             return jsonify({"success": False, "error": "Invalid date format"}), 400
 
-        doctor_doc = db.collection('User').document(doctor_id).get()
-        if not doctor_doc.exists:
-            return jsonify({"success": False, "error": "Doctor not found"}), 404
-
-        doctor_data = doctor_doc.to_dict()
-        fcm_tokens = doctor_data.get('fcm_token', [])
-        if not fcm_tokens:
-            print(f"⚠️ ไม่มี FCM token สำหรับแพทย์ {doctor_id}")
-            return jsonify({"success": False, "error": "No FCM tokens found"}), 400
-
-        title = "📅 ตารางเวรถูกเปลี่ยนแปลง"
-        body = (
-            f"ตารางเวรของคุณถูกเปลี่ยนเป็น "
-            f"วันที่ {schedule_date.strftime('%d %B %Y')} "
-            f"เวลา {start_time} - {end_time} "
-            "โปรดตรวจสอบรายละเอียด"
-        )
+        return submit_job("doctor_schedule_updated", {
+            "doctor_id": doctor_id,
+            "schedule_date": schedule_date_str,
+            "start_time": start_time,
+            "end_time": end_time,
+        })
 
-        notification_service.send_fcm_notification(
-            fcm_tokens,
-            title,
-            body,
-            {
-                "type": "SCHEDULE_UPDATED",
-                "schedule_date": schedule_date.strftime('%Y-%m-%d'),
-                "start_time": start_time,
-                "end_time": end_time,
-            },
-            role="Doctor",
-            recipient_id=doctor_id
-        )
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # db.collection("Notifications").add({
-        #     "recipient_id": doctor_id,
-        #     "role": "Doctor",
-        #     "title": title,
-        #     "body": body,
-        #     "timestamp": datetime.now(),
-        #     "type": "SCHEDULE_UPDATED",
-        #     "status": "sent"
-        # })
+@app.route('/notifications/batch', methods=['POST'])
+@idempotent
+def notifications_batch():
+    """📦 แจ้งเตือนหลายรายการ (ต่างชนิดกันได้) ในครั้งเดียว แทนการเรียก route ทีละรายการ"""
+    try:
+        data = request.json
+        items = data.get('items') if isinstance(data, dict) else None
 
-        print(f"✅ แจ้งเตือนแพทย์ {doctor_id} สำเร็จ และบันทึกใน Firestore")
-        return jsonify({"success": True, "message": "Notification sent to doctor"}), 200
+        if not isinstance(items, list) or not items:
+            return jsonify({"success": False, "error": "items must be a non-empty list"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"success": False, "error": f"Too many items (max {BATCH_MAX_ITEMS})"}), 400
+
+        return submit_job("notification_batch", {"items": items})
 
     except Exception as e:
         print(f"❌ Error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/notifications', methods=['GET'])
+def notifications_history():
+    """📜 ประวัติแจ้งเตือนของผู้รับทีละหน้า (?recipient_id=&role=&limit=&cursor=) พร้อม ETag / 304
+
+    ต้องแนบ Firebase ID token (Authorization: Bearer ...) ดูได้เฉพาะของตัวเอง ยกเว้นเจ้าหน้าที่ (role Staff)
+    """
+    try:
+        caller = verify_bearer_token(request.headers.get('Authorization'))
+    except AuthError as e:
+        return jsonify({"success": False, "error": str(e)}), 401
+
+    try:
+        recipient_id, role, limit, cursor = parse_page_args(request.args)
+        if recipient_id != caller:
+            caller_doc = notification_service.get_document('User', caller)
+            if not caller_doc.exists or caller_doc.to_dict().get('role') != 'Staff':
+                return jsonify({"success": False, "error": "Cannot read another user's notifications"}), 403
+        page = notification_history.page(recipient_id, role, limit, cursor)
+    except InvalidHistoryRequest as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except CircuitOpenError as e:
+        response = jsonify({"success": False, "error": str(e)})
+        response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+        return response, 503
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    if etag_matches(request.headers.get('If-None-Match'), page['etag']):
+        response = Response(status=304)
+    else:
+        response = jsonify({"success": True, "notifications": page['items'], "next_cursor": page['next_cursor']})
+    response.headers['ETag'] = page['etag']
+    # ให้ client ตรวจกับ server ทุกครั้ง (ได้ 304 ถ้าไม่มีอะไรใหม่)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/fcm-tokens', methods=['POST'])
+def register_fcm_token():
+    """📲 ลงทะเบียน FCM token ของเครื่องในทะเบียน FcmTokens ({user_id, token, platform?})
+
+    ต้องแนบ Firebase ID token (Authorization: Bearer ...) ของผู้ใช้ user_id เอง
+    """
+    try:
+        caller = verify_bearer_token(request.headers.get('Authorization'))
+    except AuthError as e:
+        return jsonify({"success": False, "error": str(e)}), 401
+
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id')
+        token = data.get('token')
+        platform = data.get('platform')
+
+        if not user_id or not isinstance(token, str) or not token.strip():
+            return jsonify({"success": False, "error": "Missing required fields"}), 400
+        if '/' in token:
+            return jsonify({"success": False, "error": "Invalid token"}), 400
+        if user_id != caller:
+            return jsonify({"success": False, "error": "Cannot register tokens for another user"}), 403
+
+        user_doc = notification_service.get_document('User', user_id)
+        if not user_doc.exists:
+            return jsonify({"success": False, "error": "User not found"}), 404
+
+        notification_service.token_index.register(
+            user_id, [token], role=user_doc.to_dict().get('role'), platform=platform
+        )
+        return jsonify({"success": True}), 200
+
+    except CircuitOpenError as e:
+        response = jsonify({"success": False, "error": str(e)})
+        response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+        return response, 503
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/health/breakers', methods=['GET'])
+def circuit_breakers():
+    """🔌 สถานะ circuit breaker ของแต่ละ dependency (FCM / Firestore)"""
+    return jsonify({"success": True, "breakers": breakers_snapshot()}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """📮 ดูสถานะงานแจ้งเตือนใน outbox"""
+    job = outbox.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "job": job}), 200
+
 # =================== End Routes ===================
 
+# ⏱️ สรุปเวลาที่ใช้ตอน startup (ดู cold start ของแต่ละ replica)
+registry.print_startup_report()
+
 if __name__ == "__main__":
     print("🚀 Starting Flask Server with APScheduler...")
     app.run(host="0.0.0.0", port=5001, debug=True)
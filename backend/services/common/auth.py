@@ -0,0 +1,26 @@
+from firebase_admin import auth
+
+from services import registry
+
+BEARER_PREFIX = 'Bearer '
+
+
+class AuthError(Exception):
+    """🔐 request ไม่มี Firebase ID token หรือ token ใช้ไม่ได้ (ตอบ 401)"""
+
+
+def verify_bearer_token(header):
+    """🔐 ตรวจ Firebase ID token จาก header `Authorization: Bearer <token>` แล้วคืน uid ของผู้เรียก
+
+    token หมดอายุ / ปลอม / ถูกเพิกถอน -> AuthError; ดึง public key ของ Google ไม่ได้ -> exception เดิม (ให้ตอบ 5xx)
+    """
+    if not header or not header.startswith(BEARER_PREFIX):
+        raise AuthError("Missing bearer token")
+    id_token = header[len(BEARER_PREFIX):].strip()
+    if not id_token:
+        raise AuthError("Missing bearer token")
+    try:
+        claims = auth.verify_id_token(id_token, app=registry.firebase_app())
+    except (ValueError, auth.InvalidIdTokenError) as e:
+        raise AuthError(f"Invalid ID token: {e}") from e
+    return claims['uid']
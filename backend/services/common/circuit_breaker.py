@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+
+import requests
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+
+from .metrics import register_gauge
+
+# ค่าเริ่มต้นของทุก breaker (ปรับผ่าน env ได้)
+FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+HALF_OPEN_MAX_CALLS = int(os.environ.get("CIRCUIT_HALF_OPEN_MAX_CALLS", "1"))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# ความล้มเหลวที่บอกว่า dependency มีปัญหาจริง (timeout / ล่ม / ต่อไม่ติด)
+# error อื่นเช่น NotFound, InvalidArgument, PermissionDenied แปลว่า dependency ยังตอบได้ปกติ ไม่นับเข้า breaker
+TRANSIENT_ERRORS = (
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.RetryError,
+    auth_exceptions.TransportError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """⛔ breaker เปิดอยู่ ไม่ได้เรียก dependency (ลองใหม่ได้หลัง retry_after วินาที)"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """🌩️ error นี้ควรนับเป็นความล้มเหลวของ dependency หรือไม่"""
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class CircuitBreaker:
+    """🔌 ตัดวงจรเมื่อ dependency ล้มติดกัน เพื่อให้ request ล้มทันทีแทนการค้างรอ timeout
+
+    - closed: เรียกได้ตามปกติ นับความล้มเหลวที่ติดกัน ครบ failure_threshold -> open
+    - open: ปฏิเสธทุกการเรียกด้วย CircuitOpenError จนครบ reset_timeout -> half_open
+    - half_open: ปล่อยให้ลองได้ half_open_max_calls ครั้ง สำเร็จ -> closed / ล้มเหลว -> open อีกรอบ
+    ผู้เรียกต้องเรียก allow() ก่อน แล้วตามด้วย record_success / record_failure / record_ignored หนึ่งครั้ง
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 half_open_max_calls=HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _retry_after_locked(self, now):
+        return max(0.0, self._opened_at + self.reset_timeout - now)
+
+    def allow(self):
+        """🚪 ขอสิทธิ์เรียก dependency (raise CircuitOpenError ถ้าเปิดอยู่)"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self._retry_after_locked(now))
+                self.state = HALF_OPEN
+                self._probes = 0
+                print(f"🔌 circuit {self.name}: half-open (ลองเรียกใหม่)")
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probes += 1
+
+    def _open_locked(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self.opened_count += 1
+        print(f"⛔ circuit {self.name}: open ({self.failures} failures) ปิดรับ {self.reset_timeout:.0f} วินาที")
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print(f"✅ circuit {self.name}: closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._open_locked(time.monotonic())
+
+    def record_ignored(self):
+        """↩️ ผลที่ไม่บอกอะไรเกี่ยวกับสุขภาพของ dependency (คืน slot ของการลองใน half-open)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def raise_open(self):
+        """⛔ raise CircuitOpenError ด้วยเวลาที่เหลือของ breaker นี้"""
+        with self._lock:
+            retry_after = self._retry_after_locked(time.monotonic()) if self.state == OPEN else self.reset_timeout
+        raise CircuitOpenError(self.name, retry_after)
+
+    def call(self, fn, *args, **kwargs):
+        """📞 เรียก fn ผ่าน breaker: นับเฉพาะ error ชั่วคราว (is_transient) เป็นความล้มเหลว
+
+        error อื่นถูก raise ต่อตามเดิมแต่นับเป็นการตอบกลับปกติของ dependency
+        """
+        self.allow()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_transient(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_after": round(self._retry_after_locked(now), 3) if self.state == OPEN else 0.0,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+            }
+
+
+def get_breaker(name, **options):
+    """♻️ คืน CircuitBreaker ตัวเดียวต่อชื่อ dependency ทั้ง process (options ใช้ตอนสร้างครั้งแรกเท่านั้น)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **options)
+                _breakers[name] = breaker
+                register_gauge(f'medibridge_circuit_{name}_state', f'{name} circuit state (0 closed, 1 half-open, 2 open)',
+                               lambda: _STATE_VALUES[breaker.state])
+    return breaker
+
+
+def breakers_snapshot():
+    """📋 สถานะของทุก breaker {name: {...}} สำหรับ endpoint monitoring"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
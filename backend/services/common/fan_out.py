@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from .circuit_breaker import CircuitOpenError
+from .metrics import register_gauge
+
+# pool กลางที่ทุก request ใช้แตกงานย่อย (จำกัดจำนวน thread รวมทั้ง process)
+FANOUT_MAX_WORKERS = int(os.environ.get("FANOUT_MAX_WORKERS", "32"))
+# เวลารอสูงสุดของแต่ละงานย่อย (วินาที นับจากตอน submit)
+FANOUT_BRANCH_TIMEOUT = float(os.environ.get("FANOUT_BRANCH_TIMEOUT", "30"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_active = 0
+_active_lock = threading.Lock()
+
+
+class BranchTimeout(TimeoutError):
+    """⏱️ งานย่อยทำไม่เสร็จภายในเวลาที่กำหนด (งานยังทำต่อใน pool แต่ request ไม่รอแล้ว)"""
+
+    def __init__(self, name, timeout):
+        super().__init__(f"{name} did not finish within {timeout:.1f}s")
+        self.name = name
+        self.timeout = timeout
+
+
+class BranchResult:
+    """📋 ผลของงานย่อยหนึ่งงาน: value (ถ้าสำเร็จ) หรือ error (exception ที่เกิดขึ้น / BranchTimeout)
+
+    งานที่เกิน timeout ยังทำต่ออยู่ future ของงานนั้นเก็บไว้ใน future ให้ผู้เรียกตามผลจริงภายหลังได้
+    """
+
+    def __init__(self, name, value=None, error=None, elapsed=0.0, future=None):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+        self.future = future
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def timed_out(self):
+        return isinstance(self.error, BranchTimeout)
+
+
+def get_fan_out_executor():
+    """♻️ คืน ThreadPoolExecutor กลางสำหรับแตกงานย่อยของ request"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fan-out")
+                register_gauge('medibridge_fanout_active', 'Request sub-tasks currently running in the fan-out pool',
+                               lambda: _active)
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    global _active
+    with _active_lock:
+        _active += 1
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        with _active_lock:
+            _active -= 1
+
+
+class FanOut:
+    """🔀 แตกงานย่อยที่ไม่ขึ้นต่อกันของ request หนึ่งให้ทำพร้อมกันบน pool กลาง แล้วรอผลรวม
+
+    route จึงใช้เวลาเท่างานที่ช้าที่สุดแทนผลรวมของทุกงาน
+    exception ของงานย่อยไม่หลุดออกมาเอง ผู้เรียกตัดสินจาก BranchResult (และ first_error)
+    """
+
+    def __init__(self, timeout=FANOUT_BRANCH_TIMEOUT, executor=None):
+        self.timeout = timeout
+        self.executor = executor or get_fan_out_executor()
+        self._branches = []
+
+    def submit(self, name, fn, *args, **kwargs):
+        """➕ เริ่มงานย่อยทันที"""
+        started = time.monotonic()
+        future = self.executor.submit(_run, fn, args, kwargs)
+        self._branches.append((name, future, started))
+        return self
+
+    def wait(self):
+        """⏳ รอทุกงานย่อย -> {name: BranchResult} (งานที่เกิน timeout ได้ error เป็น BranchTimeout)"""
+        results = {}
+        for name, future, started in self._branches:
+            remaining = max(0.0, started + self.timeout - time.monotonic())
+            try:
+                value = future.result(timeout=remaining)
+            except FutureTimeout:
+                results[name] = BranchResult(name, error=BranchTimeout(name, self.timeout),
+                                             elapsed=time.monotonic() - started, future=future)
+            except Exception as e:
+                results[name] = BranchResult(name, error=e, elapsed=time.monotonic() - started)
+            else:
+                results[name] = BranchResult(name, value=value, elapsed=time.monotonic() - started)
+        return results
+
+
+def first_error(results):
+    """🔎 error ของงานย่อยที่ควรรายงาน (CircuitOpenError ก่อน เพื่อให้ตอบ 503 / เลื่อนงาน) หรือ None ถ้าไม่มีงานใดล้ม"""
+    errors = [result.error for result in results.values() if not result.ok]
+    for error in errors:
+        if isinstance(error, CircuitOpenError):
+            return error
+    return errors[0] if errors else None
@@ -0,0 +1,170 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from services.registry import FIRESTORE_TIMEOUT
+from .circuit_breaker import get_breaker
+from .lease import ACQUIRED, DONE, FirestoreLease
+from .metrics import record_firestore
+from .ttl_cache import TTLCache
+
+# collection ที่เก็บผลลัพธ์ตาม idempotency key (ใช้ร่วมกันทุก replica; document id = hash ของ route + key)
+IDEMPOTENCY_COLLECTION = 'IdempotencyKeys'
+# อายุของผลลัพธ์ที่จำไว้ (วินาที) นับจากตอนที่ request แรกทำเสร็จ
+DEFAULT_TTL = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+# request แรกถือ key ไว้ได้นานสุดเท่านี้ (วินาที) ถ้า process ตายระหว่างทำ replica อื่นรับทำต่อได้หลังจากนี้
+DEFAULT_LEASE_SECONDS = float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "60"))
+DEFAULT_MAXSIZE = int(os.environ.get("IDEMPOTENCY_MAXSIZE", "10000"))
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class IdempotencyConflict(Exception):
+    """❗ ใช้ Idempotency-Key เดิมกับ payload คนละชุด"""
+
+
+class IdempotencyInProgress(Exception):
+    """⏳ request แรกของ key นี้ยังทำไม่เสร็จ (อยู่บน replica อื่น) ให้ client ลองใหม่ภายหลัง"""
+
+
+class _Uncacheable(Exception):
+    """ผลลัพธ์ 5xx ที่ไม่ควรจำไว้ (ให้ client retry ได้จริง)"""
+
+    def __init__(self, result):
+        super().__init__("uncacheable result")
+        self.result = result
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def payload_fingerprint(body):
+    """🔏 hash ของ payload แบบไม่ขึ้นกับลำดับ key ใน JSON"""
+    try:
+        canonical = json.dumps(json.loads(body or b"null"), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        canonical = body or b""
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def key_document_id(scope, key):
+    """🔑 document id ของ key (key จาก client อาจมี "/" จึงใช้ hash แทน)"""
+    return hashlib.sha256(f"{scope}\n{key}".encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """🔁 จำผลลัพธ์ของ request ตาม Idempotency-Key เพื่อให้ retry ได้คำตอบเดิมโดยไม่ส่งซ้ำ
+
+    - กันซ้ำเฉพาะ request ที่ client ส่ง Idempotency-Key มาเอง (ไม่เดา key จาก payload
+      เพราะแจ้งเตือนเนื้อหาเดิมที่ตั้งใจส่งซ้ำจะถูกกลืนหายไป)
+    - ผลลัพธ์เก็บใน Firestore (IdempotencyKeys) ผ่าน FirestoreLease จึงกันซ้ำได้ข้าม replica และข้ามการ restart
+      request แรกถือ lease ระหว่างทำ request ที่ key ซ้ำบน replica อื่นได้ IdempotencyInProgress
+    - request ที่ key ซ้ำกันใน process เดียวกันและมาพร้อมกันจะรอผลของตัวแรก (single-flight ผ่าน TTLCache)
+      ผลที่เคยอ่าน / เขียนแล้วแคชไว้ใน process ด้วย จึงไม่ต้องอ่าน Firestore ทุกครั้งที่ replay
+    - จำเฉพาะผลที่ไม่ใช่ 5xx; ผล 5xx ปล่อย lease และไม่เก็บ เพื่อให้ retry ครั้งถัดไปทำงานใหม่
+    เอกสารมี expire_at ให้ TTL policy ของ Firestore ลบทิ้งเอง (fieldOverrides ใน firestore.indexes.json)
+    """
+
+    def __init__(self, db, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.lease = FirestoreLease(db, collection=IDEMPOTENCY_COLLECTION)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._breaker = get_breaker('firestore')
+        self.replays = 0
+
+    def _stored(self, doc_id):
+        """📥 ผลที่ request แรกเก็บไว้ -> (fingerprint, result) หรือ None ถ้าหมดอายุแล้ว"""
+        snapshot = self._breaker.call(self.lease.collection.document(doc_id).get, timeout=FIRESTORE_TIMEOUT)
+        record_firestore(IDEMPOTENCY_COLLECTION, 'read')
+        data = snapshot.to_dict() if snapshot.exists else None
+        if data is None:
+            return None
+        expire_at = data.get('expire_at')
+        if expire_at is not None and expire_at <= _utcnow():
+            # TTL policy ลบเอกสารช้าได้ถึงหนึ่งวัน ถือว่าหมดอายุตาม expire_at เอง
+            return None
+        stored = data.get('result') or {}
+        return stored.get('fingerprint'), tuple(stored.get('response') or ())
+
+    def _load(self, doc_id, fingerprint, handler):
+        """🔒 ถือ key ใน Firestore แล้วเรียก handler หรือคืนผลเดิมที่เก็บไว้ -> (fingerprint, result)"""
+        state = self.lease.try_acquire(doc_id, self.lease_seconds)
+        if state == DONE:
+            stored = self._stored(doc_id)
+            if stored is not None:
+                return stored
+            # ผลเดิมหมดอายุแล้ว ลบทิ้งแล้วถือ key ใหม่
+            self._breaker.call(self.lease.collection.document(doc_id).delete, timeout=FIRESTORE_TIMEOUT)
+            record_firestore(IDEMPOTENCY_COLLECTION, 'write')
+            state = self.lease.try_acquire(doc_id, self.lease_seconds)
+        if state != ACQUIRED:
+            raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+
+        try:
+            result = handler()
+        except Exception:
+            self.lease.release(doc_id)
+            raise
+        if result[1] >= 500:
+            self.lease.release(doc_id)
+            raise _Uncacheable(result)
+        self.lease.complete(
+            doc_id,
+            result={"fingerprint": fingerprint, "response": list(result)},
+            expire_at=_utcnow() + datetime.timedelta(seconds=self.ttl),
+        )
+        return fingerprint, result
+
+    def run(self, scope, key, body, handler):
+        """▶️ คืน (result, replayed) โดย result คือค่าที่ handler คืน (ต้องมี status ที่ index 1)
+
+        scope แยก key ของแต่ละ route; ถ้าไม่มี key จะเรียก handler ตรง ๆ โดยไม่กันซ้ำ
+        result ต้องเก็บลง Firestore ได้ (bytes / ตัวเลข / str / dict)
+        """
+        if not key:
+            return handler(), False
+
+        fingerprint = payload_fingerprint(body)
+        doc_id = key_document_id(scope, key)
+        executed = False
+
+        def execute():
+            nonlocal executed
+            executed = True
+            return handler()
+
+        def load():
+            return self._load(doc_id, fingerprint, execute)
+
+        try:
+            stored_fingerprint, result = self._cache.get_or_load((scope, key), load)
+        except _Uncacheable as e:
+            return e.result, not executed
+
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict(f"Idempotency-Key {key} was already used with a different payload")
+        if not executed:
+            self.replays += 1
+        return result, not executed
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["replays"] = self.replays
+        return stats
+
+
+def get_idempotency_store(db):
+    """🔁 IdempotencyStore ตัวเดียวต่อ Firestore client ทั้ง process"""
+    store = _stores.get(id(db))
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(id(db))
+            if store is None:
+                store = IdempotencyStore(db)
+                _stores[id(db)] = store
+    return store
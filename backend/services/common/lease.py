@@ -0,0 +1,123 @@
+import datetime
+import os
+import socket
+import uuid
+
+from firebase_admin import firestore
+
+from services.registry import FIRESTORE_TIMEOUT
+from .circuit_breaker import get_breaker
+from .metrics import record_firestore
+
+# collection ที่เก็บ lease (document id = ชื่อ lease)
+LEASE_COLLECTION = 'Leases'
+
+# เอกสาร lease มี expire_at ให้ TTL policy ของ Firestore ลบทิ้งเอง (fieldOverrides ใน firestore.indexes.json)
+# ค่าเริ่มต้นคือหลังหมดอายุ lease / หลังงานเสร็จไปแล้วเท่านี้วัน
+LEASE_RETENTION = datetime.timedelta(days=int(os.environ.get("LEASE_RETENTION_DAYS", "7")))
+
+# ผลของ try_acquire
+ACQUIRED = 'acquired'
+HELD = 'held'
+DONE = 'done'
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def default_owner_id():
+    """🪪 ชื่อเจ้าของ lease ที่ไม่ซ้ำกันระหว่างเครื่อง / process"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class FirestoreLease:
+    """🔒 lease บนเอกสาร Firestore ให้มีเพียง process เดียวที่ทำงานชิ้นหนึ่งในช่วงเวลาหนึ่ง
+
+    - try_acquire ใช้ transaction อ่าน-เขียนเอกสาร lease จึงชนะได้เพียงคนเดียว
+    - lease หมดอายุเองถ้าเจ้าของตายระหว่างทำงาน ให้ process อื่นรับช่วงต่อได้
+    - complete ทำเครื่องหมายว่างานเสร็จแล้ว ไม่ให้ใครทำซ้ำอีกแม้ lease จะหมดอายุ
+    - ทุกเอกสารมี expire_at สำหรับ TTL policy จึงไม่สะสมใน collection ไปเรื่อย ๆ
+    - ทุกการเรียก Firestore ผ่าน breaker 'firestore' และมี FIRESTORE_TIMEOUT (ล่มอยู่ -> CircuitOpenError ทันที)
+    ใช้ Firestore emulator แทนได้ด้วย FIRESTORE_EMULATOR_HOST
+    """
+
+    def __init__(self, db, collection=LEASE_COLLECTION, owner=None):
+        self.db = db
+        self.collection_name = collection
+        self.collection = db.collection(collection)
+        self.owner = owner or default_owner_id()
+        self._breaker = get_breaker('firestore')
+
+    def _acquire(self, name, ttl, renewing):
+        ref = self.collection.document(name)
+        owner = self.owner
+
+        def acquire(transaction):
+            snapshot = ref.get(transaction=transaction, timeout=FIRESTORE_TIMEOUT)
+            record_firestore(self.collection_name, 'read')
+            data = snapshot.to_dict() if snapshot.exists else None
+            now = _utcnow()
+            if data is not None:
+                if data.get('state') == DONE:
+                    return DONE
+                expires_at = data.get('expires_at')
+                alive = expires_at is not None and expires_at > now
+                if renewing:
+                    # ต่ออายุได้เฉพาะเจ้าของเดิม
+                    if data.get('owner') != owner:
+                        return HELD
+                elif alive:
+                    # lease ที่ยังไม่หมดอายุแย่งไม่ได้ แม้แต่ thread อื่นใน process เดียวกัน
+                    return HELD
+            elif renewing:
+                return HELD
+            expires_at = now + datetime.timedelta(seconds=ttl)
+            transaction.set(ref, {
+                "owner": owner,
+                "state": HELD,
+                "expires_at": expires_at,
+                "expire_at": expires_at + LEASE_RETENTION,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            })
+            record_firestore(self.collection_name, 'write')
+            return ACQUIRED
+
+        return self._breaker.call(firestore.transactional(acquire), self.db.transaction())
+
+    def try_acquire(self, name, ttl):
+        """🔑 พยายามถือ lease ชื่อ name เป็นเวลา ttl วินาที -> ACQUIRED / HELD / DONE"""
+        return self._acquire(name, ttl, renewing=False)
+
+    def renew(self, name, ttl):
+        """🔁 ต่ออายุ lease ที่ถืออยู่ (คืน False ถ้าเสีย lease ไปแล้ว)"""
+        return self._acquire(name, ttl, renewing=True) == ACQUIRED
+
+    def release(self, name):
+        """🔓 ปล่อย lease ที่ถืออยู่ ให้ process อื่นรับงานนี้ต่อได้ทันที"""
+        ref = self.collection.document(name)
+        owner = self.owner
+
+        def release(transaction):
+            snapshot = ref.get(transaction=transaction, timeout=FIRESTORE_TIMEOUT)
+            record_firestore(self.collection_name, 'read')
+            if snapshot.exists and snapshot.to_dict().get('owner') == owner:
+                transaction.delete(ref)
+                record_firestore(self.collection_name, 'write')
+
+        self._breaker.call(firestore.transactional(release), self.db.transaction())
+
+    def complete(self, name, result=None, expire_at=None):
+        """✅ บันทึกว่างานของ lease นี้เสร็จแล้ว (พร้อมผลลัพธ์ถ้ามี)
+
+        expire_at คือเวลาที่ไม่ต้องกันงานซ้ำแล้ว (ให้ TTL ลบเอกสารได้) ค่าเริ่มต้นคืออีก LEASE_RETENTION
+        """
+        self._breaker.call(self.collection.document(name).set, {
+            "owner": self.owner,
+            "state": DONE,
+            "result": result or {},
+            "expire_at": expire_at or _utcnow() + LEASE_RETENTION,
+            "completed_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }, timeout=FIRESTORE_TIMEOUT)
+        record_firestore(self.collection_name, 'write')
@@ -0,0 +1,161 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+from .metrics import register_gauge
+
+# 📝 log แบบมีโครงสร้างผ่านคิว: thread ของ request แค่ใส่ record ลงคิว แล้ว thread เบื้องหลังเขียนลง stdout
+# LOG_FORMAT=json (ค่าเริ่มต้น) หรือ text สำหรับอ่านด้วยตาตอนพัฒนา
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# คิวเต็มเมื่อไรจะทิ้ง record แทนการให้ request รอ (นับจำนวนที่ทิ้งไว้ใน metric)
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# อัตราสุ่มเก็บบรรทัดที่ "สำเร็จ" ของ event ที่เกิดต่อ token (0-1); บรรทัดที่ล้มเหลวเก็บทุกบรรทัดเสมอ
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get("LOG_SUCCESS_SAMPLE_RATE", "0.01"))
+# กำหนดอัตราแยกต่อ event ได้ เช่น "fcm.sent=0.1,reminder.sent=1"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+
+ROOT_LOGGER = "medibridge"
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+def _parse_sample_rates(spec):
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        try:
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            print(f"⚠️ LOG_SAMPLE_RATES ไม่ถูกต้อง: {item}")
+    return rates
+
+
+_sample_rates = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+class JsonFormatter(logging.Formatter):
+    """🧾 หนึ่ง record ต่อหนึ่งบรรทัด JSON (ts, level, logger, event, message + ฟิลด์เพิ่มเติม)"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """📄 ข้อความเดิมตามด้วย key=value ของฟิลด์"""
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        extra = " ".join(f"{key}={value}" for key, value in fields.items())
+        line = f"{record.getMessage()} {extra}".rstrip()
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """📥 ใส่ record ลงคิวแบบไม่รอ ถ้าคิวเต็มก็ทิ้งและนับไว้"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # ไม่ต้อง format ข้อความบน thread ของ request: เก็บ args ไว้ให้ writer format เอง
+        record.exc_text = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """🔧 ตั้งค่า logger "medibridge" ให้ส่ง record ผ่านคิวไปยัง writer เบื้องหลัง (เรียกซ้ำได้)"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        _queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, stream)
+        _listener.start()
+        atexit.register(_listener.stop)
+        register_gauge('medibridge_log_records_dropped', 'Log records dropped because the log queue was full',
+                       lambda: _queue_handler.dropped)
+
+
+def get_logger(name):
+    """🪵 คืน logger ลูกของ "medibridge" (ตั้งค่าคิวให้ในครั้งแรก)"""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def redact_token(token):
+    """🙈 ย่อ FCM token ให้เหลือหัวท้าย พอใช้ไล่ปัญหาได้โดยไม่เปิดเผย token เต็ม"""
+    if not token:
+        return token
+    token = str(token)
+    if len(token) <= 12:
+        return f"{token[:3]}…"
+    return f"{token[:6]}…{token[-4:]}"
+
+
+def redact_tokens(tokens, limit=3):
+    """🙈 สรุปรายการ token เป็น {count, sample} แทนการ log ทั้งรายการ"""
+    tokens = list(tokens or [])
+    return {"count": len(tokens), "sample": [redact_token(t) for t in tokens[:limit]]}
+
+
+def sample_rate(event):
+    return _sample_rates.get(event, LOG_SUCCESS_SAMPLE_RATE)
+
+
+def log_event(logger, event, message, level=logging.INFO, sampled=False, **fields):
+    """📝 log หนึ่ง event พร้อมฟิลด์ ถ้า sampled=True จะสุ่มเก็บตาม sample_rate(event)
+
+    ระดับ WARNING ขึ้นไปไม่ถูกสุ่มทิ้งเสมอ; บรรทัดที่ถูกสุ่มจะมีฟิลด์ sample_rate ไว้คำนวณกลับเป็นจำนวนจริง
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sampled and level < logging.WARNING:
+        rate = sample_rate(event)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        fields["sample_rate"] = rate
+    logger.log(level, message, extra={"event": event, "fields": fields})
@@ -0,0 +1,141 @@
+import threading
+
+# prometheus_client เป็น dependency เสริม: ถ้าไม่ได้ติดตั้ง metric ทุกตัวจะเป็น no-op และ /metrics ตอบ 503
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # pragma: no cover - ขึ้นกับ environment
+    REGISTRY = None
+
+METRICS_ENABLED = REGISTRY is not None
+CONTENT_TYPE = CONTENT_TYPE_LATEST if METRICS_ENABLED else "text/plain; charset=utf-8"
+
+# bucket (วินาที) ครอบคลุมตั้งแต่ตอบจากแคชไปจนถึง fan-out ขนาดใหญ่
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if METRICS_ENABLED:
+    REQUEST_LATENCY = Histogram(
+        'medibridge_http_request_duration_seconds', 'HTTP request latency by route',
+        ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+    )
+    FCM_LATENCY = Histogram(
+        'medibridge_fcm_request_duration_seconds', 'FCM HTTP v1 call latency by response status',
+        ['status'], buckets=LATENCY_BUCKETS,
+    )
+    FIRESTORE_OPERATIONS = Counter(
+        'medibridge_firestore_operations_total', 'Firestore document reads / writes by collection',
+        ['collection', 'operation'],
+    )
+    REMINDER_DURATION = Histogram(
+        'medibridge_reminder_job_duration_seconds', 'Appointment reminder run duration',
+        ['mode'], buckets=JOB_BUCKETS,
+    )
+    STAFF_DIGEST_EVENTS = Counter(
+        'medibridge_staff_digest_events_total', 'Staff notification events by how they were delivered',
+        ['kind', 'delivery'],
+    )
+else:
+    REQUEST_LATENCY = FCM_LATENCY = FIRESTORE_OPERATIONS = REMINDER_DURATION = STAFF_DIGEST_EVENTS = _NoopMetric()
+
+
+def record_firestore(collection, operation, count=1):
+    """🔥 นับการอ่าน (read) / เขียน (write) เอกสาร Firestore ของ collection"""
+    if count:
+        FIRESTORE_OPERATIONS.labels(collection, operation).inc(count)
+
+
+def record_staff_digest(kind, delivery, count=1):
+    """📬 นับเหตุการณ์แจ้งเตือนเจ้าหน้าที่ (delivery = immediate / single / digest / dropped)"""
+    if count:
+        STAFF_DIGEST_EVENTS.labels(kind, delivery).inc(count)
+
+
+def observe_fcm(status, seconds):
+    """📡 บันทึกเวลาเรียก FCM หนึ่งครั้ง (status = HTTP status หรือ "error")"""
+    FCM_LATENCY.labels(str(status)).observe(seconds)
+
+
+class _CallbackCollector:
+    """📊 ค่าที่อ่านตอน scrape (ความยาวคิว, สถิติแคช) จึงไม่มีต้นทุนบน hot path"""
+
+    def __init__(self):
+        self._gauges = []
+        self._caches = []
+        self._lock = threading.Lock()
+
+    def add_gauge(self, name, documentation, fn):
+        with self._lock:
+            self._gauges.append((name, documentation, fn))
+
+    def add_cache(self, cache_name, stats_fn):
+        with self._lock:
+            self._caches.append((cache_name, stats_fn))
+
+    def collect(self):
+        with self._lock:
+            gauges = list(self._gauges)
+            caches = list(self._caches)
+
+        for name, documentation, fn in gauges:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"⚠️ อ่านค่า metric {name} ไม่ได้: {e}")
+                continue
+            yield GaugeMetricFamily(name, documentation, value=value)
+
+        if not caches:
+            return
+        hits = CounterMetricFamily('medibridge_cache_hits', 'Cache hits', labels=['cache'])
+        misses = CounterMetricFamily('medibridge_cache_misses', 'Cache misses', labels=['cache'])
+        ratio = GaugeMetricFamily('medibridge_cache_hit_ratio', 'Cache hit ratio since start', labels=['cache'])
+        size = GaugeMetricFamily('medibridge_cache_entries', 'Entries currently cached', labels=['cache'])
+        for cache_name, stats_fn in caches:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"⚠️ อ่านสถิติแคช {cache_name} ไม่ได้: {e}")
+                continue
+            hits.add_metric([cache_name], stats.get('hits', 0))
+            misses.add_metric([cache_name], stats.get('misses', 0))
+            ratio.add_metric([cache_name], stats.get('hit_rate', 0.0))
+            size.add_metric([cache_name], stats.get('size', 0))
+        yield hits
+        yield misses
+        yield ratio
+        yield size
+
+
+_collector = _CallbackCollector()
+if METRICS_ENABLED:
+    REGISTRY.register(_collector)
+
+
+def register_gauge(name, documentation, fn):
+    """📏 ลงทะเบียน gauge ที่อ่านค่าจาก fn() ตอน scrape"""
+    _collector.add_gauge(name, documentation, fn)
+
+
+def register_cache(cache_name, stats_fn):
+    """🗃️ ลงทะเบียนแคช (stats_fn คืน dict แบบ TTLCache.stats) ให้ export hit / miss / hit ratio"""
+    _collector.add_cache(cache_name, stats_fn)
+
+
+def render_metrics():
+    """📤 คืน (body, status) ในรูปแบบ Prometheus text format"""
+    if not METRICS_ENABLED:
+        return b"prometheus_client is not installed\n", 503
+    return generate_latest(REGISTRY), 200
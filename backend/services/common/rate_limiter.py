@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+# รอ slot ว่างได้ครั้งละไม่เกินนี้ (วินาที) แล้วตรวจใหม่ เผื่อ limit ถูกขยายหรือ pause หมดเวลา
+MAX_WAIT_STEP = 0.05
+
+# ผลลัพธ์ที่ส่งกลับมาให้ limiter ปรับตัว
+SUCCESS = 'success'
+OVERLOADED = 'overloaded'
+IGNORED = 'ignored'
+
+
+class RateLimitTimeout(Exception):
+    """⏱️ รอ token / slot ของ limiter เกินเวลาที่กำหนด (ผู้เรียกควรถือว่าเป็นปัญหาชั่วคราวแล้วลองใหม่ภายหลัง)"""
+
+
+class AdaptiveRateLimiter:
+    """🚦 token bucket (จำกัดจำนวน request ต่อวินาที) + จำนวนพร้อมกันแบบ AIMD ใช้ร่วมกันทุก sender
+
+    - ทุก request ต้องได้ทั้ง token จาก bucket และ slot ของ concurrency ก่อนยิง
+    - สำเร็จ: ขยาย limit ทีละน้อย (+1 ต่อหนึ่งรอบของ limit) / โดนจำกัด (429, 503): ลด limit ลงครึ่งหนึ่ง
+      (ลดได้ครั้งเดียวต่อ decrease_cooldown เพื่อไม่ให้ request ที่ค้างอยู่ชุดเดียวกันกด limit ลงซ้ำ ๆ)
+    - release(..., retry_after) หยุดทุก sender ตาม Retry-After ที่ server บอก แต่ไม่เกิน max_pause วินาที
+      (Retry-After ที่ยาวผิดปกติค่าเดียวจะได้ไม่หยุดการส่งทั้ง process)
+    ใช้ได้ทั้งจาก thread (acquire) และ asyncio (acquire_async)
+    """
+
+    def __init__(self, rate, burst=None, max_concurrency=64, min_concurrency=1,
+                 initial_concurrency=None, decrease_factor=0.5, decrease_cooldown=1.0, max_pause=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.limit = float(initial_concurrency or self.max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.max_pause = max_pause
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _try_acquire_locked(self, now):
+        """คืน 0 ถ้าได้สิทธิ์แล้ว ไม่เช่นนั้นคืนเวลาที่ควรรอก่อนลองใหม่ (วินาที)"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return MAX_WAIT_STEP
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self, timeout=None):
+        """⏳ รอจนได้ token และ slot (block thread) ไม่เกิน timeout วินาที (None = ไม่จำกัด)
+
+        raise RateLimitTimeout ถ้ายังไม่ได้สิทธิ์เมื่อครบ timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._try_acquire_locked(now)
+                if wait <= 0:
+                    return
+                if deadline is not None:
+                    if now >= deadline:
+                        raise RateLimitTimeout(f"No FCM send slot within {timeout:.1f}s")
+                    wait = min(wait, deadline - now)
+                self._cond.wait(min(wait, MAX_WAIT_STEP))
+
+    async def acquire_async(self, timeout=None):
+        """⏳ เหมือน acquire แต่รอด้วย asyncio.sleep (ไม่ block event loop)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                wait = self._try_acquire_locked(now)
+            if wait <= 0:
+                return
+            if deadline is not None:
+                if now >= deadline:
+                    raise RateLimitTimeout(f"No FCM send slot within {timeout:.1f}s")
+                wait = min(wait, deadline - now)
+            await asyncio.sleep(min(wait, MAX_WAIT_STEP))
+
+    def release(self, outcome=SUCCESS, retry_after=None):
+        """✅ คืน slot พร้อมบอกผล เพื่อปรับ limit (และหยุดทุก sender ตาม retry_after ถ้ามี)"""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if outcome == OVERLOADED:
+                self.throttled += 1
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif outcome == SUCCESS:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+            if retry_after:
+                if self.max_pause is not None:
+                    retry_after = min(retry_after, self.max_pause)
+                self._paused_until = max(self._paused_until, now + retry_after)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+            }
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class _InFlight:
+    """⏳ งานโหลดค่าที่กำลังทำอยู่ ให้ thread อื่นที่ขอ key เดียวกันรอผลร่วมกัน"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """🗃️ แคชแบบจำกัดขนาด (LRU) ที่แต่ละค่ามีอายุ (TTL) และรวม miss ที่ซ้ำกันเป็นการโหลดครั้งเดียว"""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    def _get_locked(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _set_locked(self, key, value, ttl, now):
+        self._data[key] = (value, now + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key, time.monotonic())
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set_locked(key, value, ttl, time.monotonic())
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader, ttl=None):
+        """🔁 คืนค่าจากแคช ถ้าไม่มีให้เรียก loader (thread ที่ขอ key เดียวกันจะรอผลเดียวกัน)"""
+        with self._lock:
+            value = self._get_locked(key, time.monotonic())
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = _InFlight()
+                self._inflight[key] = pending
+                owner = True
+            else:
+                self.merged += 1
+                owner = False
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+            with self._lock:
+                self._set_locked(key, pending.value, ttl, time.monotonic())
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.done.set()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "merged": self.merged,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -1,73 +1,69 @@
+import logging
+
+from services.common.log import get_logger, log_event
 from .notification_service import NotificationService
+from .messages import new_appointment_message, appointment_status_message
+
+logger = get_logger("appointment")
 
 class AppointmentNotification:
-    def __init__(self, db, service_account_file):
-        self.notification_service = NotificationService(db, service_account_file)
+    def __init__(self, db, service_account_file, notification_service=None):
+        self.notification_service = notification_service or NotificationService(db, service_account_file)
 
     def notify_new_appointment(self, appointment_id, appointment_date, appointment_time):
         """🔔 แจ้งเตือนเจ้าหน้าที่เมื่อมีนัดหมายใหม่ และบันทึก"""
-        staff_docs = self.notification_service.db.collection('User').where('role', '==', 'Staff').stream()
-        tokens = []
-        staff_ids = []
-        for doc in staff_docs:
-            tokens.extend(doc.to_dict().get('fcm_token', []))
-            staff_ids.append(doc.id)
+        tokens = self.notification_service.get_staff_tokens()
 
-        title = "🔔 แจ้งเตือน: นัดหมายใหม่"
-        body = f"มีนัดหมายใหม่ วันที่ {appointment_date} เวลา {appointment_time} กรุณาตรวจสอบ"
+        title, body, data = new_appointment_message(appointment_id, appointment_date, appointment_time)
 
-        # ✅ ส่ง Notification พร้อมบันทึกแจ้งเตือนให้ทุกสตาฟ
-        self.notification_service.send_fcm_notification(tokens, title, body, 
-            {"appointment_id": appointment_id}, 
-            role="Staff", 
-            recipient_id="all_staff")
+        # ✅ ส่ง Notification พร้อมบันทึกแจ้งเตือนให้ทุกสตาฟ (ผ่าน topic ถ้าพร้อม)
+        self.notification_service.send_staff_broadcast(title, body, data, tokens=tokens)
 
     def notify_patient_about_appointment_status(self, patient_id, status, appointment_date, appointment_time):
-        print(f"📌 [DEBUG] กำลังเตรียมส่งแจ้งเตือนให้ผู้ป่วย: {patient_id}")
-
         """🔔 แจ้งเตือนผู้ป่วยเมื่อสถานะนัดหมายเปลี่ยน"""
-        patient_doc = self.notification_service.db.collection('User').document(patient_id).get()
+        log_event(logger, "appointment.notify_patient", f"📌 กำลังเตรียมส่งแจ้งเตือนให้ผู้ป่วย: {patient_id}",
+                  level=logging.DEBUG, patient_id=patient_id, status=status)
+        patient_doc = self.notification_service.get_document('User', patient_id)
         if not patient_doc.exists:
-            print(f"❌ [DEBUG] ไม่พบข้อมูลผู้ป่วยใน Firestore: {patient_id}")
+            log_event(logger, "appointment.patient_missing", f"❌ ไม่พบข้อมูลผู้ป่วยใน Firestore: {patient_id}",
+                      level=logging.WARNING, patient_id=patient_id)
             return
 
-        tokens = patient_doc.to_dict().get('fcm_token', [])
+        tokens = self.notification_service.get_user_tokens(patient_id, patient_doc.to_dict())
         if not tokens:
             print("⚠️ ไม่มี Token สำหรับผู้ป่วยนี้")
             return
 
-        status_msg = "ได้รับการยืนยันแล้ว" if status == "รอชำระเงิน" else "ถูกยกเลิก"
-        title = "🩺 แจ้งเตือน: สถานะนัดหมาย"
-        body = f"นัดหมายของคุณ {status_msg} วันที่ {appointment_date} เวลา {appointment_time}"
+        title, body, data = appointment_status_message(status, appointment_date, appointment_time)
 
         # ✅ ส่ง Notification พร้อมบันทึกแจ้งเตือน
         self.notification_service.send_fcm_notification(tokens, title, body, 
-            {"status": status}, 
+            data, 
             role="Patient", 
        
             recipient_id=patient_id)
         
     def notify_doctor_about_appointment_status(self, doctor_id, status, appointment_date, appointment_time):
         """🔔 แจ้งเตือนแพทย์เมื่อมีการยืนยันหรือยกเลิกนัดหมาย"""
-        print(f"📌 [DEBUG] กำลังเตรียมส่งแจ้งเตือนให้แพทย์: {doctor_id}")
+        log_event(logger, "appointment.notify_doctor", f"📌 กำลังเตรียมส่งแจ้งเตือนให้แพทย์: {doctor_id}",
+                  level=logging.DEBUG, doctor_id=doctor_id, status=status)
 
-        doctor_doc = self.notification_service.db.collection('User').document(doctor_id).get()
+        doctor_doc = self.notification_service.get_document('User', doctor_id)
         if not doctor_doc.exists:
-            print(f"❌ [DEBUG] ไม่พบข้อมูลแพทย์ใน Firestore: {doctor_id}")
+            log_event(logger, "appointment.doctor_missing", f"❌ ไม่พบข้อมูลแพทย์ใน Firestore: {doctor_id}",
+                      level=logging.WARNING, doctor_id=doctor_id)
             return
 
-        tokens = doctor_doc.to_dict().get('fcm_token', [])
+        tokens = self.notification_service.get_user_tokens(doctor_id, doctor_doc.to_dict())
         if not tokens:
             print("⚠️ ไม่มี Token สำหรับแพทย์นี้")
             return
 
-        status_msg = "ได้รับการยืนยันแล้ว" if status == "รอชำระเงิน" else "ถูกยกเลิก"
-        title = "🩺 แจ้งเตือน: สถานะนัดหมาย"
-        body = f"นัดหมายของคุณ {status_msg} วันที่ {appointment_date} เวลา {appointment_time}"
+        title, body, data = appointment_status_message(status, appointment_date, appointment_time)
 
         # ✅ ส่ง Notification พร้อมบันทึกแจ้งเตือน
         self.notification_service.send_fcm_notification(tokens, title, body, 
-            {"status": status}, 
+            data, 
             role="Doctor", 
             recipient_id=doctor_id)
 
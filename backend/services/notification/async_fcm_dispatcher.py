@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import time
+
+import httpx
+
+from services.common.circuit_breaker import CircuitOpenError, get_breaker
+from services.common.metrics import observe_fcm
+from services.common.rate_limiter import IGNORED, RateLimitTimeout
+
+from .fcm_dispatcher import (
+    DEFAULT_MAX_CONCURRENCY, FCM_ACQUIRE_TIMEOUT, FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT, FCM_SEND_URL, collect_results,
+    get_fcm_rate_limiter, limiter_outcome, raise_if_circuit_open, record_breaker,
+)
+from .fcm_errors import (
+    CIRCUIT_OPEN, FCM_MAX_RETRIES, RATE_LIMITED, RETRY, backoff_delay, classify_response, retry_after_seconds,
+)
+
+# httpcore ไล่ดูทุก connection ใน pool ต่อทุก request ที่รอ ถ้า pool ใหญ่จะช้าแบบกำลังสอง
+# จึงแบ่งเป็นหลาย client ย่อย client ละไม่เกิน 16 connection แล้วกระจายแบบ round-robin
+CONNECTIONS_PER_CLIENT = 16
+
+
+class AsyncFCMDispatcher:
+    """⚡ ส่ง FCM v1 แบบ asyncio ผ่าน httpx.AsyncClient จำกัดจำนวนพร้อมกันด้วย semaphore"""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, endpoint=FCM_SEND_URL, client=None,
+                 limiter=None, max_retries=FCM_MAX_RETRIES, breaker=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.endpoint = endpoint
+        # ✅ limiter ตัวเดียวกับ FCMDispatcher ฝั่ง sync จึงรวม quota ของทั้ง process
+        self.limiter = limiter or get_fcm_rate_limiter()
+        self.max_retries = max_retries
+        self.breaker = breaker or get_breaker('fcm')
+        if client is not None:
+            self.clients = [client]
+        else:
+            shards = -(-self.max_concurrency // CONNECTIONS_PER_CLIENT)
+            per_client = -(-self.max_concurrency // shards)
+            self.clients = [
+                httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=per_client, max_keepalive_connections=per_client),
+                    timeout=httpx.Timeout(FCM_READ_TIMEOUT, connect=FCM_CONNECT_TIMEOUT),
+                )
+                for _ in range(shards)
+            ]
+        self._next_client = itertools.cycle(self.clients)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def post(self, payload, access_token):
+        """📡 ส่ง message เดียวไปยัง FCM (ผ่าน circuit breaker และ rate limiter)
+
+        raise CircuitOpenError ทันทีถ้า breaker ของ FCM เปิดอยู่ และ RateLimitTimeout ถ้ารอ limiter เกิน FCM_ACQUIRE_TIMEOUT
+        """
+        self.breaker.allow()
+        async with self._semaphore:
+            await self.limiter.acquire_async(timeout=FCM_ACQUIRE_TIMEOUT)
+            started = time.perf_counter()
+            try:
+                response = await next(self._next_client).post(
+                    self.endpoint,
+                    headers={
+                        "Authorization": f"Bearer {access_token}",
+                        "Content-Type": "application/json",
+                    },
+                    json=payload,
+                )
+            except httpx.HTTPError:
+                observe_fcm("error", time.perf_counter() - started)
+                self.limiter.release(IGNORED)
+                self.breaker.record_failure()
+                raise
+            observe_fcm(response.status_code, time.perf_counter() - started)
+            self.limiter.release(*limiter_outcome(response))
+            record_breaker(self.breaker, response)
+            return response
+
+    async def send(self, payload, access_token):
+        """🔁 ส่ง message เดียวพร้อม retry (สัญญาเดียวกับ FCMDispatcher.send)"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.post(payload, access_token)
+            except CircuitOpenError:
+                return RETRY, CIRCUIT_OPEN
+            except RateLimitTimeout:
+                return RETRY, RATE_LIMITED
+            except httpx.HTTPError as e:
+                result, code = RETRY, f"NETWORK_ERROR: {e}"
+            else:
+                result, code = classify_response(response.status_code, response.text)
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            if result != RETRY or attempt == self.max_retries:
+                return result, code
+            delay = backoff_delay(attempt, retry_after)
+            if delay is None:
+                return result, code
+            await asyncio.sleep(delay)
+
+    async def send_to_tokens(self, tokens, build_payload, access_token):
+        """📨 ส่งไปทุก token พร้อมกัน แล้วคืน (valid_tokens, invalid_tokens, failed_tokens) ตามลำดับเดิม"""
+        results = list(zip(tokens, await asyncio.gather(
+            *(self.send(build_payload(token), access_token) for token in tokens)
+        )))
+        raise_if_circuit_open(self.breaker, results)
+        return collect_results(results)
+
+    async def aclose(self):
+        for client in self.clients:
+            await client.aclose()
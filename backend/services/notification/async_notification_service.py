@@ -0,0 +1,161 @@
+import asyncio
+import logging
+
+from firebase_admin import firestore
+
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.circuit_breaker import CircuitOpenError, get_breaker, is_transient
+from services.common.log import get_logger, log_event, redact_tokens
+from services.common.ttl_cache import TTLCache
+from .async_fcm_dispatcher import AsyncFCMDispatcher
+from .document_cache import DEFAULT_MAXSIZE, DEFAULT_TTLS, get_document_cache
+from .notification_log import get_notification_log
+from .staff_token_directory import get_staff_token_directory
+from .token_index import get_token_index, normalize_tokens
+from .token_provider import get_token_provider
+
+_MISSING = object()
+
+logger = get_logger("notification")
+
+
+class AsyncNotificationService:
+    """⚡ NotificationService ฉบับ asyncio สำหรับ ASGI app
+
+    - อ่านเอกสารด้วย Firestore AsyncClient (ผ่านแคชแบบเดียวกับฝั่ง sync)
+    - ส่ง FCM ด้วย httpx.AsyncClient
+    - ใช้ staff token directory, ดัชนี token และ notification log ตัวเดียวกับฝั่ง sync
+      (ต้องใช้ Firestore client แบบ sync เพราะ snapshot listener / batch ทำงานบน thread)
+    """
+
+    def __init__(self, async_db, db, service_account_file, dispatcher=None, token_provider=None):
+        self.async_db = async_db
+        self.db = db
+        self.dispatcher = dispatcher or AsyncFCMDispatcher()
+        self.token_provider = token_provider or get_token_provider(service_account_file)
+        self.staff_directory = get_staff_token_directory(db)
+        self.token_index = get_token_index(db)
+        self.notification_log = get_notification_log(db)
+        self.document_cache = get_document_cache(db)
+        self._documents = TTLCache(maxsize=DEFAULT_MAXSIZE, ttl=min(DEFAULT_TTLS.values()))
+        self._inflight = {}
+        self._firestore_breaker = get_breaker('firestore')
+
+    async def _get_access_token(self):
+        token = self.token_provider.cached_token()
+        if token is not None:
+            return token
+        # รีเฟรชจริงเป็นการเรียก network แบบ blocking จึงย้ายไปทำใน thread
+        return await asyncio.to_thread(self.token_provider.get_token)
+
+    async def get_document(self, collection, doc_id):
+        """📄 อ่านเอกสารผ่านแคช; coroutine ที่ขอ key เดียวกันพร้อมกันจะรอการอ่านครั้งเดียว"""
+        key = (collection, doc_id)
+        cached = self._documents.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            self._firestore_breaker.allow()
+            try:
+                snapshot = await self.async_db.collection(collection).document(doc_id).get(timeout=FIRESTORE_TIMEOUT)
+            except Exception as e:
+                if is_transient(e):
+                    self._firestore_breaker.record_failure()
+                else:
+                    self._firestore_breaker.record_success()
+                raise
+            self._firestore_breaker.record_success()
+            self._documents.set(key, snapshot, ttl=DEFAULT_TTLS.get(collection))
+            pending.set_result(snapshot)
+            return snapshot
+        except Exception as e:
+            pending.set_exception(e)
+            # กัน warning "exception was never retrieved" เมื่อไม่มีใครรอ
+            pending.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate_document(self, collection, doc_id):
+        """🧹 ลบเอกสารออกจากแคชทั้งของฝั่ง async และ DocumentCache ของฝั่ง sync (ใน process เดียวกัน)"""
+        self._documents.pop((collection, doc_id))
+        self.document_cache.invalidate(collection, doc_id)
+
+    async def get_user_tokens(self, user_id, user_data=None):
+        """🔑 FCM token ของผู้ใช้ผ่านทะเบียน FcmTokens (ผู้ใช้ที่ยังไม่ได้ migrate ใช้ fcm_token ของเอกสาร User)"""
+        tokens_by_user = await asyncio.to_thread(self.token_index.tokens_for_users, [user_id])
+        if user_id in tokens_by_user:
+            return tokens_by_user[user_id]
+        if user_data is None:
+            snapshot = await self.get_document('User', user_id)
+            user_data = snapshot.to_dict() if snapshot.exists else {}
+        return normalize_tokens(user_data.get('fcm_token'))
+
+    async def get_staff_tokens(self):
+        """👥 ดึง FCM Token ของเจ้าหน้าที่ (ไม่ block event loop ระหว่างรอ snapshot แรก)"""
+        if self.staff_directory.is_ready():
+            return self.staff_directory.get_tokens()
+        return await asyncio.to_thread(self.staff_directory.get_tokens)
+
+    async def send_fcm_notification(self, tokens, title, body, data=None, role=None, recipient_id=None):
+        """🚀 ส่ง FCM Notification (สัญญาเดียวกับ NotificationService.send_fcm_notification)"""
+        log_event(logger, "fcm.send", f"📡 ส่งแจ้งเตือนสำหรับ {role} - recipient_id: {recipient_id}",
+                  level=logging.DEBUG, role=role, recipient_id=recipient_id, tokens=redact_tokens(tokens or []))
+        tokens = [t for t in dict.fromkeys(tokens or []) if t]
+        if not tokens:
+            log_event(logger, "fcm.no_tokens", "⚠️ ไม่มี FCM token ที่สามารถใช้ได้",
+                      level=logging.WARNING, role=role, recipient_id=recipient_id)
+            return False
+
+        access_token = await self._get_access_token()
+
+        def build_payload(token):
+            return {
+                "message": {
+                    "token": token,
+                    "notification": {"title": title, "body": body},
+                    "data": data or {},
+                    "android": {"priority": "high"}
+                }
+            }
+
+        valid_tokens, invalid_tokens, failed_tokens = await self.dispatcher.send_to_tokens(
+            tokens, build_payload, access_token
+        )
+        self.token_index.record_results(valid_tokens, failed_tokens)
+
+        # 🧹 ลบ Token ที่ใช้ไม่ได้ (เขียน Firestore แบบ batch ใน thread)
+        if invalid_tokens:
+            try:
+                for user_id in await asyncio.to_thread(self.token_index.remove_tokens, invalid_tokens):
+                    self.invalidate_document('User', user_id)
+            except CircuitOpenError as e:
+                log_event(logger, "fcm.cleanup_skipped", "⚠️ ข้ามการลบ token ที่ใช้ไม่ได้ (Firestore circuit เปิดอยู่)",
+                          level=logging.WARNING, invalid=len(invalid_tokens), error=str(e))
+
+        if not valid_tokens:
+            log_event(logger, "fcm.no_valid_tokens", "❌ ไม่มี FCM Token ที่ใช้งานได้", level=logging.ERROR,
+                      role=role, recipient_id=recipient_id, invalid=len(invalid_tokens))
+            return False
+
+        self.notification_log.add({
+            "title": title,
+            "body": body,
+            "data": data or {},
+            "role": role or "Unknown",
+            "recipient_id": recipient_id or "Unknown",
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+        log_event(logger, "notification.queued", f"📝 เพิ่มบันทึกแจ้งเตือนสำหรับ {role} ลงคิวแล้ว",
+                  role=role, recipient_id=recipient_id, sent=len(valid_tokens), invalid=len(invalid_tokens))
+        return True
+
+    async def aclose(self):
+        await self.dispatcher.aclose()
@@ -0,0 +1,218 @@
+import logging
+import os
+from datetime import datetime
+
+from services.common.circuit_breaker import CircuitOpenError
+from services.common.log import get_logger, log_event
+from .staff_digest import get_staff_digest
+from .messages import (
+    appointment_status_message,
+    payment_due_message,
+    payment_status_message,
+    schedule_updated_message,
+    staff_payment_upload_message,
+)
+
+# จำนวนรายการสูงสุดต่อหนึ่ง request ของ /notifications/batch
+BATCH_MAX_ITEMS = int(os.environ.get("NOTIFICATION_BATCH_MAX_ITEMS", "500"))
+
+# ชนิดของรายการที่รองรับ และ field ที่ต้องมี (ชื่อเดียวกับ route แบบทีละรายการ)
+ITEM_FIELDS = {
+    "appointment_status": ("patient_id", "doctor_id", "status", "appointment_date", "appointment_time"),
+    "payment_due": ("patient_id", "amount"),
+    "payment_status": ("patient_id", "appointment_id", "status"),
+    "staff_payment_upload": ("patient_id", "appointment_id", "slip_url"),
+    "doctor_schedule_updated": ("doctor_id", "schedule_date", "start_time", "end_time"),
+}
+# field ที่ถูกใช้เป็น document id ตรง ๆ ต้องเป็น string และห้ามมี "/"
+ID_FIELDS = ("patient_id", "doctor_id", "appointment_id")
+
+logger = get_logger("batch")
+
+
+def validate_item(item):
+    """🔍 ตรวจรายการหนึ่งรายการ คืนข้อความ error หรือ None ถ้าใช้ได้"""
+    if not isinstance(item, dict):
+        return "Item must be an object"
+    fields = ITEM_FIELDS.get(item.get("type"))
+    if fields is None:
+        return f"Unknown notification type: {item.get('type')}"
+    missing = [field for field in fields if not item.get(field)]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    invalid = [field for field in ID_FIELDS
+               if field in fields and (not isinstance(item[field], str) or '/' in item[field])]
+    if invalid:
+        return f"Invalid id fields: {', '.join(invalid)}"
+    if item["type"] == "doctor_schedule_updated":
+        try:
+            datetime.fromisoformat(item["schedule_date"])
+        except (TypeError, ValueError):
+            return "Invalid date format"
+    return None
+
+
+def _referenced_documents(item):
+    """📎 เอกสาร (collection, doc_id) ที่รายการนี้ต้องอ่าน"""
+    keys = [('User', item[field]) for field in ('patient_id', 'doctor_id') if field in ITEM_FIELDS[item["type"]]]
+    if 'appointment_id' in ITEM_FIELDS[item["type"]]:
+        keys.append(('Appointments', item['appointment_id']))
+    return keys
+
+
+class _Failure(Exception):
+    """รายการที่ส่งไม่ได้ พร้อม http status ของรายการนั้น"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class BatchNotification:
+    """📦 แจ้งเตือนหลายรายการ (ต่างชนิดกันได้) ในงานเดียว
+
+    อ่าน User / Appointments ที่ทุกรายการอ้างถึงด้วย get_all ครั้งเดียว (ทีละก้อน) และหา token ของผู้รับทุกคนในคราวเดียว
+    แล้วส่งทุกข้อความพร้อมกันผ่าน NotificationService.send_many แทนการอ่านและส่งทีละรายการ
+    """
+
+    def __init__(self, notification_service):
+        self.notification_service = notification_service
+
+    def _user(self, documents, tokens_by_user, user_id, role):
+        """👤 คืน (tokens, data) ของผู้ใช้จากเอกสารและ token ที่อ่านมาแล้ว"""
+        snapshot = documents[('User', user_id)]
+        if not snapshot.exists:
+            raise _Failure(f"{role} not found: {user_id}", 404)
+        data = snapshot.to_dict()
+        tokens = tokens_by_user.get(user_id, [])
+        if not tokens:
+            raise _Failure(f"No FCM tokens found for {role.lower()} {user_id}", 400)
+        return tokens, data
+
+    def _appointment(self, documents, appointment_id):
+        snapshot = documents[('Appointments', appointment_id)]
+        if not snapshot.exists:
+            raise _Failure(f"Appointment not found: {appointment_id}", 404)
+        return snapshot.to_dict()
+
+    def _direct(self, documents, tokens_by_user, user_id, role, message):
+        tokens, _ = self._user(documents, tokens_by_user, user_id, role)
+        title, body, data = message
+        return {"tokens": tokens, "title": title, "body": body, "data": data, "role": role, "recipient_id": user_id}
+
+    def _plan(self, item, documents, tokens_by_user):
+        """🗺️ แปลงรายการเป็นข้อความที่ต้องส่ง -> list ของ dict หรือ _Failure (ต่อผู้รับ)
+
+        ข้อความที่มี "broadcast" คือแจ้งเตือนเจ้าหน้าที่ทุกคน (ส่งผ่าน StaffDigest)
+        """
+        kind = item["type"]
+        if kind == "appointment_status":
+            message = appointment_status_message(item['status'], item['appointment_date'], item['appointment_time'])
+            plans = []
+            for field, role in (('patient_id', 'Patient'), ('doctor_id', 'Doctor')):
+                try:
+                    plans.append(self._direct(documents, tokens_by_user, item[field], role, message))
+                except _Failure as e:
+                    plans.append(e)
+            return plans
+        if kind == "payment_due":
+            return [self._direct(documents, tokens_by_user, item['patient_id'], 'Patient', payment_due_message(item['amount']))]
+        if kind == "payment_status":
+            appointment_data = self._appointment(documents, item['appointment_id'])
+            message = payment_status_message(item['appointment_id'], appointment_data, item['status'])
+            return [self._direct(documents, tokens_by_user, item['patient_id'], 'Patient', message)]
+        if kind == "staff_payment_upload":
+            snapshot = documents[('User', item['patient_id'])]
+            if not snapshot.exists:
+                raise _Failure(f"Patient not found: {item['patient_id']}", 404)
+            appointment_data = self._appointment(documents, item['appointment_id'])
+            title, body, data = staff_payment_upload_message(
+                item['patient_id'], snapshot.to_dict(), appointment_data, item['slip_url'],
+                appointment_id=item['appointment_id'],
+            )
+            return [{"broadcast": True, "title": title, "body": body, "data": data}]
+        # doctor_schedule_updated
+        message = schedule_updated_message(
+            datetime.fromisoformat(item['schedule_date']), item['start_time'], item['end_time']
+        )
+        return [self._direct(documents, tokens_by_user, item['doctor_id'], 'Doctor', message)]
+
+    def notify(self, items):
+        """🚀 ส่งทุกรายการ แล้วคืนผลต่อรายการตามลำดับเดิม
+
+        raise CircuitOpenError ถ้า Firestore / FCM ล่มก่อนที่จะส่งได้สักรายการ (ให้ทั้งงานลองใหม่ได้อย่างปลอดภัย)
+        """
+        service = self.notification_service
+        results = [None] * len(items)
+        valid = []
+        for i, item in enumerate(items):
+            error = validate_item(item)
+            if error:
+                results[i] = {"success": False, "status": 400, "error": error}
+            else:
+                valid.append(i)
+
+        # 📚 อ่านทุกเอกสารที่อ้างถึงในครั้งเดียว (ซ้ำกันก็อ่านครั้งเดียว)
+        documents = service.document_cache.get_many(
+            [key for i in valid for key in _referenced_documents(items[i])]
+        )
+
+        # 🔑 หา token ของผู้รับทุกคนผ่านทะเบียน FcmTokens ในคราวเดียว
+        recipients = {doc_id for i in valid if items[i]["type"] != "staff_payment_upload"
+                      for collection, doc_id in _referenced_documents(items[i]) if collection == 'User'}
+        users = {doc_id: documents[('User', doc_id)].to_dict() for doc_id in recipients
+                 if documents[('User', doc_id)].exists}
+        tokens_by_user = service.get_tokens_for_users(list(users), users)
+
+        plans = {}
+        for i in valid:
+            try:
+                plans[i] = self._plan(items[i], documents, tokens_by_user)
+            except _Failure as e:
+                plans[i] = [e]
+
+        direct = [(i, plan) for i in valid for plan in plans[i] if isinstance(plan, dict) and not plan.get("broadcast")]
+        sent = dict.fromkeys(range(len(items)), 0)
+        errors = {i: [plan for plan in plans[i] if isinstance(plan, _Failure)] for i in valid}
+
+        # 📨 ส่งข้อความถึงผู้ใช้ทุกคนพร้อมกันในรอบเดียว
+        for (i, plan), ok in zip(direct, service.send_many([plan for _, plan in direct])):
+            if ok:
+                sent[i] += 1
+            else:
+                errors[i].append(_Failure(f"Failed to send notification to {plan['role'].lower()} {plan['recipient_id']}", 500))
+
+        # 📢 แจ้งเตือนเจ้าหน้าที่ (ผ่าน digest: รายการแรกส่งทันที ที่เหลือรวมเป็นข้อความสรุปเมื่อหมดช่วงเวลา)
+        staff_digest = get_staff_digest(service)
+        for i in valid:
+            for plan in plans[i]:
+                if not isinstance(plan, dict) or not plan.get("broadcast"):
+                    continue
+                try:
+                    ok = staff_digest.submit("staff_payment_upload", plan["title"], plan["body"], plan["data"])
+                except CircuitOpenError as e:
+                    # รายการอื่นอาจส่งไปแล้ว จึงไม่ล้มทั้งงาน (ถ้าลองใหม่ทั้งงานจะส่งซ้ำ)
+                    errors[i].append(_Failure(str(e), 503))
+                    continue
+                if ok:
+                    sent[i] += 1
+                else:
+                    errors[i].append(_Failure("Failed to send notification to staff", 500))
+
+        for i in valid:
+            failures = errors[i]
+            if not failures:
+                results[i] = {"success": True, "status": 200, "sent": sent[i]}
+            else:
+                status = 207 if sent[i] else failures[0].status
+                results[i] = {"success": False, "status": status, "sent": sent[i],
+                              "errors": [str(failure) for failure in failures]}
+
+        for i, item in enumerate(items):
+            results[i] = dict(results[i], index=i, type=item.get("type") if isinstance(item, dict) else None)
+
+        succeeded = sum(1 for result in results if result["success"])
+        log_event(logger, "batch.sent", f"📦 ส่งแจ้งเตือนแบบ batch {succeeded}/{len(items)} รายการ",
+                  level=logging.INFO if succeeded == len(items) else logging.WARNING,
+                  items=len(items), succeeded=succeeded, documents=len(documents), messages=len(direct))
+        return results
@@ -0,0 +1,91 @@
+import threading
+from collections import Counter
+
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.circuit_breaker import get_breaker
+from services.common.metrics import record_firestore
+from services.common.ttl_cache import TTLCache
+
+# อายุของเอกสารในแคชแยกตาม collection (วินาที)
+DEFAULT_TTLS = {
+    'User': 60.0,
+    'Appointments': 30.0,
+}
+DEFAULT_MAXSIZE = 4096
+# จำนวนเอกสารต่อการเรียก get_all หนึ่งครั้ง
+GET_ALL_CHUNK_SIZE = 100
+
+_MISSING = object()
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class DocumentCache:
+    """📚 แคชแบบ read-through สำหรับการอ่านเอกสาร User / Appointments ทีละ id"""
+
+    def __init__(self, db, ttls=None, maxsize=DEFAULT_MAXSIZE):
+        self.db = db
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._cache = TTLCache(maxsize=maxsize, ttl=min(self.ttls.values()))
+        self._breaker = get_breaker('firestore')
+
+    def get(self, collection, doc_id):
+        """📄 คืน DocumentSnapshot จากแคช ถ้าไม่มีจึงอ่านจาก Firestore (รวม miss ที่ซ้ำกัน)
+
+        raise CircuitOpenError ทันทีถ้า breaker ของ Firestore เปิดอยู่และเอกสารไม่อยู่ในแคช
+        """
+        def load():
+            record_firestore(collection, 'read')
+            ref = self.db.collection(collection).document(doc_id)
+            return self._breaker.call(ref.get, timeout=FIRESTORE_TIMEOUT)
+
+        return self._cache.get_or_load((collection, doc_id), load, ttl=self.ttls.get(collection))
+
+    def get_many(self, keys):
+        """📚 อ่านหลายเอกสารในครั้งเดียว -> {(collection, doc_id): DocumentSnapshot}
+
+        ที่อยู่ในแคชไม่อ่านซ้ำ ที่เหลืออ่านด้วย get_all ก้อนละ GET_ALL_CHUNK_SIZE แล้วเก็บเข้าแคช
+        (เอกสารที่ไม่มีอยู่ก็ได้ snapshot ที่ exists=False เหมือน get)
+        """
+        result = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            snapshot = self._cache.get(key, _MISSING)
+            if snapshot is _MISSING:
+                missing.append(key)
+            else:
+                result[key] = snapshot
+
+        for i in range(0, len(missing), GET_ALL_CHUNK_SIZE):
+            chunk = missing[i:i + GET_ALL_CHUNK_SIZE]
+            refs = [self.db.collection(collection).document(doc_id) for collection, doc_id in chunk]
+            keys_by_path = {ref.path: key for ref, key in zip(refs, chunk)}
+            for collection, count in Counter(collection for collection, _ in chunk).items():
+                record_firestore(collection, 'read', count)
+            snapshots = self._breaker.call(lambda: list(self.db.get_all(refs, timeout=FIRESTORE_TIMEOUT)))
+            # get_all ไม่รับประกันลำดับ จึงจับคู่กลับด้วย path ของเอกสาร
+            for snapshot in snapshots:
+                key = keys_by_path[snapshot.reference.path]
+                self._cache.set(key, snapshot, ttl=self.ttls.get(key[0]))
+                result[key] = snapshot
+        return result
+
+    def invalidate(self, collection, doc_id):
+        """🧹 ลบเอกสารออกจากแคช (เรียกหลังเขียนเอกสารนั้น)"""
+        self._cache.pop((collection, doc_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def get_document_cache(db):
+    """♻️ คืน DocumentCache ตัวเดียวต่อ Firestore client ทั้ง process"""
+    cache = _caches.get(id(db))
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(id(db))
+            if cache is None:
+                cache = DocumentCache(db)
+                _caches[id(db)] = cache
+    return cache
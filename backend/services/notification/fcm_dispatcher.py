@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import registry
+from services.common.circuit_breaker import CircuitOpenError, get_breaker
+from services.common.log import get_logger, log_event, redact_token
+from services.common.metrics import observe_fcm, register_gauge
+from services.common.rate_limiter import IGNORED, OVERLOADED, SUCCESS, AdaptiveRateLimiter, RateLimitTimeout
+from .fcm_errors import (
+    CIRCUIT_OPEN, DEAD, FAILED, FCM_MAX_RETRIES, OVERLOAD_STATUS, RATE_LIMITED, RETRY, RETRY_MAX_DELAY, SENT,
+    backoff_delay, classify_response, retry_after_seconds,
+)
+
+# ตั้ง FCM_ENDPOINT เพื่อชี้ไปยัง FCM ปลอม (เช่นตอนทำ benchmark)
+FCM_SEND_URL = os.environ.get(
+    "FCM_ENDPOINT", "https://fcm.googleapis.com/v1/projects/medi-bridge-app/messages:send"
+)
+
+# จำนวน request ที่ส่งไป FCM พร้อมกันได้สูงสุด (ปรับผ่าน env ได้)
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("FCM_MAX_CONCURRENCY", "64"))
+# quota ของ FCM v1 คือ 600,000 message / นาที ต่อ project (= 10,000 / วินาที) ใช้ร่วมกันทุก sender ใน process
+FCM_RATE_LIMIT = float(os.environ.get("FCM_RATE_LIMIT", "10000"))
+FCM_MIN_CONCURRENCY = int(os.environ.get("FCM_MIN_CONCURRENCY", "4"))
+# timeout ต่อ request (วินาที) ไม่ให้ thread ค้างไม่มีกำหนดเมื่อ FCM ช้า
+FCM_CONNECT_TIMEOUT = float(os.environ.get("FCM_CONNECT_TIMEOUT", "3"))
+FCM_READ_TIMEOUT = float(os.environ.get("FCM_READ_TIMEOUT", "10"))
+# รอสิทธิ์จาก rate limiter ได้นานสุดเท่านี้ (วินาที) แล้วคืน RETRY แทนการให้ thread / งานใน outbox ค้าง
+FCM_ACQUIRE_TIMEOUT = float(os.environ.get("FCM_ACQUIRE_TIMEOUT", str(RETRY_MAX_DELAY)))
+
+logger = get_logger("fcm")
+
+_shared_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_shared_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_fcm_rate_limiter():
+    """♻️ คืน AdaptiveRateLimiter ตัวเดียวที่ทุก dispatcher (sync / async) ใช้ร่วมกันทั้ง process"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        with _limiter_lock:
+            if _shared_limiter is None:
+                limiter = AdaptiveRateLimiter(
+                    FCM_RATE_LIMIT,
+                    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    min_concurrency=FCM_MIN_CONCURRENCY,
+                    max_pause=RETRY_MAX_DELAY,
+                )
+                register_gauge('medibridge_fcm_concurrency_limit', 'Adaptive FCM concurrency limit',
+                               lambda: limiter.stats()['limit'])
+                register_gauge('medibridge_fcm_in_flight', 'FCM requests currently in flight',
+                               lambda: limiter.stats()['in_flight'])
+                register_gauge('medibridge_fcm_throttled', 'FCM responses that signalled overload (429 / 503)',
+                               lambda: limiter.stats()['throttled'])
+                _shared_limiter = limiter
+    return _shared_limiter
+
+
+def record_breaker(breaker, response):
+    """🔌 5xx นับเป็นความล้มเหลวของ FCM ส่วน 2xx / 4xx (รวม 429) แปลว่า FCM ยังตอบได้ปกติ"""
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def raise_if_circuit_open(breaker, results):
+    """⛔ ถ้าทุก token ไม่ได้ส่งเพราะ breaker เปิด ให้ผู้เรียกรู้ (ตอบ 503 หรือเลื่อนงาน) แทนการถือว่าส่งไม่สำเร็จ"""
+    if results and all(code == CIRCUIT_OPEN for _, (_, code) in results):
+        breaker.raise_open()
+
+
+def limiter_outcome(response):
+    """🚦 แปลง response เป็นผลที่ limiter ใช้ปรับตัว -> (outcome, retry_after)
+
+    retry_after ถูกจำกัดไว้ที่ RETRY_MAX_DELAY เท่ากับที่ backoff_delay ยอมรอ
+    """
+    if response.status_code in OVERLOAD_STATUS:
+        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        return OVERLOADED, min(retry_after, RETRY_MAX_DELAY) if retry_after else None
+    if response.status_code < 500:
+        return SUCCESS, None
+    return IGNORED, None
+
+
+def build_pooled_session(pool_size):
+    """🔌 สร้าง requests.Session ที่เก็บ keep-alive connection ไว้ใช้ซ้ำ"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def collect_results(results):
+    """📋 รวมผลต่อ token -> (valid_tokens, invalid_tokens, failed_tokens)
+
+    invalid มีเฉพาะ token ที่ FCM ยืนยันว่าใช้ไม่ได้ (UNREGISTERED / INVALID_ARGUMENT);
+    failed คือ token ที่ล้มแบบไม่ชั่วคราว (FAILED เช่น SENDER_ID_MISMATCH) ใช้นับความล้มเหลวในทะเบียน token;
+    token ที่ส่งไม่สำเร็จชั่วคราว (quota, server ล่ม) ไม่อยู่ในรายการใดเลย และจะไม่ถูกลบ
+    """
+    valid_tokens = []
+    invalid_tokens = []
+    failed_tokens = []
+    for token, (result, code) in results:
+        if result == SENT:
+            # บรรทัดที่สำเร็จต่อ token สุ่มเก็บเพียงบางส่วน (LOG_SUCCESS_SAMPLE_RATE)
+            log_event(logger, "fcm.sent", "✅ FCM ส่งสำเร็จ", sampled=True, token=redact_token(token))
+            valid_tokens.append(token)
+        elif result == DEAD:
+            log_event(logger, "fcm.dead_token", "🧹 FCM token ใช้ไม่ได้แล้ว", level=logging.WARNING,
+                      token=redact_token(token), code=code)
+            invalid_tokens.append(token)
+        else:
+            log_event(logger, "fcm.error", "⚠️ FCM ส่งไม่สำเร็จ (ไม่ลบ token)", level=logging.WARNING,
+                      token=redact_token(token), result=result, code=code)
+            if result == FAILED:
+                failed_tokens.append(token)
+    return valid_tokens, invalid_tokens, failed_tokens
+
+
+class FCMDispatcher:
+    """🚀 ส่ง FCM v1 แบบขนานผ่าน connection pool ที่ใช้ร่วมกันทั้ง process"""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, session=None, endpoint=FCM_SEND_URL,
+                 limiter=None, max_retries=FCM_MAX_RETRIES, breaker=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.endpoint = endpoint
+        self.limiter = limiter or get_fcm_rate_limiter()
+        self.breaker = breaker or get_breaker('fcm')
+        self.max_retries = max_retries
+        self.session = session or build_pooled_session(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="fcm-dispatch"
+        )
+
+    def post(self, payload, access_token):
+        """📡 ส่ง message เดียวไปยัง FCM (ผ่าน circuit breaker และ rate limiter, ใช้ connection จาก pool)
+
+        raise CircuitOpenError ทันทีถ้า breaker ของ FCM เปิดอยู่ และ RateLimitTimeout ถ้ารอ limiter เกิน FCM_ACQUIRE_TIMEOUT
+        """
+        self.breaker.allow()
+        self.limiter.acquire(timeout=FCM_ACQUIRE_TIMEOUT)
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.endpoint,
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json",
+                },
+                json=payload,
+                timeout=(FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT),
+            )
+        except requests.RequestException:
+            observe_fcm("error", time.perf_counter() - started)
+            self.limiter.release(IGNORED)
+            self.breaker.record_failure()
+            raise
+        observe_fcm(response.status_code, time.perf_counter() - started)
+        self.limiter.release(*limiter_outcome(response))
+        record_breaker(self.breaker, response)
+        return response
+
+    def send(self, payload, access_token):
+        """🔁 ส่ง message เดียวพร้อม retry (429 / 5xx / เครือข่าย) -> (SENT / DEAD / RETRY / FAILED, errorCode)
+
+        รอระหว่างรอบด้วย backoff แบบ jitter ที่ไม่น้อยกว่า Retry-After; คืน RETRY ถ้าลองครบแล้วยังไม่สำเร็จ
+        """
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.post(payload, access_token)
+            except CircuitOpenError:
+                return RETRY, CIRCUIT_OPEN
+            except RateLimitTimeout:
+                return RETRY, RATE_LIMITED
+            except requests.RequestException as e:
+                result, code = RETRY, f"NETWORK_ERROR: {e}"
+            else:
+                result, code = classify_response(response.status_code, response.text)
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            if result != RETRY or attempt == self.max_retries:
+                return result, code
+            delay = backoff_delay(attempt, retry_after)
+            if delay is None:
+                return result, code
+            time.sleep(delay)
+
+    def send_to_tokens(self, tokens, build_payload, access_token):
+        """📨 ส่งไปทุก token พร้อมกัน แล้วคืน (valid_tokens, invalid_tokens, failed_tokens) ตามลำดับเดิม
+
+        raise CircuitOpenError ถ้า breaker ของ FCM เปิดอยู่จนไม่ได้ส่งเลยสักรายการ
+        """
+        return self.send_many([(tokens, build_payload)], access_token)[0]
+
+    def send_many(self, messages, access_token):
+        """📨 ส่งหลายข้อความพร้อมกันในรอบเดียว; messages คือ list ของ (tokens, build_payload)
+
+        ทุก token ของทุกข้อความเข้า executor พร้อมกัน แล้วคืน [(valid_tokens, invalid_tokens, failed_tokens), ...] ตามลำดับ messages
+        raise CircuitOpenError ถ้า breaker ของ FCM เปิดอยู่จนไม่ได้ส่งเลยสักรายการ
+        """
+        futures = [
+            [(token, self._executor.submit(self.send, build_payload(token), access_token)) for token in tokens]
+            for tokens, build_payload in messages
+        ]
+        results = [[(token, future.result()) for token, future in message] for message in futures]
+        raise_if_circuit_open(self.breaker, [pair for message in results for pair in message])
+        return [collect_results(message) for message in results]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def get_dispatcher():
+    """♻️ คืน FCMDispatcher ตัวเดียวที่ใช้ร่วมกันทั้ง process"""
+    global _shared_dispatcher
+    if _shared_dispatcher is None:
+        with _dispatcher_lock:
+            if _shared_dispatcher is None:
+                _shared_dispatcher = FCMDispatcher(session=registry.http_session())
+    return _shared_dispatcher
@@ -0,0 +1,83 @@
+import datetime
+import email.utils
+import json
+import os
+import random
+
+# ผลของการส่งหนึ่ง message
+SENT = 'sent'
+DEAD = 'dead'        # token ใช้ไม่ได้แล้ว ควรลบออกจากผู้ใช้
+RETRY = 'retry'      # ชั่วคราว (quota / server ล่ม / เครือข่าย) ลองใหม่ได้
+FAILED = 'failed'    # ผิดพลาดแบบอื่น (auth, sender id, payload) ไม่ลบ token และไม่ลองใหม่
+
+# code ของผลที่ไม่ได้ส่งเพราะ circuit breaker ของ FCM เปิดอยู่
+CIRCUIT_OPEN = 'CIRCUIT_OPEN'
+# errorCode ของผล RETRY เมื่อรอ rate limiter ของ process เกิน FCM_ACQUIRE_TIMEOUT
+RATE_LIMITED = 'RATE_LIMITED'
+
+# มีแค่ 2 errorCode นี้ที่แปลว่า token เสียจริง (ดู FCM v1 ErrorCode)
+DEAD_TOKEN_CODES = frozenset({'UNREGISTERED', 'INVALID_ARGUMENT'})
+RETRYABLE_CODES = frozenset({'QUOTA_EXCEEDED', 'UNAVAILABLE', 'INTERNAL'})
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+# status ที่แปลว่า FCM กำลังจำกัดเรา ให้ limiter ลดจำนวนพร้อมกันลง
+OVERLOAD_STATUS = frozenset({429, 503})
+
+FCM_MAX_RETRIES = int(os.environ.get("FCM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("FCM_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.environ.get("FCM_RETRY_MAX_DELAY", "30"))
+
+_FCM_ERROR_TYPE = 'type.googleapis.com/google.firebase.fcm.v1.FcmError'
+
+
+def fcm_error_code(body_text):
+    """🔎 ดึง errorCode ของ FCM (ถ้าไม่มีใช้ error.status เช่น UNAVAILABLE) จาก body ของ response"""
+    try:
+        error = json.loads(body_text or '{}').get('error') or {}
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(error, dict):
+        return None
+    for detail in error.get('details') or []:
+        if isinstance(detail, dict) and detail.get('@type') == _FCM_ERROR_TYPE and detail.get('errorCode'):
+            return detail['errorCode']
+    return error.get('status')
+
+
+def classify_response(status_code, body_text):
+    """🏷️ แยกผลของ FCM v1 -> (SENT / DEAD / RETRY / FAILED, errorCode)"""
+    if status_code == 200:
+        return SENT, None
+    code = fcm_error_code(body_text)
+    if code in DEAD_TOKEN_CODES:
+        return DEAD, code
+    if status_code in RETRYABLE_STATUS or code in RETRYABLE_CODES:
+        return RETRY, code or str(status_code)
+    return FAILED, code or str(status_code)
+
+
+def retry_after_seconds(value):
+    """⏱️ แปลง header Retry-After (วินาที หรือวันที่แบบ HTTP) เป็นจำนวนวินาที"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """🎲 exponential backoff แบบ full jitter แต่ไม่น้อยกว่า Retry-After ที่ server ขอ
+
+    คืน None ถ้า server ขอให้รอนานกว่า RETRY_MAX_DELAY (ไม่ควรให้ request รอนานขนาดนั้น)
+    """
+    if retry_after and retry_after > RETRY_MAX_DELAY:
+        return None
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    return max(delay, retry_after or 0.0)
@@ -0,0 +1,174 @@
+from datetime import datetime
+
+# 📝 ข้อความแจ้งเตือนแต่ละประเภท ใช้ร่วมกันทั้งฝั่ง Flask (sync) และ ASGI (async)
+# แต่ละฟังก์ชันคืน (title, body, data)
+
+# ฟิลด์ของ data ที่ส่งผ่าน topic ได้ (ไม่มีชื่อคน / ลิงก์สลิป) แอปเจ้าหน้าที่ใช้ id ไปดึงรายละเอียดเอง
+TOPIC_DATA_FIELDS = ("type", "count", "digest_id", "appointment_id", "patient_id", "doctor_id")
+TOPIC_BODY = "กรุณาเปิดแอปเพื่อดูรายละเอียด"
+
+
+def format_appointment_date(raw_date):
+    """🗓️ จัดรูปแบบวันที่นัดหมาย เช่น 22 February 2025"""
+    if isinstance(raw_date, datetime):
+        return raw_date.strftime('%d %B %Y')
+    return 'ไม่ระบุวันที่'
+
+
+def patient_display_name(patient_data):
+    return f"{patient_data.get('first_name', 'ไม่ทราบชื่อ')} {patient_data.get('last_name', '')}"
+
+
+def doctor_display_name(doctor_data, doctor_id):
+    if doctor_data is None:
+        return f"แพทย์ (รหัส: {doctor_id})"
+    first_name = doctor_data.get('first_name', 'ไม่ทราบชื่อ')
+    last_name = doctor_data.get('last_name', 'ไม่ทราบนามสกุล')
+    return f"แพทย์ {first_name} {last_name}"
+
+
+def new_appointment_message(appointment_id, appointment_date, appointment_time):
+    title = "🔔 แจ้งเตือน: นัดหมายใหม่"
+    body = f"มีนัดหมายใหม่ วันที่ {appointment_date} เวลา {appointment_time} กรุณาตรวจสอบ"
+    return title, body, {"appointment_id": appointment_id}
+
+
+def appointment_status_message(status, appointment_date, appointment_time):
+    status_msg = "ได้รับการยืนยันแล้ว" if status == "รอชำระเงิน" else "ถูกยกเลิก"
+    title = "🩺 แจ้งเตือน: สถานะนัดหมาย"
+    body = f"นัดหมายของคุณ {status_msg} วันที่ {appointment_date} เวลา {appointment_time}"
+    return title, body, {"status": status}
+
+
+def payment_due_message(amount):
+    title = "💳 แจ้งเตือนค่ารักษาพยาบาล"
+    body = f"คุณมีค่ารักษาพยาบาลจำนวน {amount} บาท กรุณาชำระเงิน"
+    return title, body, {"type": "PAYMENT_DUE", "amount": str(amount)}
+
+
+def staff_payment_upload_message(patient_id, patient_data, appointment_data, slip_url, appointment_id=None):
+    patient_name = patient_display_name(patient_data)
+    appointment_date = format_appointment_date(appointment_data.get('appointment_date'))
+    appointment_time = appointment_data.get('appointment_time', 'ไม่ระบุเวลา')
+
+    title = "📩 แจ้งเตือน: ผู้ป่วยอัปโหลดสลิปชำระเงิน"
+    body = f"ผู้ป่วย {patient_name} ได้อัปโหลดสลิปสำหรับนัดหมายวันที่ {appointment_date} เวลา {appointment_time}"
+    data = {
+        "type": "PAYMENT_UPLOAD",
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "appointment_date": appointment_date,
+        "appointment_time": appointment_time,
+        "slip_url": slip_url
+    }
+    if appointment_id:
+        data["appointment_id"] = appointment_id
+    return title, body, data
+
+
+def _digest_names(names, count):
+    """👥 ชื่อไม่เกิน 3 ชื่อแรกตามด้วยจำนวนที่เหลือ เช่น ก, ข, ค และอีก 2 รายการ"""
+    shown = [name for name in dict.fromkeys(names) if name][:3]
+    text = ", ".join(shown)
+    if count > len(shown):
+        text = f"{text} และอีก {count - len(shown)} รายการ" if shown else f"{count} รายการ"
+    return text
+
+
+def staff_payment_digest_message(events):
+    """📩 สรุปการอัปโหลดสลิปหลายรายการในแจ้งเตือนเดียว (events = list ของ data จาก staff_payment_upload_message)"""
+    count = len(events)
+    title = f"📩 แจ้งเตือน: มีสลิปชำระเงินใหม่ {count} รายการ"
+    body = f"ผู้ป่วย {_digest_names([e.get('patient_name') for e in events], count)} ได้อัปโหลดสลิป กรุณาตรวจสอบ"
+    return title, body, {"type": "PAYMENT_UPLOAD_DIGEST", "count": str(count)}
+
+
+def payment_status_message(appointment_id, appointment_data, status):
+    appointment_date = format_appointment_date(appointment_data.get('appointment_date'))
+    appointment_time = appointment_data.get('appointment_time', 'ไม่ระบุเวลา')
+
+    title = "💳 สถานะการชำระเงิน"
+    body = f"สถานะการชำระเงินสำหรับนัดหมายวันที่ {appointment_date} เวลา {appointment_time}: {status}"
+    data = {
+        "type": "PAYMENT_STATUS",
+        "appointment_id": appointment_id,
+        "appointment_date": str(appointment_date),
+        "appointment_time": str(appointment_time),
+        "status": status
+    }
+    return title, body, data
+
+
+def schedule_change_request_message(doctor_name, schedule_date, schedule_time, reason, doctor_id=None):
+    formatted_date = format_appointment_date(schedule_date)
+    formatted_time = schedule_time if schedule_time else "ไม่ระบุเวลา"
+
+    title = "📅 คำร้องขอเปลี่ยนตารางเวร"
+    body = (
+        f"{doctor_name} ขอเปลี่ยนตารางเวร "
+        f"วันที่ {formatted_date} เวลา {formatted_time} "
+        f"เหตุผล: {reason}"
+    )
+    data = {
+        "type": "SCHEDULE_CHANGE_REQUEST",
+        "doctor_name": doctor_name,
+        "schedule_date": formatted_date,
+        "schedule_time": formatted_time,
+    }
+    if doctor_id:
+        data["doctor_id"] = doctor_id
+    return title, body, data
+
+
+def schedule_change_digest_message(events):
+    """📅 สรุปคำร้องขอเปลี่ยนตารางเวรหลายรายการในแจ้งเตือนเดียว"""
+    count = len(events)
+    title = f"📅 คำร้องขอเปลี่ยนตารางเวรใหม่ {count} รายการ"
+    body = f"{_digest_names([e.get('doctor_name') for e in events], count)} ขอเปลี่ยนตารางเวร กรุณาตรวจสอบ"
+    return title, body, {"type": "SCHEDULE_CHANGE_REQUEST_DIGEST", "count": str(count)}
+
+
+def staff_topic_message(title, data):
+    """📢 ข้อความสำหรับส่งผ่าน topic: หัวข้อเดิม เนื้อหากลาง ๆ และ data เฉพาะ id (ตัดชื่อผู้ป่วย/แพทย์ และ slip_url ออก)"""
+    data = data or {}
+    return title, TOPIC_BODY, {key: str(data[key]) for key in TOPIC_DATA_FIELDS if data.get(key)}
+
+
+def schedule_request_submitted_message(schedule_date, schedule_time):
+    title = "📨 คำขอเปลี่ยนตารางเวรถูกส่งแล้ว"
+    body = (
+        f"คำขอเปลี่ยนตารางเวรของคุณถูกส่งสำเร็จ "
+        f"วันที่ {schedule_date} เวลา {schedule_time} "
+        "กรุณารอการตรวจสอบจากเจ้าหน้าที่"
+    )
+    data = {
+        "type": "SCHEDULE_REQUEST_SUBMITTED",
+        "schedule_date": schedule_date,
+        "schedule_time": schedule_time,
+        "status": "pending"
+    }
+    return title, body, data
+
+
+def schedule_updated_message(schedule_date, start_time, end_time):
+    title = "📅 ตารางเวรถูกเปลี่ยนแปลง"
+    body = (
+        f"ตารางเวรของคุณถูกเปลี่ยนเป็น "
+        f"วันที่ {schedule_date.strftime('%d %B %Y')} "
+        f"เวลา {start_time} - {end_time} "
+        "โปรดตรวจสอบรายละเอียด"
+    )
+    data = {
+        "type": "SCHEDULE_UPDATED",
+        "schedule_date": schedule_date.strftime('%Y-%m-%d'),
+        "start_time": start_time,
+        "end_time": end_time,
+    }
+    return title, body, data
+
+
+def appointment_reminder_message(appointment_time, when='วันพรุ่งนี้'):
+    """⏰ แจ้งเตือนล่วงหน้าก่อนถึงนัด (when เช่น วันนี้ / วันพรุ่งนี้ / วันที่ 22 February 2025)"""
+    title = 'แจ้งเตือนนัดหมาย'
+    body = f'คุณมีนัดหมายใน{when} เวลา {appointment_time}'
+    return title, body, {}
@@ -0,0 +1,138 @@
+import base64
+import datetime
+import hashlib
+import json
+import os
+
+from firebase_admin import firestore
+
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.circuit_breaker import get_breaker
+from services.common.metrics import record_firestore
+from services.common.ttl_cache import TTLCache
+from .notification_log import NOTIFICATIONS_COLLECTION, get_notification_log
+
+HISTORY_PAGE_SIZE = int(os.environ.get("NOTIFICATION_HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = 100
+# หน้าแรกของแต่ละผู้รับเก็บไว้สั้น ๆ (วินาที) เพราะ replica อื่นอาจเขียนบันทึกใหม่โดยที่เราไม่รู้
+HISTORY_CACHE_TTL = float(os.environ.get("NOTIFICATION_HISTORY_CACHE_TTL", "10"))
+HISTORY_CACHE_SIZE = 2048
+
+
+class InvalidHistoryRequest(ValueError):
+    """❌ พารามิเตอร์ของ /notifications ไม่ถูกต้อง (ตอบ 400)"""
+
+
+def encode_cursor(snapshot):
+    """🔖 cursor ของหน้าถัดไป = (timestamp, document id) ของรายการสุดท้าย ในรูป base64 ที่อ่านไม่ออกสำหรับ client"""
+    raw = json.dumps({"t": snapshot.get('timestamp').isoformat(), "id": snapshot.id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """🔖 แปลง cursor กลับเป็น (timestamp, document id)"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        timestamp, doc_id = datetime.datetime.fromisoformat(raw["t"]), str(raw["id"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidHistoryRequest("Invalid cursor") from e
+    # id ถูกใช้เป็น document id ตรง ๆ ห้ามว่างและห้ามมี "/" (จะกลายเป็น path ไปยังเอกสารอื่น)
+    if not doc_id or '/' in doc_id:
+        raise InvalidHistoryRequest("Invalid cursor")
+    return timestamp, doc_id
+
+
+def parse_page_args(args):
+    """🔍 อ่าน query string -> (recipient_id, role, limit, cursor)"""
+    recipient_id = args.get('recipient_id')
+    if not recipient_id:
+        raise InvalidHistoryRequest("Missing required fields")
+    try:
+        limit = int(args.get('limit') or HISTORY_PAGE_SIZE)
+    except ValueError:
+        raise InvalidHistoryRequest("limit must be an integer")
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        raise InvalidHistoryRequest(f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
+    return recipient_id, args.get('role') or None, limit, args.get('cursor') or None
+
+
+def etag_matches(if_none_match, etag):
+    """🏷️ header If-None-Match ตรงกับ etag หรือไม่ (เทียบแบบ weak)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    strip = lambda tag: tag.strip().removeprefix('W/')
+    return strip(etag) in {strip(tag) for tag in if_none_match.split(',')}
+
+
+def _serialize(snapshot):
+    data = snapshot.to_dict()
+    timestamp = data.get('timestamp')
+    return {
+        "id": snapshot.id,
+        "title": data.get('title'),
+        "body": data.get('body'),
+        "data": data.get('data') or {},
+        "role": data.get('role'),
+        "recipient_id": data.get('recipient_id'),
+        "timestamp": timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp,
+    }
+
+
+class NotificationHistory:
+    """📜 อ่านประวัติแจ้งเตือนของผู้รับทีละหน้า (recipient_id [+ role] เรียงตาม timestamp ใหม่ไปเก่า)
+
+    ใช้ query เดียวต่อหน้าบน composite index (recipient_id, role, timestamp) ใน firestore.indexes.json
+    และเลื่อนหน้าด้วย cursor (timestamp, document id) แทน offset ที่ต้องอ่านเอกสารที่ข้ามไปด้วย
+    หน้าแรกถูกแคชไว้สั้น ๆ และล้างทันทีเมื่อ process นี้บันทึกแจ้งเตือนใหม่ให้ผู้รับคนนั้น
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.collection(NOTIFICATIONS_COLLECTION)
+        self._cache = TTLCache(maxsize=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL)
+        self._cached_limits = set()
+        self._breaker = get_breaker('firestore')
+        get_notification_log(db).add_listener(self._on_logged)
+
+    def _on_logged(self, records):
+        """🧹 ล้างหน้าแรกที่แคชไว้ของผู้รับที่เพิ่งได้แจ้งเตือนใหม่"""
+        recipients = {(record.get('recipient_id'), record.get('role')) for record in records}
+        for recipient_id, role in recipients:
+            for limit in list(self._cached_limits):
+                self._cache.pop((recipient_id, role, limit))
+                self._cache.pop((recipient_id, None, limit))
+
+    def page(self, recipient_id, role=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """📄 คืน {"items": [...], "next_cursor": str | None, "etag": str}"""
+        if cursor is not None:
+            return self._query(recipient_id, role, limit, cursor)
+        self._cached_limits.add(limit)
+        return self._cache.get_or_load(
+            (recipient_id, role, limit), lambda: self._query(recipient_id, role, limit, None)
+        )
+
+    def _query(self, recipient_id, role, limit, cursor):
+        query = self.collection.where('recipient_id', '==', recipient_id)
+        if role:
+            query = query.where('role', '==', role)
+        # __name__ ตัดสินลำดับของรายการที่ timestamp เท่ากัน (บันทึกใน batch เดียวกัน) ไม่ให้หายหรือซ้ำระหว่างหน้า
+        query = query.order_by('timestamp', direction=firestore.Query.DESCENDING) \
+                     .order_by('__name__', direction=firestore.Query.DESCENDING)
+        if cursor is not None:
+            timestamp, doc_id = decode_cursor(cursor)
+            query = query.start_after({'timestamp': timestamp, '__name__': self.collection.document(doc_id)})
+
+        # อ่านเกินหนึ่งรายการเพื่อรู้ว่ามีหน้าถัดไปหรือไม่
+        docs = self._breaker.call(lambda: list(query.limit(limit + 1).stream(timeout=FIRESTORE_TIMEOUT)))
+        # query ที่ไม่เจอเอกสารก็ยังคิดเป็น 1 read
+        record_firestore(NOTIFICATIONS_COLLECTION, 'read', max(1, len(docs)))
+
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        items = [_serialize(doc) for doc in docs]
+        next_cursor = encode_cursor(docs[-1]) if has_more else None
+        fingerprint = json.dumps([[item['id'], item['timestamp']] for item in items] + [next_cursor])
+        etag = 'W/"' + hashlib.sha1(fingerprint.encode()).hexdigest()[:20] + '"'
+        return {"items": items, "next_cursor": next_cursor, "etag": etag}
@@ -0,0 +1,297 @@
+import atexit
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from firebase_admin import firestore
+
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.circuit_breaker import is_transient
+from services.common.lease import default_owner_id
+from services.common.metrics import record_firestore, register_gauge
+from .outbox import OUTBOX_PATH
+
+NOTIFICATIONS_COLLECTION = 'Notifications'
+# flush เมื่อมีรายการค้างครบเท่านี้ (Firestore รับได้สูงสุด 500 write ต่อ batch)
+FLUSH_SIZE = 200
+# หรือเมื่อรายการแรกค้างอยู่นานเกินเท่านี้ (วินาที)
+FLUSH_INTERVAL = 2.0
+MAX_BATCH_WRITES = 500
+# เขียน batch ไม่สำเร็จด้วย error ชั่วคราว ลองใหม่ทันที (backoff = DELAY * 2^(attempt-1)) จนครบ WRITE_ATTEMPTS ครั้ง
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 0.5
+# บันทึกที่ยังเขียนไม่ได้เก็บลงตาราง notification_log_dead_letters ในไฟล์ SQLite เดียวกับ outbox
+# แล้วลองเขียนซ้ำทุก REPLAY_INTERVAL วินาที ครบ MAX_REPLAYS ครั้งแล้วเก็บไว้ให้ตรวจสอบเอง (ไม่ลบ)
+REPLAY_INTERVAL = float(os.environ.get("NOTIFICATION_LOG_REPLAY_INTERVAL", "60"))
+MAX_REPLAYS = 20
+
+_DEAD_LETTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notification_log_dead_letters (
+    doc_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires_at REAL,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notification_log_dead_letters_attempts ON notification_log_dead_letters (attempts);
+"""
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def _encode(record):
+    # SERVER_TIMESTAMP เก็บลง SQLite ไม่ได้ ใช้เวลาที่เขียนไม่สำเร็จแทน (ใกล้เคียงเวลาที่ส่งจริง)
+    stored = dict(record)
+    timestamp = stored.get("timestamp")
+    if timestamp is firestore.SERVER_TIMESTAMP:
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(timestamp, datetime.datetime):
+        stored["timestamp"] = timestamp.isoformat()
+    return json.dumps(stored, ensure_ascii=False, default=str)
+
+
+def _decode(text):
+    record = json.loads(text)
+    if isinstance(record.get("timestamp"), str):
+        record["timestamp"] = datetime.datetime.fromisoformat(record["timestamp"])
+    return record
+
+
+class DeadLetterStore:
+    """🪦 บันทึกแจ้งเตือนที่เขียนลง Firestore ไม่สำเร็จ เก็บไว้ใน SQLite เพื่อเขียนซ้ำภายหลัง
+
+    document id ถูกกำหนดตั้งแต่ครั้งแรก การเขียนซ้ำจึงไม่สร้างบันทึกซ้ำ; แถวที่กำลังเขียนซ้ำถูกถือด้วย lease
+    หลาย process ที่ใช้ไฟล์เดียวกันจึงไม่หยิบแถวเดียวกันพร้อมกัน
+    """
+
+    def __init__(self, path=OUTBOX_PATH, lease_seconds=REPLAY_INTERVAL):
+        self.path = path
+        self.lease_seconds = max(1.0, float(lease_seconds))
+        self.owner = default_owner_id()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_DEAD_LETTER_SCHEMA)
+
+    def add(self, items, error):
+        """➕ เก็บ [(doc_id, record), ...] ที่เขียนไม่สำเร็จ"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO notification_log_dead_letters (doc_id, record, error, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(doc_id, _encode(record), str(error), now) for doc_id, record in items],
+            )
+
+    def claim(self, limit=MAX_BATCH_WRITES):
+        """🤝 หยิบแถวที่ยังลองได้และไม่มี process อื่นถืออยู่ -> [(doc_id, record), ...]"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT doc_id, record FROM notification_log_dead_letters "
+                    "WHERE attempts < ? AND (lease_expires_at IS NULL OR lease_expires_at <= ?) "
+                    "ORDER BY created_at LIMIT ?",
+                    (MAX_REPLAYS, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE notification_log_dead_letters SET owner = ?, lease_expires_at = ? WHERE doc_id = ?",
+                    [(self.owner, now + self.lease_seconds, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(doc_id, _decode(record)) for doc_id, record in rows]
+
+    def remove(self, doc_ids):
+        """🗑️ ลบแถวที่เขียนลง Firestore ได้แล้ว"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM notification_log_dead_letters WHERE doc_id = ? AND owner = ?",
+                [(doc_id, self.owner) for doc_id in doc_ids],
+            )
+
+    def mark_failed(self, doc_ids, error):
+        """🔁 นับครั้งที่เขียนซ้ำไม่สำเร็จ และปล่อย lease ให้รอบถัดไป"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE notification_log_dead_letters SET attempts = attempts + 1, error = ?, "
+                "owner = NULL, lease_expires_at = NULL WHERE doc_id = ? AND owner = ?",
+                [(str(error), doc_id, self.owner) for doc_id in doc_ids],
+            )
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notification_log_dead_letters").fetchone()[0]
+
+
+class NotificationLogSink:
+    """📝 บัฟเฟอร์บันทึกแจ้งเตือนแล้วเขียนลง Notifications ทีละ WriteBatch ใน thread เบื้องหลัง
+
+    batch ที่เขียนไม่สำเร็จถูกลองใหม่ด้วย backoff แล้วจึงเก็บลง DeadLetterStore (ไม่ทิ้งบันทึก)
+    thread เดียวกันเขียนบันทึกใน dead letter ซ้ำทุก REPLAY_INTERVAL วินาที
+    """
+
+    def __init__(self, db, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, dead_letters=None,
+                 replay_interval=REPLAY_INTERVAL):
+        self.db = db
+        self.flush_size = min(flush_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.dead_letters = dead_letters or DeadLetterStore()
+        self.replay_interval = replay_interval
+        self._next_replay = 0.0
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._listeners = []
+        self._thread = threading.Thread(target=self._run, name="notification-log", daemon=True)
+        self._thread.start()
+        register_gauge('medibridge_notification_log_dead_letters',
+                       'Notification log records waiting to be rewritten to Firestore', self.dead_letters.count)
+
+    def add(self, record):
+        """➕ เพิ่มบันทึกลงบัฟเฟอร์ (ไม่รอการเขียน Firestore)"""
+        with self._cond:
+            if self._closed:
+                # ปิดไปแล้ว เขียนตรงเพื่อไม่ให้ข้อมูลหาย
+                self._write([record])
+                return
+            self._buffer.append(record)
+            # ปลุก thread เมื่อเริ่มนับเวลารายการแรก หรือเมื่อครบขนาด batch
+            if len(self._buffer) == 1 or len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def add_listener(self, callback):
+        """👂 เรียก callback(records) หลังเขียนแต่ละ batch สำเร็จ (เช่น ล้างแคชหน้าประวัติแจ้งเตือน)"""
+        self._listeners.append(callback)
+
+    def _take(self):
+        with self._cond:
+            records, self._buffer = self._buffer, []
+        return records
+
+    def _commit(self, items):
+        """✍️ เขียน [(doc_id, record), ...] เป็น batch เดียว ลองใหม่เมื่อเป็น error ชั่วคราว (raise เมื่อครบแล้ว)"""
+        collection = self.db.collection(NOTIFICATIONS_COLLECTION)
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            batch = self.db.batch()
+            for doc_id, record in items:
+                batch.set(collection.document(doc_id), record)
+            try:
+                batch.commit(timeout=FIRESTORE_TIMEOUT)
+                record_firestore(NOTIFICATIONS_COLLECTION, 'write', len(items))
+                return
+            except Exception as e:
+                if attempt >= WRITE_ATTEMPTS or not is_transient(e):
+                    raise
+                print(f"⚠️ บันทึกแจ้งเตือนไม่สำเร็จ (ครั้งที่ {attempt}) ลองใหม่: {e}")
+                time.sleep(WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _notify(self, records):
+        for listener in self._listeners:
+            listener(records)
+
+    def _write(self, records):
+        with self._flush_lock:
+            collection = self.db.collection(NOTIFICATIONS_COLLECTION)
+            for i in range(0, len(records), MAX_BATCH_WRITES):
+                # กำหนด document id ไว้ก่อน การลองใหม่ / เขียนซ้ำจาก dead letter จึงเขียนทับเอกสารเดิม
+                items = [(collection.document().id, record) for record in records[i:i + MAX_BATCH_WRITES]]
+                try:
+                    self._commit(items)
+                    print(f"📝 บันทึกแจ้งเตือนลง Firestore {len(items)} รายการ")
+                except Exception as e:
+                    print(f"❌ ล้มเหลวในการบันทึกการแจ้งเตือน {len(items)} รายการ เก็บไว้เขียนซ้ำภายหลัง: {e}")
+                    self.dead_letters.add(items, e)
+                    continue
+                self._notify([record for _, record in items])
+
+    def replay(self):
+        """🪦 เขียนบันทึกใน dead letter ซ้ำทีละ batch จนหมดหรือจนเขียนไม่สำเร็จ -> จำนวนที่เขียนได้"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                items = self.dead_letters.claim()
+                if not items:
+                    break
+                doc_ids = [doc_id for doc_id, _ in items]
+                try:
+                    self._commit(items)
+                except Exception as e:
+                    print(f"⚠️ เขียนบันทึกแจ้งเตือนจาก dead letter ไม่สำเร็จ {len(items)} รายการ: {e}")
+                    self.dead_letters.mark_failed(doc_ids, e)
+                    break
+                self.dead_letters.remove(doc_ids)
+                written += len(items)
+                self._notify([record for _, record in items])
+        if written:
+            print(f"🪦 เขียนบันทึกแจ้งเตือนจาก dead letter แล้ว {written} รายการ")
+        return written
+
+    def _replay_if_due(self):
+        now = time.monotonic()
+        if now < self._next_replay:
+            return
+        self._next_replay = now + self.replay_interval
+        try:
+            self.replay()
+        except Exception as e:
+            print(f"⚠️ เขียนบันทึกแจ้งเตือนจาก dead letter ไม่สำเร็จ: {e}")
+
+    def flush(self):
+        """💾 เขียนทุกรายการที่ค้างอยู่ทันที"""
+        records = self._take()
+        if records:
+            self._write(records)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    # ตื่นเป็นระยะเพื่อเขียน dead letter ซ้ำแม้ไม่มีบันทึกใหม่
+                    self._cond.wait(self.replay_interval)
+                if self._closed:
+                    return
+                if self._buffer and len(self._buffer) < self.flush_size:
+                    # รอให้ครบขนาดหรือหมดเวลา แล้วค่อย flush
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+            self._replay_if_due()
+
+    def close(self):
+        """🛑 หยุด thread เบื้องหลังและ flush ที่เหลือทั้งหมด (เรียกตอนปิดโปรแกรม)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+
+def get_notification_log(db):
+    """♻️ คืน NotificationLogSink ตัวเดียวต่อ Firestore client และ flush อัตโนมัติตอนปิดโปรแกรม"""
+    sink = _sinks.get(id(db))
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(id(db))
+            if sink is None:
+                sink = NotificationLogSink(db)
+                _sinks[id(db)] = sink
+                atexit.register(sink.close)
+    return sink
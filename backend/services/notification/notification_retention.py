@@ -0,0 +1,85 @@
+import datetime
+import os
+import time
+
+from firebase_admin import firestore
+
+from services import registry
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.lease import ACQUIRED, FirestoreLease
+from services.common.metrics import record_firestore
+from .notification_log import NOTIFICATIONS_COLLECTION
+
+# เก็บบันทึกแจ้งเตือนไว้ใน Notifications กี่วัน (0 = ไม่ย้ายออก)
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_RETENTION_DAYS", "90"))
+ARCHIVE_COLLECTION = os.environ.get("NOTIFICATION_ARCHIVE_COLLECTION", "NotificationsArchive")
+# ย้ายครั้งละเท่านี้ (set ที่ archive + delete ที่ต้นทาง = 2 write ต่อเอกสาร, Firestore รับ 500 write ต่อ batch)
+ARCHIVE_BATCH_SIZE = 250
+# จำนวน batch สูงสุดต่อการรันหนึ่งครั้ง ที่เหลือค่อยย้ายในรอบถัดไป
+ARCHIVE_MAX_BATCHES = int(os.environ.get("NOTIFICATION_ARCHIVE_MAX_BATCHES", "200"))
+RETENTION_LEASE_TTL = 900.0
+
+
+def _lease():
+    return registry.lazy("retention_lease", lambda: FirestoreLease(registry.firestore_client()))
+
+
+def archive_old_notifications(retention_days=None, now=None):
+    """🗄️ ย้ายบันทึกแจ้งเตือนที่เก่ากว่า retention_days วันไป NotificationsArchive ทีละ batch
+
+    ทุก replica เรียกพร้อมกันได้: มีเพียง process เดียวที่ได้ lease ของวันนั้นและเป็นคนย้าย
+    คืนสถิติ หรือ None ถ้าไม่ได้เป็นคนทำ
+    """
+    retention_days = NOTIFICATION_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return None
+
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cutoff = now - datetime.timedelta(days=retention_days)
+    name = f"notification-retention-{now.date().isoformat()}"
+    lease = _lease()
+    if lease.try_acquire(name, RETENTION_LEASE_TTL) != ACQUIRED:
+        print(f"⏭️ ข้ามการย้ายบันทึกแจ้งเตือน ({name} มี process อื่นทำแล้ว)")
+        return None
+
+    db = registry.firestore_client()
+    source = db.collection(NOTIFICATIONS_COLLECTION)
+    archive = db.collection(ARCHIVE_COLLECTION)
+    query = source.where('timestamp', '<', cutoff).order_by('timestamp').limit(ARCHIVE_BATCH_SIZE)
+
+    started = time.monotonic()
+    archived = 0
+    batches = 0
+    try:
+        while batches < ARCHIVE_MAX_BATCHES:
+            docs = list(query.stream(timeout=FIRESTORE_TIMEOUT))
+            record_firestore(NOTIFICATIONS_COLLECTION, 'read', max(1, len(docs)))
+            if not docs:
+                break
+            batch = db.batch()
+            for doc in docs:
+                batch.set(archive.document(doc.id), dict(doc.to_dict(), archived_at=firestore.SERVER_TIMESTAMP))
+                batch.delete(doc.reference)
+            batch.commit(timeout=FIRESTORE_TIMEOUT)
+            record_firestore(ARCHIVE_COLLECTION, 'write', len(docs))
+            record_firestore(NOTIFICATIONS_COLLECTION, 'write', len(docs))
+            archived += len(docs)
+            batches += 1
+            lease.renew(name, RETENTION_LEASE_TTL)
+            if len(docs) < ARCHIVE_BATCH_SIZE:
+                break
+    except Exception as e:
+        print(f"❌ ย้ายบันทึกแจ้งเตือนล้มเหลวหลังย้ายไป {archived} รายการ: {e}")
+        lease.release(name)
+        return None
+
+    stats = {
+        "archived": archived,
+        "batches": batches,
+        "cutoff": cutoff.isoformat(),
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+    lease.complete(name, stats)
+    print(f"🗄️ ย้ายบันทึกแจ้งเตือนที่เก่ากว่า {retention_days} วันไป {ARCHIVE_COLLECTION} แล้ว "
+          f"{archived} รายการ ({batches} batch ใน {stats['elapsed_seconds']} วินาที)")
+    return stats
@@ -1,119 +1,210 @@
-import json
-import requests
+import logging
+import os
 from firebase_admin import firestore
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
+from services.common.circuit_breaker import CircuitOpenError
+from services.common.log import get_logger, log_event, redact_tokens
+from .fcm_dispatcher import get_dispatcher
+from .fcm_errors import SENT
+from .token_provider import get_token_provider
+from .staff_token_directory import get_staff_token_directory
+from .document_cache import get_document_cache
+from .token_index import get_token_index, normalize_tokens
+from .notification_log import get_notification_log
+from .staff_topic import TOPIC_MIN_LENGTH, get_staff_topic_subscriptions, topic_configured
+from .messages import staff_topic_message
+
+# "tokens" = ส่งทีละ token แบบเดิม, "topic" = ส่งถึงเจ้าหน้าที่ทุกคนด้วยข้อความเดียวผ่าน FCM topic
+# (เปิดได้เมื่อตั้ง STAFF_FCM_TOPIC เป็นชื่อสุ่มที่เดาไม่ได้แล้วเท่านั้น)
+STAFF_BROADCAST_MODE = os.environ.get("STAFF_BROADCAST_MODE", "tokens")
+
+logger = get_logger("notification")
 
 class NotificationService:
-    def __init__(self, db, service_account_file):
+    def __init__(self, db, service_account_file, dispatcher=None, token_provider=None):
         self.db = db
+        self.dispatcher = dispatcher or get_dispatcher()
         self.service_account_file = service_account_file
-        self.SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-        self.credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_file, scopes=self.SCOPES
-        )
+        # ✅ ใช้ credentials/token ร่วมกันทั้ง process แทนการโหลดใหม่ทุก service
+        self.token_provider = token_provider or get_token_provider(service_account_file)
+        self.credentials = self.token_provider.credentials
+        self.staff_directory = get_staff_token_directory(db)
+        self.document_cache = get_document_cache(db)
+        self.token_index = get_token_index(db)
+        self.notification_log = get_notification_log(db)
+        self.staff_topic = None
+        if STAFF_BROADCAST_MODE == "topic":
+            if topic_configured():
+                self.staff_topic = get_staff_topic_subscriptions(db)
+            else:
+                print(f"⚠️ STAFF_BROADCAST_MODE=topic ต้องตั้ง STAFF_FCM_TOPIC เป็นชื่อสุ่มอย่างน้อย {TOPIC_MIN_LENGTH} ตัวอักษร "
+                      "ส่งทีละ token แทน")
+
+    def get_document(self, collection, doc_id):
+        """📄 อ่านเอกสารผ่านแคช (User / Appointments) แทนการ get จาก Firestore ทุกครั้ง"""
+        return self.document_cache.get(collection, doc_id)
+
+    def get_tokens_for_users(self, user_ids, user_data=None):
+        """🔑 หา FCM token ของผู้ใช้หลายคนผ่านทะเบียน FcmTokens -> {user_id: [token, ...]}
+
+        ผู้ใช้ที่ยังไม่อยู่ในทะเบียน (ยังไม่ได้ migrate) ใช้ fcm_token จากเอกสาร User แทน
+        user_data คือ {user_id: dict ของเอกสาร User} ที่ผู้เรียกอ่านมาแล้ว (ถ้ามี)
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        tokens_by_user = self.token_index.tokens_for_users(user_ids)
+        for user_id in user_ids:
+            if user_id in tokens_by_user:
+                continue
+            data = (user_data or {}).get(user_id)
+            if data is None:
+                snapshot = self.get_document('User', user_id)
+                data = snapshot.to_dict() if snapshot.exists else {}
+            tokens_by_user[user_id] = normalize_tokens(data.get('fcm_token'))
+        return tokens_by_user
+
+    def get_user_tokens(self, user_id, user_data=None):
+        """🔑 FCM token ของผู้ใช้หนึ่งคน (ผ่านทะเบียน FcmTokens)"""
+        return self.get_tokens_for_users([user_id], {user_id: user_data} if user_data is not None else None)[user_id]
+
+    def get_staff_tokens(self):
+        """👥 ดึง FCM Token ของเจ้าหน้าที่ทั้งหมดจาก directory ในหน่วยความจำ"""
+        return self.staff_directory.get_tokens()
     
     def _get_access_token(self):
-        """🔐 สร้าง Access Token สำหรับ Firebase Cloud Messaging"""
-        self.credentials.refresh(Request())
-        return self.credentials.token
+        """🔐 ดึง Access Token (แคชไว้จนใกล้หมดอายุ) สำหรับ Firebase Cloud Messaging"""
+        return self.token_provider.get_token()
     
-    def _log_notification(self, recipient_id, role, title, body):
-        print(f"📝 [DEBUG] กำลังบันทึกแจ้งเตือนลง Firestore -> recipient_id: {recipient_id}, role: {role}")
-
-        """📜 บันทึกแจ้งเตือนลง Firestore"""
-        try:
-            self.db.collection('Notifications').add({
-                "recipient_id": recipient_id,
-                "role": role,
-                "title": title,
-                "body": body,
+    def send_fcm_notification(self, tokens, title, body, data=None, role=None, recipient_id=None, records=None):
+        """🚀 ส่ง FCM Notification"""
+        return self.send_many([{
+            "tokens": tokens, "title": title, "body": body, "data": data,
+            "role": role, "recipient_id": recipient_id, "records": records,
+        }])[0]
+
+    def _log_records(self, title, body, data, role, recipient_id, records=None):
+        """📝 บันทึกแจ้งเตือนที่ส่งสำเร็จ: records (เช่นทุกเหตุการณ์ใน digest) หรือข้อความที่ส่งจริงหนึ่งรายการ"""
+        for record in records or [{"title": title, "body": body, "data": data}]:
+            self.notification_log.add({
+                "title": record["title"],
+                "body": record["body"],
+                "data": record.get("data") or {},
+                "role": role or "Unknown",
+                "recipient_id": recipient_id or "Unknown",
                 "timestamp": firestore.SERVER_TIMESTAMP
             })
-            print(f"✅ บันทึกการแจ้งเตือนสำเร็จ: {title}")
-        except Exception as e:
-            print(f"❌ ล้มเหลวในการบันทึกการแจ้งเตือน: {e}")
-
-    def send_fcm_notification(self, tokens, title, body, data=None, role=None, recipient_id=None):
-        print(f"📡 [DEBUG] เรียก send_fcm_notification สำหรับ {role} - recipient_id: {recipient_id}")
-        print(f"📨 [DEBUG] กำลังส่งไปยัง FCM Token: {tokens}")
-        
-        """🚀 ส่ง FCM Notification"""
-        if not tokens:
-            print("⚠️ ไม่มี FCM token ที่สามารถใช้ได้")
-            return False
 
-        # 🔍 ตรวจสอบ Token และส่งแจ้งเตือน
+    def send_many(self, notifications):
+        """📦 ส่งหลายแจ้งเตือนในรอบเดียว -> [True / False, ...] ตามลำดับ
+
+        notifications คือ list ของ dict (tokens, title, body, data, role, recipient_id, records)
+        records (ถ้ามี) คือบันทึกที่เขียนแทนข้อความที่ส่งจริง เช่นเหตุการณ์ทุกรายการที่รวมอยู่ใน digest
+        ทุก token ของทุกแจ้งเตือนถูกส่งพร้อมกัน และลบ token ที่ใช้ไม่ได้ของทั้งชุดด้วย batch เดียว
+        """
+        results = [False] * len(notifications)
+        pending = []
+        for i, notification in enumerate(notifications):
+            role, recipient_id = notification.get("role"), notification.get("recipient_id")
+            log_event(logger, "fcm.send", f"📡 ส่งแจ้งเตือนสำหรับ {role} - recipient_id: {recipient_id}",
+                      level=logging.DEBUG, role=role, recipient_id=recipient_id,
+                      tokens=redact_tokens(notification.get("tokens") or []))
+            # 🔍 ตัด token ซ้ำ / ว่าง
+            tokens = [t for t in dict.fromkeys(notification.get("tokens") or []) if t]
+            if not tokens:
+                log_event(logger, "fcm.no_tokens", "⚠️ ไม่มี FCM token ที่สามารถใช้ได้",
+                          level=logging.WARNING, role=role, recipient_id=recipient_id)
+                continue
+            pending.append((i, tokens))
+        if not pending:
+            return results
+
+        def payload_builder(notification):
+            def build_payload(token):
+                return {
+                    "message": {
+                        "token": token,
+                        "notification": {"title": notification["title"], "body": notification["body"]},
+                        "data": notification.get("data") or {},
+                        "android": {"priority": "high"}
+                    }
+                }
+            return build_payload
+
         access_token = self._get_access_token()
-        valid_tokens = []
-        invalid_tokens = []
+        outcomes = self.dispatcher.send_many(
+            [(tokens, payload_builder(notifications[i])) for i, tokens in pending], access_token
+        )
+
+        # 📈 บันทึกผลการส่งต่อ token ลงทะเบียน (ไม่รอการเขียน)
+        self.token_index.record_results(
+            [token for valid, _, _ in outcomes for token in valid],
+            [token for _, _, failed in outcomes for token in failed],
+        )
+
+        # 🧹 ลบ Token ที่ใช้ไม่ได้ (หาเจ้าของผ่านทะเบียน FcmTokens แล้วลบแบบ batch)
+        invalid_tokens = [token for _, invalid, _ in outcomes for token in invalid]
+        if invalid_tokens:
+            try:
+                for user_id in self.token_index.remove_tokens(invalid_tokens):
+                    self.document_cache.invalidate('User', user_id)
+            except CircuitOpenError as e:
+                # ส่งไปแล้ว ไม่ควรล้มทั้ง request เพราะลบ token ไม่ได้ (จะถูกลบในการส่งครั้งถัดไป)
+                log_event(logger, "fcm.cleanup_skipped", "⚠️ ข้ามการลบ token ที่ใช้ไม่ได้ (Firestore circuit เปิดอยู่)",
+                          level=logging.WARNING, invalid=len(invalid_tokens), error=str(e))
+
+        for (i, _), (valid_tokens, invalid, _) in zip(pending, outcomes):
+            notification = notifications[i]
+            role, recipient_id = notification.get("role"), notification.get("recipient_id")
+            if not valid_tokens:
+                log_event(logger, "fcm.no_valid_tokens", "❌ ไม่มี FCM Token ที่ใช้งานได้", level=logging.ERROR,
+                          role=role, recipient_id=recipient_id, invalid=len(invalid))
+                continue
+
+            # 📝 บันทึกผ่าน sink แบบ batch เพื่อไม่ให้ request ต้องรอการเขียน Firestore
+            self._log_records(notification["title"], notification["body"], notification.get("data"),
+                              role, recipient_id, notification.get("records"))
+            log_event(logger, "notification.queued", f"📝 เพิ่มบันทึกแจ้งเตือนสำหรับ {role} ลงคิวแล้ว",
+                      role=role, recipient_id=recipient_id, sent=len(valid_tokens), invalid=len(invalid))
+            results[i] = True
+        return results
 
-        for token in tokens:
+    def send_staff_broadcast(self, title, body, data=None, tokens=None, records=None):
+        """📢 ส่งถึงเจ้าหน้าที่ทุกคน: ใช้ FCM topic ข้อความเดียวถ้า subscription ตรงแล้ว ไม่งั้นส่งทีละ token
+
+        ข้อความที่ส่งผ่าน topic ถูกตัดเหลือเฉพาะ id (staff_topic_message) ส่วนการส่งทีละ token ส่งข้อความเต็ม
+
+        records (ถ้ามี) คือบันทึกแจ้งเตือนที่เขียนแทนข้อความที่ส่ง (ใช้กับ digest ที่รวมหลายเหตุการณ์)
+        """
+        if self.staff_topic is not None and self.staff_topic.is_synced():
+            # ข้อความ topic ไม่มีข้อมูลส่วนตัว แอปใช้ id ใน data ไปดึงรายละเอียดเอง (บันทึกแจ้งเตือนยังเก็บข้อความเต็ม)
+            topic_title, topic_body, topic_data = staff_topic_message(title, data)
             payload = {
                 "message": {
-                    "token": token,
-                    "notification": {"title": title, "body": body},
-                    "data": data or {},
+                    "topic": self.staff_topic.topic,
+                    "notification": {"title": topic_title, "body": topic_body},
+                    "data": topic_data,
                     "android": {"priority": "high"}
                 }
             }
+            result, code = self.dispatcher.send(payload, self._get_access_token())
+            if result == SENT:
+                self._log_records(title, body, data, "Staff", "all_staff", records)
+                log_event(logger, "fcm.topic_sent", f"📢 ส่งแจ้งเตือนเจ้าหน้าที่ผ่าน topic {self.staff_topic.topic} สำเร็จ",
+                          topic=self.staff_topic.topic)
+                return True
+            log_event(logger, "fcm.topic_failed", "⚠️ ส่งผ่าน topic ไม่สำเร็จ ส่งทีละ token แทน",
+                      level=logging.WARNING, topic=self.staff_topic.topic, result=result, code=code)
 
-            response = requests.post(
-                "https://fcm.googleapis.com/v1/projects/medi-bridge-app/messages:send",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-            )
-
-            if response.status_code == 200:
-                print(f"✅ FCM ส่งสำเร็จ: {token}")
-                valid_tokens.append(token)
-            else:
-                print(f"⚠️ FCM Error: {response.text}")
-                invalid_tokens.append(token)
+        if tokens is None:
+            tokens = self.get_staff_tokens()
+        return self.send_fcm_notification(tokens, title, body, data, role="Staff", recipient_id="all_staff",
+                                          records=records)
 
-        # 🧹 ลบ Token ที่ใช้ไม่ได้
-        if invalid_tokens:
-            user_docs = self.db.collection('User').where('fcm_token', 'array_contains_any', invalid_tokens).stream()
-            for doc in user_docs:
-                user_id = doc.id
-                current_tokens = doc.to_dict().get('fcm_token', [])
-                updated_tokens = [t for t in current_tokens if t not in invalid_tokens]
-                self.db.collection('User').document(user_id).update({"fcm_token": updated_tokens})
-                print(f"🧹 อัปเดต FCM Token สำหรับ User: {user_id}")
-
-        if not valid_tokens:
-            print("❌ ไม่มี FCM Token ที่ใช้งานได้")
-            return False
-        
-        self.db.collection("Notifications").add({
-            "title": title,
-            "body": body,
-            "data": data or {},
-            "role": role or "Unknown",
-            "recipient_id": recipient_id or "Unknown",
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
-        print(f"📝 บันทึกแจ้งเตือนลง Firestore สำหรับ {role} สำเร็จ")
-        return True
-    
     def send_fcm_v1(self, payload):
         """🚀 ส่ง FCM ผ่าน Firebase Cloud Messaging v1 API"""
         access_token = self._get_access_token()
 
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        response = requests.post(
-            "https://fcm.googleapis.com/v1/projects/medi-bridge-app/messages:send",
-            headers=headers,
-            json=payload
-        )
-        print(f"📡 [DEBUG] FCM Response: {response.status_code} -> {response.text}")
+        response = self.dispatcher.post(payload, access_token)
+        log_event(logger, "fcm.response", "📡 FCM Response", level=logging.DEBUG,
+                  status=response.status_code, response=response.text[:500])
         return response
 
     
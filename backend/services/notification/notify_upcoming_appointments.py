@@ -1,64 +1,307 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, messaging
+from firebase_admin import exceptions, messaging
 import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# ตรวจสอบว่ามี Firebase app อยู่แล้วหรือไม่
-try:
-    firebase_admin.get_app()
-except ValueError:
-    cred = credentials.Certificate("config/medi-bridge-app-firebase-adminsdk-iew3q-c1f0b31f28.json")
-    firebase_admin.initialize_app(cred)
+from services import registry
+from services.common.lease import ACQUIRED, DONE, FirestoreLease
+from services.common.log import get_logger, log_event, redact_token
+from services.common.metrics import REMINDER_DURATION, record_firestore
+from services.notification.messages import appointment_reminder_message
+from services.notification.token_index import get_token_index, normalize_tokens
 
-db = firestore.client()
+# จำนวนเอกสารผู้ป่วยต่อการเรียก get_all หนึ่งครั้ง
+PATIENT_CHUNK_SIZE = 100
+# send_each รับได้สูงสุด 500 message ต่อครั้ง
+SEND_BATCH_SIZE = 500
 
-def notify_appointments_tomorrow():
-    now = datetime.datetime.now()
-    tomorrow = now + datetime.timedelta(days=1)
-    start = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 0, 0)
-    end = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 23, 59, 59)
-    
-    appointments_ref = db.collection('Appointments')
-    query = appointments_ref \
+# แบ่งนัดหมายของพรุ่งนี้เป็นกี่ shard (ตามช่วง document id) ให้หลาย worker / replica ช่วยกันส่ง
+REMINDER_SHARDS = int(os.environ.get("REMINDER_SHARDS", "4"))
+# จำนวน shard ที่ process หนึ่งทำพร้อมกัน
+REMINDER_SHARD_WORKERS = int(os.environ.get("REMINDER_SHARD_WORKERS", "4"))
+# อายุ lease ของแต่ละ shard (วินาที) ถ้า process ตายระหว่างส่ง process อื่นรับช่วงได้หลังจากนี้
+REMINDER_LEASE_TTL = float(os.environ.get("REMINDER_LEASE_TTL", "600"))
+# รอ shard ที่ process อื่นถืออยู่ได้นานสุดเท่านี้ (วินาที) เผื่อต้องรับช่วงต่อ
+REMINDER_RUN_DEADLINE = float(os.environ.get("REMINDER_RUN_DEADLINE", "1800"))
+REMINDER_POLL_INTERVAL = 15.0
+
+# ตัวอักษรของ auto-ID ของ Firestore เรียงตามลำดับที่ Firestore ใช้เทียบ document id
+AUTO_ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+logger = get_logger("reminders")
+
+
+
+def _db():
+    # ✅ ใช้ Firestore client ตัวเดียวกับทั้ง process และสร้างเมื่อถูกใช้ครั้งแรก (ไม่ใช่ตอน import)
+    return registry.firestore_client()
+
+
+def _lease():
+    return registry.lazy("reminder_lease", lambda: FirestoreLease(_db()))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def shard_bounds(shards):
+    """✂️ แบ่งช่วง document id เป็น shards ช่วง -> [(lower, upper), ...] (None = ไม่มีขอบ)
+
+    auto-ID กระจายสม่ำเสมอบนตัวอักษร 62 ตัว จึงแบ่งตามตัวอักษรแรก;
+    ช่วงแรกและช่วงสุดท้ายเปิดปลายไว้ เพื่อให้ id ที่ไม่ใช่ auto-ID ตกอยู่ใน shard ใด shard หนึ่งเสมอ
+    """
+    shards = max(1, min(int(shards), len(AUTO_ID_ALPHABET)))
+    cuts = [AUTO_ID_ALPHABET[round(i * len(AUTO_ID_ALPHABET) / shards)] for i in range(1, shards)]
+    lowers = [None] + cuts
+    uppers = cuts + [None]
+    return list(zip(lowers, uppers))
+
+
+def _load_appointments(start, end, id_range=(None, None)):
+    """📅 ดึงนัดหมายในช่วงเวลา (อ่านเฉพาะฟิลด์ที่ใช้) จำกัดเฉพาะช่วง document id ของ shard ถ้ามี"""
+    collection = _db().collection('Appointments')
+    query = collection \
         .where('appointment_date', '>=', start) \
         .where('appointment_date', '<=', end)
-    appointments = query.stream()
-    
-    for doc in appointments:
+    lower, upper = id_range
+    if lower is not None:
+        query = query.where('__name__', '>=', collection.document(lower))
+    if upper is not None:
+        query = query.where('__name__', '<', collection.document(upper))
+    query = query.select(['patient_id', 'appointment_time'])
+    appointments = []
+    for doc in query.stream():
+        record_firestore('Appointments', 'read')
         data = doc.to_dict()
-        patient_id = data.get('patient_id')
-        appointment_time = data.get('appointment_time')
-    
-        user_doc = db.collection('User').document(patient_id).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            fcm_token = user_data.get('fcm_token')
-            tokens = []
-            if isinstance(fcm_token, list):
-                tokens = fcm_token
-            elif isinstance(fcm_token, str):
-                tokens = [fcm_token]
-    
-            if tokens:
-                for token in tokens:
-                    if token and token.strip():
-                        try:
-                            messaging.send(
-                                messaging.Message(
-                                    token=token,
-                                    notification=messaging.Notification(
-                                        title='แจ้งเตือนนัดหมาย',
-                                        body=f'คุณมีนัดหมายในวันพรุ่งนี้ เวลา {appointment_time}'
-                                    )
-                                )
-                            )
-                            print(f"✅ แจ้งเตือนผู้ใช้ {patient_id} สำหรับ token {token} เรียบร้อย")
-                        except messaging.UnregisteredError:
-                            print(f"⚠️ Token {token} หมดอายุหรือไม่ถูกต้อง ข้ามไปเลย")
-                        except Exception as e:
-                            print(f"❌ ส่งแจ้งเตือน token {token} ผิดพลาด: {e}")
-                    else:
-                        print(f"⚠️ ข้าม token ว่างของผู้ใช้ {patient_id}")
+        if data.get('patient_id'):
+            appointments.append((data['patient_id'], data.get('appointment_time')))
+    return appointments
+
+
+def _load_patient_tokens(patient_ids):
+    """👤 หา token ของผู้ป่วยทุกคนผ่านทะเบียน FcmTokens -> {patient_id: [token, ...]}
+
+    ผู้ป่วยที่ยังไม่อยู่ในทะเบียนอ่าน fcm_token ด้วย get_all ทีละก้อนแทน
+    """
+    db = _db()
+    tokens_by_patient = get_token_index(db).tokens_for_users(patient_ids)
+    unknown = [pid for pid in patient_ids if pid not in tokens_by_patient]
+    for chunk in _chunks(unknown, PATIENT_CHUNK_SIZE):
+        refs = [db.collection('User').document(pid) for pid in chunk]
+        record_firestore('User', 'read', len(refs))
+        for snapshot in db.get_all(refs, field_paths=['fcm_token']):
+            if snapshot.exists:
+                tokens_by_patient[snapshot.id] = normalize_tokens(snapshot.to_dict().get('fcm_token'))
+    return tokens_by_patient
+
+
+def _build_messages(appointments, tokens_by_patient, when='วันพรุ่งนี้'):
+    """📨 สร้าง message ต่อ (token, เวลานัด) โดยตัดรายการที่ซ้ำกันออก"""
+    messages = []
+    seen = set()
+    for patient_id, appointment_time in appointments:
+        for token in tokens_by_patient.get(patient_id, []):
+            key = (token, appointment_time)
+            if key in seen:
+                continue
+            seen.add(key)
+            title, body, _ = appointment_reminder_message(appointment_time, when)
+            messages.append(messaging.Message(
+                token=token,
+                notification=messaging.Notification(title=title, body=body)
+            ))
+    return messages
+
+
+def _send_in_batches(messages, before_batch=None):
+    """🚀 ส่งด้วย messaging.send_each ทีละ 500 message
+
+    before_batch() ถูกเรียกก่อนส่งแต่ละ batch (เช่น ต่ออายุ lease) ถ้าคืน False จะหยุดส่ง batch ที่เหลือ
+    คืน (sent, failed, batches, unregistered_tokens, delivered_tokens, rejected_tokens)
+    rejected คือ token ที่ล้มแบบไม่ชั่วคราว (SENDER_ID_MISMATCH) ใช้นับความล้มเหลวในทะเบียน
+    """
+    sent = 0
+    failed = 0
+    batches = 0
+    unregistered = []
+    delivered = []
+    rejected = []
+    for chunk in _chunks(messages, SEND_BATCH_SIZE):
+        if before_batch is not None and before_batch() is False:
+            print(f"⚠️ หยุดส่งแจ้งเตือนก่อน batch ที่ {batches + 1} (เหลือ {len(messages) - sent - failed} message)")
+            break
+        batches += 1
+        try:
+            batch_response = messaging.send_each(chunk, app=registry.firebase_app())
+        except Exception as e:
+            print(f"❌ ส่งแจ้งเตือน batch ที่ {batches} ผิดพลาด: {e}")
+            failed += len(chunk)
+            continue
+
+        sent += batch_response.success_count
+        failed += batch_response.failure_count
+        for message, response in zip(chunk, batch_response.responses):
+            if response.success:
+                delivered.append(message.token)
+                continue
+            # ✅ นับเป็น token เสียเฉพาะ UNREGISTERED / INVALID_ARGUMENT เหมือนฝั่ง FCMDispatcher
+            if isinstance(response.exception, (messaging.UnregisteredError, exceptions.InvalidArgumentError)):
+                unregistered.append(message.token)
             else:
-                print(f"⚠️ ข้ามผู้ใช้ {patient_id} เพราะไม่มี FCM token")
+                if isinstance(response.exception, messaging.SenderIdMismatchError):
+                    rejected.append(message.token)
+                log_event(logger, "reminder.send_error", "❌ ส่งแจ้งเตือนนัดหมายไม่สำเร็จ", level=logging.WARNING,
+                          token=redact_token(message.token), error=str(response.exception))
+    return sent, failed, batches, unregistered, delivered, rejected
+
+
+def send_appointment_reminders(appointments, when='วันพรุ่งนี้', before_batch=None):
+    """🔔 ส่งแจ้งเตือนนัดหมายให้รายการ (patient_id, appointment_time) และคืนสถิติของรอบนี้
+
+    exception ถูก raise ได้เฉพาะก่อนเริ่มส่ง; งานเก็บกวาดหลังส่ง (ทะเบียน token) ล้มเหลวได้โดยไม่กระทบผลลัพธ์
+    """
+    started = time.monotonic()
+
+    patient_ids = list(dict.fromkeys(patient_id for patient_id, _ in appointments))
+    tokens_by_patient = _load_patient_tokens(patient_ids)
+    messages = _build_messages(appointments, tokens_by_patient, when)
+    sent, failed, batches, unregistered, delivered, rejected = _send_in_batches(messages, before_batch)
+
+    try:
+        token_index = get_token_index(_db())
+        token_index.record_results(delivered, rejected)
+        if unregistered:
+            # 🧹 token ที่หมดอายุแล้วลบออกผ่านทะเบียน FcmTokens
+            token_index.remove_tokens(unregistered)
+    except Exception as e:
+        print(f"⚠️ ลบ/บันทึกผล token หลังส่งแจ้งเตือนไม่สำเร็จ (ข้ามไป): {e}")
+
+    return {
+        "appointments": len(appointments),
+        "patients": len(patient_ids),
+        "patients_without_tokens": sum(1 for pid in patient_ids if not tokens_by_patient.get(pid)),
+        "messages": len(messages),
+        "batches": batches,
+        "sent": sent,
+        "failed": failed,
+        "unregistered": len(unregistered),
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def _run_shard(name, start, end, id_range):
+    """📦 ส่งแจ้งเตือนของ shard เดียว แล้วบันทึกว่าเสร็จ
+
+    ต่ออายุ lease ก่อนส่งทุก batch; ถ้าเสีย lease ไปแล้วจะหยุดส่งเพื่อไม่ให้ซ้ำกับเจ้าของใหม่
+    ล้มเหลวก่อนเริ่มส่ง -> ปล่อย lease ให้คนอื่นทำต่อ / เริ่มส่งไปแล้ว -> บันทึกว่าเสร็จเสมอ (ไม่ส่งซ้ำทั้ง shard)
+    """
+    lease = _lease()
+    progress = {"sending": False, "lost": False}
+
+    def before_batch():
+        progress["sending"] = True
+        try:
+            if not lease.renew(name, REMINDER_LEASE_TTL):
+                progress["lost"] = True
+                print(f"⚠️ shard {name} เสีย lease ให้ process อื่นแล้ว")
+                return False
+        except Exception as e:
+            # ต่ออายุไม่ได้ชั่วคราว ส่งต่อไป (lease ยังไม่หมดอายุจนกว่าจะครบ REMINDER_LEASE_TTL)
+            print(f"⚠️ ต่ออายุ lease ของ shard {name} ไม่สำเร็จ: {e}")
+        return True
+
+    try:
+        stats = send_appointment_reminders(_load_appointments(start, end, id_range), before_batch=before_batch)
+    except Exception as e:
+        print(f"❌ shard {name} ล้มเหลว: {e}")
+        if progress["sending"]:
+            stats = {"failed_shards": 1}
         else:
-            print(f"⚠️ ไม่พบข้อมูลผู้ใช้ {patient_id}")
+            try:
+                lease.release(name)
+            except Exception as release_error:
+                print(f"⚠️ ปล่อย lease ของ shard {name} ไม่สำเร็จ (รอหมดอายุแทน): {release_error}")
+            return None
+
+    if not progress["lost"]:
+        try:
+            lease.complete(name, stats)
+        except Exception as e:
+            print(f"⚠️ บันทึกว่า shard {name} เสร็จแล้วไม่สำเร็จ: {e}")
+    return stats
+
+
+def _merge_stats(results):
+    totals = {}
+    for stats in results:
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def notify_appointments_tomorrow(shards=None):
+    """🔔 ส่งแจ้งเตือนนัดหมายพรุ่งนี้ โดยแต่ละ shard มี process เดียวที่ได้ส่ง (ผ่าน lease ใน Firestore)
+
+    ทุก worker / replica เรียกฟังก์ชันนี้พร้อมกันได้: แต่ละตัวจะแย่ง shard ที่ยังไม่มีเจ้าของ
+    ทำ shard ที่ได้ไปพร้อมกันหลาย thread และรอรับช่วง shard ที่เจ้าของหายไประหว่างทาง
+    """
+    now = datetime.datetime.now()
+    tomorrow = now + datetime.timedelta(days=1)
+    start = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 0, 0)
+    end = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 23, 59, 59)
+
+    bounds = shard_bounds(shards or REMINDER_SHARDS)
+    names = [f"appointment-reminders-{start.date().isoformat()}-{i + 1}of{len(bounds)}" for i in range(len(bounds))]
+    pending = dict(zip(names, bounds))
+
+    started = time.monotonic()
+    deadline = started + REMINDER_RUN_DEADLINE
+    results = []
+    lease = _lease()
+    with ThreadPoolExecutor(max_workers=max(1, REMINDER_SHARD_WORKERS), thread_name_prefix="reminder-shard") as pool:
+        while pending:
+            claimed = []
+            for name in list(pending):
+                try:
+                    state = lease.try_acquire(name, REMINDER_LEASE_TTL)
+                except Exception as e:
+                    # Firestore มีปัญหาชั่วคราว ลองแย่ง shard นี้ใหม่รอบถัดไป
+                    print(f"⚠️ แย่ง lease ของ shard {name} ไม่สำเร็จ: {e}")
+                    continue
+                if state == DONE:
+                    pending.pop(name)
+                elif state == ACQUIRED:
+                    claimed.append(name)
+
+            futures = {name: pool.submit(_run_shard, name, start, end, pending[name]) for name in claimed}
+            for name, future in futures.items():
+                stats = future.result()
+                if stats is not None:
+                    results.append(stats)
+                    pending.pop(name)
+
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                print(f"⚠️ หมดเวลารอ shard ที่ process อื่นถืออยู่: {sorted(pending)}")
+                break
+            # shard ที่เหลือมีคนอื่นถืออยู่ (หรือเพิ่งล้มเหลว) รอดูว่าเสร็จหรือ lease หมดอายุ
+            time.sleep(REMINDER_POLL_INTERVAL)
+
+    stats = _merge_stats(results)
+    stats["shards_total"] = len(bounds)
+    stats["shards_run"] = len(results)
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    REMINDER_DURATION.labels('batch').observe(stats["elapsed_seconds"])
+
+    print(
+        f"✅ แจ้งเตือนนัดหมายพรุ่งนี้เสร็จ: ทำ {stats['shards_run']}/{stats['shards_total']} shard, "
+        f"นัดหมาย {stats.get('appointments', 0)} รายการ, "
+        f"ส่งสำเร็จ {stats.get('sent', 0)}, ล้มเหลว {stats.get('failed', 0)}, "
+        f"{stats.get('batches', 0)} batch ใน {stats['elapsed_seconds']} วินาที"
+    )
+    return stats
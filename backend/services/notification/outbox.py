@@ -0,0 +1,296 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from services.registry import backend_path
+from services.common.circuit_breaker import CircuitOpenError
+from services.common.lease import default_owner_id
+
+# ไฟล์ SQLite ที่ใช้เก็บคิวงานแจ้งเตือน (อยู่รอดแม้ process ถูก restart) path แบบ relative อ้างจากโฟลเดอร์ backend/
+OUTBOX_PATH = backend_path(os.environ.get("NOTIFICATION_OUTBOX_PATH", "data/notification_outbox.sqlite3"))
+DEFAULT_WORKERS = int(os.environ.get("NOTIFICATION_OUTBOX_WORKERS", "4"))
+MAX_ATTEMPTS = 5
+# backoff = BASE * 2^(attempt-1) วินาที (มี jitter) แต่ไม่เกิน MAX
+BASE_BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 300.0
+# งานที่ worker ถืออยู่เกินเวลานี้โดยไม่ต่ออายุ (process ตาย) ถูก worker อื่นรับไปทำต่อได้ (วินาที)
+JOB_LEASE_SECONDS = float(os.environ.get("NOTIFICATION_OUTBOX_LEASE", "120"))
+# เก็บงานที่จบแล้วไว้ให้ดูสถานะได้นานเท่านี้ (วินาที)
+FINISHED_RETENTION_SECONDS = 7 * 24 * 3600
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    result TEXT,
+    http_status INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    lease_expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_attempt_at);
+"""
+# คอลัมน์ที่เพิ่มทีหลัง (ไฟล์คิวเดิมจะถูกเพิ่มคอลัมน์ให้ตอนเปิด)
+_ADDED_COLUMNS = {"owner": "TEXT", "lease_expires_at": "REAL"}
+
+
+class NotificationOutbox:
+    """📮 คิวงานแจ้งเตือนแบบถาวรบน SQLite พร้อม worker pool ที่ retry ด้วย exponential backoff
+
+    handler รับ payload (dict) แล้วคืน (response_dict, http_status)
+    - 2xx  -> succeeded
+    - 4xx  -> failed ทันที (ข้อมูลไม่ถูกต้อง ส่งซ้ำก็ไม่ช่วย)
+    - 5xx หรือ exception -> retry จนครบ MAX_ATTEMPTS
+    - CircuitOpenError -> เลื่อนไปทำหลัง breaker ปิด โดยไม่นับเป็นความพยายาม
+    งานที่กำลังทำถูกผูกกับ owner (เครื่อง:pid) พร้อม lease ที่ต่ออายุเป็นระยะ หลาย process ใช้ไฟล์เดียวกันได้
+    และงาน running จะถูกรับช่วงต่อเฉพาะเมื่อ lease ของเจ้าของหมดอายุแล้วเท่านั้น
+    """
+
+    def __init__(self, path=OUTBOX_PATH, workers=DEFAULT_WORKERS, max_attempts=MAX_ATTEMPTS,
+                 lease_seconds=JOB_LEASE_SECONDS):
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.lease_seconds = max(1.0, float(lease_seconds))
+        self.owner = default_owner_id()
+        self._handlers = {}
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Condition()
+        self._db_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+    def register(self, kind, handler):
+        """🧩 ผูกประเภทงานกับฟังก์ชันที่ทำงานนั้น"""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind, payload):
+        """➕ เพิ่มงานลงคิว (เขียน local ครั้งเดียว) แล้วคืน job id"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), PENDING, now, now, now),
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """🔎 คืนสถานะของงาน หรือ None ถ้าไม่พบ"""
+        with self._db_lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "last_error": row["last_error"],
+            "http_status": row["http_status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def depth(self):
+        """📏 จำนวนงานที่ยังไม่จบ (รอคิว + กำลังทำ)"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (PENDING, RUNNING)
+            ).fetchone()
+        return row[0]
+
+    def _claim(self):
+        """🎫 รับงานที่ถึงเวลาทำ หรืองาน running ที่ lease ของเจ้าของเดิมหมดอายุแล้ว"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE (status = ? AND next_attempt_at <= ?) "
+                    "OR (status = ? AND (lease_expires_at IS NULL OR lease_expires_at <= ?)) "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (PENDING, now, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    if row["status"] == RUNNING:
+                        print(f"♻️ รับงาน {row['id']} ต่อจาก {row['owner'] or 'process เดิม'} (lease หมดอายุ)")
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_expires_at = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (RUNNING, self.owner, now + self.lease_seconds, now, row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _renew_leases(self):
+        """🔁 ต่ออายุ lease ของงานทุกงานที่ process นี้กำลังทำอยู่"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE status = ? AND owner = ?",
+                (now + self.lease_seconds, RUNNING, self.owner),
+            )
+
+    def _heartbeat(self):
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                self._renew_leases()
+            except Exception as e:
+                print(f"⚠️ ต่ออายุ lease ของงานใน outbox ไม่สำเร็จ: {e}")
+
+    def _next_wait(self):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM jobs WHERE status = ?", (PENDING,)
+            ).fetchone()
+        if row[0] is None:
+            return 1.0
+        return min(1.0, max(0.0, row[0] - time.time()))
+
+    def _finish(self, job_id, status, result=None, http_status=None, error=None, next_attempt_at=None):
+        """🏁 บันทึกผลของงาน (เฉพาะงานที่ process นี้ยังถืออยู่ ถ้าถูกรับช่วงไปแล้วจะไม่ทับผลของเจ้าของใหม่)"""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, http_status = ?, last_error = ?, "
+                "next_attempt_at = COALESCE(?, next_attempt_at), owner = NULL, lease_expires_at = NULL, "
+                "updated_at = ? WHERE id = ? AND owner = ?",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    http_status,
+                    error,
+                    next_attempt_at,
+                    now,
+                    job_id,
+                    self.owner,
+                ),
+            )
+
+    def _defer(self, job_id, delay, error):
+        """⏸️ คืนงานเข้าคิวให้ทำใหม่หลัง delay วินาที และคืนจำนวนครั้งที่ถูกนับไปตอน claim"""
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(0, attempts - 1), last_error = ?, "
+                "next_attempt_at = ?, owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (PENDING, error, time.time() + max(1.0, delay) * random.uniform(1.0, 1.2), time.time(), job_id,
+                 self.owner),
+            )
+
+    def _backoff(self, attempts):
+        delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run_job(self, row):
+        job_id = row["id"]
+        attempts = row["attempts"] + 1
+        handler = self._handlers.get(row["kind"])
+        if handler is None:
+            self._finish(job_id, FAILED, error=f"No handler for job kind {row['kind']}")
+            return
+
+        try:
+            result, http_status = handler(json.loads(row["payload"]))
+        except CircuitOpenError as e:
+            self._defer(job_id, e.retry_after, str(e))
+            return
+        except Exception as e:
+            result, http_status, error = None, None, str(e)
+        else:
+            error = None if http_status < 500 else (result or {}).get("error") or (result or {}).get("message")
+
+        if http_status is not None and http_status < 400:
+            self._finish(job_id, SUCCEEDED, result=result, http_status=http_status)
+        elif http_status is not None and http_status < 500:
+            self._finish(job_id, FAILED, result=result, http_status=http_status)
+        elif attempts >= self.max_attempts:
+            print(f"❌ งาน {job_id} ({row['kind']}) ล้มเหลวครบ {attempts} ครั้ง: {error}")
+            self._finish(job_id, FAILED, result=result, http_status=http_status, error=error)
+        else:
+            delay = self._backoff(attempts)
+            print(f"🔁 งาน {job_id} ({row['kind']}) ล้มเหลว จะลองใหม่ใน {delay:.1f} วินาที: {error}")
+            self._finish(job_id, PENDING, result=result, http_status=http_status, error=error,
+                         next_attempt_at=time.time() + delay)
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"❌ อ่านคิวงานแจ้งเตือนล้มเหลว: {e}")
+                row = None
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(self._next_wait())
+                continue
+            self._run_job(row)
+
+    def purge_finished(self, older_than=FINISHED_RETENTION_SECONDS):
+        """🧹 ลบงานที่จบแล้วและเก่ากว่าที่กำหนด"""
+        with self._db_lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, time.time() - older_than),
+            )
+
+    def start(self):
+        """▶️ เริ่ม worker และ heartbeat ต่ออายุ lease (งาน running ของ process อื่นถูกรับช่วงเมื่อ lease หมดอายุ)"""
+        if self._threads:
+            return
+        self.purge_finished()
+        self._stopping.clear()
+        heartbeat = threading.Thread(target=self._heartbeat, name="outbox-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"📮 เริ่ม outbox worker {self.workers} ตัว ({self.path})")
+
+    def stop(self, timeout=10.0):
+        """🛑 หยุด worker (งานที่กำลังทำจะทำจนเสร็จ งานที่เหลืออยู่ในคิวต่อ)"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
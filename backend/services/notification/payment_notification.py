@@ -1,30 +1,39 @@
+import logging
+
+from services.common.log import get_logger, log_event
 from .notification_service import NotificationService
-from datetime import datetime
+from .staff_digest import get_staff_digest
+from .messages import (
+    payment_due_message,
+    payment_status_message,
+    staff_payment_upload_message,
+)
+
+logger = get_logger("payment")
 
 class PaymentNotification:
-    def __init__(self, db, service_account_file):
-        self.notification_service = NotificationService(db, service_account_file)
+    def __init__(self, db, service_account_file, notification_service=None):
+        self.notification_service = notification_service or NotificationService(db, service_account_file)
 
     def notify_patient_about_payment_due(self, patient_id, amount):
         """🔔 แจ้งเตือนผู้ป่วยเกี่ยวกับค่ารักษาพยาบาลที่ต้องชำระ"""
-        patient_doc = self.notification_service.db.collection('User').document(patient_id).get()
+        patient_doc = self.notification_service.get_document('User', patient_id)
         if not patient_doc.exists:
             print(f"❌ ไม่พบผู้ป่วย ID: {patient_id}")
             return
 
-        tokens = patient_doc.to_dict().get('fcm_token', [])
+        tokens = self.notification_service.get_user_tokens(patient_id, patient_doc.to_dict())
         if not tokens:
             print("⚠️ ไม่มี FCM Token สำหรับผู้ป่วยนี้")
             return
 
-        title = "💳 แจ้งเตือนค่ารักษาพยาบาล"
-        body = f"คุณมีค่ารักษาพยาบาลจำนวน {amount} บาท กรุณาชำระเงิน"
+        title, body, data = payment_due_message(amount)
 
         is_sent = self.notification_service.send_fcm_notification(
             tokens=tokens,
             title=title,
             body=body,
-            data={"type": "PAYMENT_DUE", "amount": str(amount)},
+            data=data,
             role="Patient",
             recipient_id=patient_id
         )
@@ -37,21 +46,20 @@ class PaymentNotification:
 
     def notify_staff_about_patient_payment(self, patient_id, appointment_id, slip_url):
         """🔔 แจ้งเตือนเจ้าหน้าที่เมื่อผู้ป่วยอัปโหลดสลิปชำระเงิน"""
-        print("📡 [DEBUG] เริ่มการแจ้งเตือน Staff")
+        log_event(logger, "payment.notify_staff", "📡 เริ่มการแจ้งเตือน Staff", level=logging.DEBUG,
+                  patient_id=patient_id, appointment_id=appointment_id)
 
         # ✅ ค้นหา first_name และ last_name ของผู้ป่วยจาก User
-        patient_doc = self.notification_service.db.collection('User').document(patient_id).get()
+        patient_doc = self.notification_service.get_document('User', patient_id)
 
         if not patient_doc.exists:
             print(f"❌ ไม่พบข้อมูลผู้ป่วยจาก User collection: {patient_id}")
             return
 
         patient_data = patient_doc.to_dict()
-        patient_name = f"{patient_data.get('first_name', 'ไม่ทราบชื่อ')} {patient_data.get('last_name', '')}"
-        print(f"👤 [DEBUG] ผู้ป่วย: {patient_name}")
 
         # ✅ ค้นหา วันเวลานัดหมาย จาก Appointments
-        appointment_doc = self.notification_service.db.collection('Appointments').document(appointment_id).get()
+        appointment_doc = self.notification_service.get_document('Appointments', appointment_id)
 
         if not appointment_doc.exists:
             print(f"❌ ไม่พบนัดหมาย ID: {appointment_id}")
@@ -59,115 +67,58 @@ class PaymentNotification:
 
         appointment_data = appointment_doc.to_dict()
 
-        # 🗓️ จัดรูปแบบวันที่-เวลา
-        raw_date = appointment_data.get('appointment_date')
-        if isinstance(raw_date, datetime):
-            appointment_date = raw_date.strftime('%d %B %Y')  # เช่น 22 กุมภาพันธ์ 2025
-        else:
-            appointment_date = 'ไม่ระบุวันที่'
-
-        appointment_time = appointment_data.get('appointment_time', 'ไม่ระบุเวลา')
-
         # ✅ ค้นหา FCM Token ของเจ้าหน้าที่
-        staff_docs = self.notification_service.db.collection('User').where('role', '==', 'Staff').stream()
-        tokens = []
-        for doc in staff_docs:
-            tokens.extend(doc.to_dict().get('fcm_token', []))
-            print(f"🟡 [DEBUG] Staff FCM Token: {doc.to_dict().get('fcm_token', [])}")
+        tokens = self.notification_service.get_staff_tokens()
 
         if not tokens:
             print("⚠️ ไม่มี FCM Token ของเจ้าหน้าที่")
             return
 
         # 📝 สร้างข้อความแจ้งเตือน
-        title = "📩 แจ้งเตือน: ผู้ป่วยอัปโหลดสลิปชำระเงิน"
-        body = f"ผู้ป่วย {patient_name} ได้อัปโหลดสลิปสำหรับนัดหมายวันที่ {appointment_date} เวลา {appointment_time}"
-
-        # ✅ ส่งแจ้งเตือนผ่าน FCM
-        is_sent = self.notification_service.send_fcm_notification(
-            tokens=tokens,
-            title=title,
-            body=body,
-            data={
-                "type": "PAYMENT_UPLOAD",
-                "patient_id": patient_id,
-                "patient_name": patient_name,
-                "appointment_date": appointment_date,
-                "appointment_time": appointment_time,
-                "slip_url": slip_url
-            },
-            role="Staff",
-            recipient_id="all_staff"
+        title, body, data = staff_payment_upload_message(
+            patient_id, patient_data, appointment_data, slip_url, appointment_id=appointment_id
         )
 
-        # ✅ บันทึกลง Firestore ใน Notifications
+        # ✅ ส่งแจ้งเตือนผ่าน FCM (topic ของเจ้าหน้าที่ ถ้าพร้อม) ช่วงที่มีการอัปโหลดถี่ ๆ จะถูกรวมเป็น digest
+        is_sent = get_staff_digest(self.notification_service).submit("staff_payment_upload", title, body, data)
+
+        # ✅ บันทึกลง Notifications ทีละเหตุการณ์ให้แล้ว (รวมถึงเหตุการณ์ใน digest)
         if is_sent:
             print(f"✅ บันทึกการแจ้งเตือนเจ้าหน้าที่สำเร็จ")
-            self.notification_service.db.collection("Notifications").add({
-                "title": title,
-                "body": body,
-                "data": {
-                    "type": "PAYMENT_UPLOAD",
-                    "patient_id": patient_id,
-                    "patient_name": patient_name,
-                    "appointment_date": appointment_date,
-                    "appointment_time": appointment_time,
-                    "slip_url": slip_url
-                },
-                "role": "Staff",
-                "recipient_id": "all_staff",
-                "timestamp": datetime.now()
-            })
         else:
             print(f"❌ การแจ้งเตือนเจ้าหน้าที่ล้มเหลว")
-            
+
     def notify_patient_about_payment_status(self, patient_id, appointment_id, status):
         """🔔 แจ้งเตือนผู้ป่วยเมื่อเจ้าหน้าที่ยืนยันหรือปฏิเสธการชำระเงิน"""
 
         # ✅ ดึงข้อมูลวันและเวลานัดหมายจาก Firestore
-        appointment_doc = self.notification_service.db.collection('Appointments').document(appointment_id).get()
+        appointment_doc = self.notification_service.get_document('Appointments', appointment_id)
         if not appointment_doc.exists:
             print(f"❌ ไม่พบนัดหมาย ID: {appointment_id}")
             return
 
         appointment_data = appointment_doc.to_dict()
-        # 🗓️ จัดรูปแบบวันที่ให้สวยงาม
-        raw_date = appointment_data.get('appointment_date')
-        if isinstance(raw_date, datetime):
-            appointment_date = raw_date.strftime('%d %B %Y')  # เช่น 22 กุมภาพันธ์ 2025
-        else:
-            appointment_date = 'ไม่ระบุวันที่'
-
-        appointment_time = appointment_data.get('appointment_time', 'ไม่ระบุเวลา')
-
 
         # ✅ ดึง FCM Token ของผู้ป่วย
-        patient_doc = self.notification_service.db.collection('User').document(patient_id).get()
+        patient_doc = self.notification_service.get_document('User', patient_id)
         if not patient_doc.exists:
             print(f"❌ ไม่พบผู้ป่วย ID: {patient_id}")
             return
 
-        tokens = patient_doc.to_dict().get('fcm_token', [])
+        tokens = self.notification_service.get_user_tokens(patient_id, patient_doc.to_dict())
         if not tokens:
             print("⚠️ ไม่มี FCM Token สำหรับผู้ป่วยนี้")
             return
 
         # 📩 สร้างข้อความแจ้งเตือน
-        title = "💳 สถานะการชำระเงิน"
-        body = f"สถานะการชำระเงินสำหรับนัดหมายวันที่ {appointment_date} เวลา {appointment_time}: {status}"
+        title, body, data = payment_status_message(appointment_id, appointment_data, status)
 
         # 🚀 ส่งแจ้งเตือนผ่าน FCM
         is_sent = self.notification_service.send_fcm_notification(
             tokens=tokens,
             title=title,
             body=body,
-            data={
-                "type": "PAYMENT_STATUS",
-                "appointment_id": appointment_id,
-                "appointment_date": str(appointment_date),
-                "appointment_time": str(appointment_time),
-                "status": status
-            },
+            data=data,
             role="Patient",
             recipient_id=patient_id
         )
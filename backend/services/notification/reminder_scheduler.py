@@ -0,0 +1,282 @@
+import datetime
+import heapq
+import itertools
+import os
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from services.common.lease import ACQUIRED, HELD, FirestoreLease
+from services.common.metrics import REMINDER_DURATION, record_firestore
+from services.notification.messages import format_appointment_date
+from services.notification.notify_upcoming_appointments import send_appointment_reminders
+
+# แจ้งเตือนล่วงหน้าก่อนเวลานัดกี่ชั่วโมง
+REMINDER_LEAD_HOURS = float(os.environ.get("REMINDER_LEAD_HOURS", "24"))
+# appointment_date เก็บเป็นเที่ยงคืนของวันนัดตามเวลาท้องถิ่น ส่วนเวลาอยู่ใน appointment_time (HH:MM)
+REMINDER_TIMEZONE = os.environ.get("REMINDER_TIMEZONE", "Asia/Bangkok")
+# lease ต่อ reminder กันไม่ให้หลาย worker / replica ส่งซ้ำ
+REMINDER_SEND_LEASE_TTL = 300.0
+# ส่งไม่สำเร็จแล้วลองใหม่หลังจากนี้ (วินาที)
+REMINDER_RETRY_DELAY = 60.0
+# lease ของ reminder ที่ส่งแล้วเก็บไว้กันส่งซ้ำจนเลยเวลานัดไปเท่านี้ แล้วให้ TTL ของ Firestore ลบทิ้ง
+REMINDER_LEASE_RETENTION = datetime.timedelta(days=1)
+CANCELLED_STATUSES = {'ยกเลิก'}
+
+
+def appointment_start(data, tz):
+    """🕘 เวลาเริ่มนัด (timezone-aware) จาก appointment_date + appointment_time หรือ None ถ้าข้อมูลไม่ครบ"""
+    raw_date = data.get('appointment_date')
+    raw_time = data.get('appointment_time')
+    if not isinstance(raw_date, datetime.datetime) or not isinstance(raw_time, str):
+        return None
+    try:
+        hour, minute = (int(part) for part in raw_time.strip().split(':')[:2])
+    except ValueError:
+        return None
+    if raw_date.tzinfo is None:
+        raw_date = raw_date.replace(tzinfo=datetime.timezone.utc)
+    local_date = raw_date.astimezone(tz).date()
+    return datetime.datetime(local_date.year, local_date.month, local_date.day, hour, minute, tzinfo=tz)
+
+
+def _day_label(start, now):
+    days = (start.date() - now.date()).days
+    if days == 0:
+        return 'วันนี้'
+    if days == 1:
+        return 'วันพรุ่งนี้'
+    return f'วันที่ {format_appointment_date(start.replace(tzinfo=None))}'
+
+
+class ReminderScheduler:
+    """⏰ ตั้งเวลาแจ้งเตือนนัดหมายรายตัวบน heap ในหน่วยความจำ
+
+    โหลดนัดหมายที่ยังไม่ถึงครั้งเดียวผ่าน snapshot listener แล้วรับเฉพาะการเปลี่ยนแปลง
+    (สร้าง / เลื่อน / ยกเลิก) มาอัปเดต heap; แต่ละ reminder ยิงก่อนเวลานัด lead_time
+    และถือ lease ต่อ reminder จึงรันหลาย process พร้อมกันได้โดยผู้ป่วยได้รับครั้งเดียว
+    listener ถูกสร้างใหม่ทุกเที่ยงคืน (เวลาท้องถิ่น) ให้ขอบล่าง appointment_date >= วันนี้ เลื่อนตามไปด้วย
+    """
+
+    def __init__(self, db, lead_time=None, timezone=REMINDER_TIMEZONE, lease=None):
+        self.db = db
+        self.lead_time = lead_time or datetime.timedelta(hours=REMINDER_LEAD_HOURS)
+        self.tz = ZoneInfo(timezone)
+        self.lease = lease or FirestoreLease(db)
+        # heap ของ (fire_at, seq, appointment_id); รายการที่ถูกแทนที่จะถูกข้ามตอน pop (lazy deletion)
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._watch = None
+        self._next_rewatch = float('inf')
+        self._thread = None
+        self.fired = 0
+
+    def start(self):
+        """▶️ เริ่มฟัง Appointments และเริ่ม thread ที่ยิง reminder (เรียกซ้ำได้)"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+            self._thread.start()
+        self._subscribe()
+
+    def _subscribe(self):
+        """👂 ฟัง Appointments ตั้งแต่วันนี้เป็นต้นไป (เปิด listener ใหม่ก่อนค่อยปิดตัวเดิม จะได้ไม่พลาดการเปลี่ยนแปลง)"""
+        today = datetime.datetime.now(self.tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        query = self.db.collection('Appointments').where('appointment_date', '>=', today)
+        watch = query.on_snapshot(self._on_snapshot)
+        tomorrow = (today + datetime.timedelta(days=1)).date()
+        midnight = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=self.tz)
+        with self._cond:
+            if self._stopped:
+                # stop() ถูกเรียกระหว่างเปิด listener
+                previous = watch
+            else:
+                previous, self._watch = self._watch, watch
+                self._next_rewatch = midnight.timestamp()
+                self._cond.notify()
+        if previous is not None:
+            previous.unsubscribe()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            watch, self._watch = self._watch, None
+            thread, self._thread = self._thread, None
+        if watch is not None:
+            watch.unsubscribe()
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def pending(self):
+        with self._cond:
+            return len(self._entries)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        record_firestore('Appointments', 'read', len(changes))
+        with self._cond:
+            for change in changes:
+                appointment_id = change.document.id
+                if change.type.name == 'REMOVED':
+                    self._entries.pop(appointment_id, None)
+                else:
+                    self._upsert_locked(appointment_id, change.document.to_dict())
+            if len(self._heap) > 2 * len(self._entries) + 1024:
+                self._compact_locked()
+            self._cond.notify()
+        print(f"⏰ อัปเดต reminder จาก Appointments {len(changes)} รายการ (รอส่ง {len(self._entries)})")
+
+    def _upsert_locked(self, appointment_id, data):
+        start = appointment_start(data, self.tz)
+        if (
+            start is None
+            or not data.get('patient_id')
+            or data.get('status') in CANCELLED_STATUSES
+            or start <= datetime.datetime.now(self.tz)
+        ):
+            # ยกเลิก / ข้อมูลไม่ครบ / เลยเวลานัดแล้ว -> ไม่ต้องเตือน
+            self._entries.pop(appointment_id, None)
+            return
+
+        fire_at = (start - self.lead_time).timestamp()
+        current = self._entries.get(appointment_id)
+        if current is not None and current[0] == fire_at and current[2] == data['patient_id']:
+            return
+
+        seq = next(self._seq)
+        self._entries[appointment_id] = (fire_at, seq, data['patient_id'], data['appointment_time'], start)
+        heapq.heappush(self._heap, (fire_at, seq, appointment_id))
+
+    def _compact_locked(self):
+        self._heap = [(entry[0], entry[1], appointment_id) for appointment_id, entry in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_due_locked(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, seq, appointment_id = heapq.heappop(self._heap)
+            entry = self._entries.get(appointment_id)
+            if entry is None or entry[1] != seq:
+                continue
+            del self._entries[appointment_id]
+            due.append((appointment_id, entry))
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.time()
+                    if (self._heap and self._heap[0][0] <= now) or now >= self._next_rewatch:
+                        break
+                    wake_at = min(self._heap[0][0] if self._heap else float('inf'), self._next_rewatch)
+                    self._cond.wait(wake_at - now if wake_at != float('inf') else None)
+                if self._stopped:
+                    return
+                due = self._pop_due_locked(time.time())
+                rewatch = time.time() >= self._next_rewatch
+            if rewatch:
+                try:
+                    self._subscribe()
+                    print("⏰ เปิด listener ของ Appointments ใหม่สำหรับวันนี้")
+                except Exception as e:
+                    print(f"⚠️ เปิด listener ของ Appointments ใหม่ไม่สำเร็จ ลองใหม่ใน {REMINDER_RETRY_DELAY:.0f} วินาที: {e}")
+                    with self._cond:
+                        self._next_rewatch = time.time() + REMINDER_RETRY_DELAY
+            if due:
+                started = time.monotonic()
+                try:
+                    self._fire(due)
+                except Exception as e:
+                    print(f"❌ ส่ง reminder ล้มเหลว: {e}")
+                REMINDER_DURATION.labels('scheduler').observe(time.monotonic() - started)
+
+    def _retry_later(self, items, delay=REMINDER_RETRY_DELAY):
+        fire_at = time.time() + delay
+        with self._cond:
+            for _, appointment_id, patient_id, appointment_time, start in items:
+                # ถ้านัดถูกเลื่อน / ยกเลิกระหว่างส่ง snapshot ใหม่เป็นตัวกำหนดแทน
+                if appointment_id in self._entries:
+                    continue
+                seq = next(self._seq)
+                self._entries[appointment_id] = (fire_at, seq, patient_id, appointment_time, start)
+                heapq.heappush(self._heap, (fire_at, seq, appointment_id))
+            self._cond.notify()
+
+    def _fire(self, due):
+        """🚀 ส่ง reminder ที่ถึงเวลา (จัดกลุ่มตามคำว่า วันนี้ / วันพรุ่งนี้ แล้วส่งแบบ batch)
+
+        ล้มเหลวก่อนเริ่มส่ง -> ปล่อย lease แล้วลองใหม่ / เริ่มส่งแล้ว -> บันทึกว่าเสร็จเสมอ (ไม่ส่งซ้ำ)
+        lease ถูก process อื่นถืออยู่ -> กลับมาดูใหม่หลัง REMINDER_SEND_LEASE_TTL (ไม่ทิ้ง reminder)
+        """
+        now = datetime.datetime.now(self.tz)
+        groups = {}
+        retry = []
+        held = []
+        for appointment_id, (fire_at, _, patient_id, appointment_time, start) in due:
+            if start <= now:
+                continue
+            name = f"appointment-reminder-{appointment_id}-{start.strftime('%Y%m%d%H%M')}"
+            item = (name, appointment_id, patient_id, appointment_time, start)
+            try:
+                state = self.lease.try_acquire(name, REMINDER_SEND_LEASE_TTL)
+            except Exception as e:
+                print(f"⚠️ ถือ lease ของ reminder {appointment_id} ไม่สำเร็จ: {e}")
+                retry.append(item)
+                continue
+            if state == HELD:
+                # process อื่นกำลังส่งอยู่: กลับมาดูอีกครั้งเมื่อ lease ของเขาหมดอายุ
+                # (ถ้าเขาส่งเสร็จจะได้ DONE แล้วข้ามไป ถ้าเขาตายระหว่างส่งเราจะรับไปส่งต่อ)
+                held.append(item)
+                continue
+            if state != ACQUIRED:
+                continue
+            groups.setdefault(_day_label(start, now), []).append(item)
+        if retry:
+            self._retry_later(retry)
+        if held:
+            self._retry_later(held, delay=REMINDER_SEND_LEASE_TTL)
+
+        for when, items in groups.items():
+            progress = {"sending": False}
+
+            def before_batch():
+                progress["sending"] = True
+                return True
+
+            try:
+                stats = send_appointment_reminders([(item[2], item[3]) for item in items], when,
+                                                   before_batch=before_batch)
+            except Exception as e:
+                if progress["sending"]:
+                    print(f"❌ ส่ง reminder {len(items)} รายการล้มเหลวระหว่างส่ง (ไม่ส่งซ้ำ): {e}")
+                    stats = None
+                else:
+                    print(f"❌ ส่ง reminder {len(items)} รายการล้มเหลว ลองใหม่ใน {REMINDER_RETRY_DELAY:.0f} วินาที: {e}")
+                    for name, *_ in items:
+                        self._release(name)
+                    self._retry_later(items)
+                    continue
+            for name, _, _, _, start in items:
+                self._complete(name, start)
+            self.fired += len(items)
+            if stats is not None:
+                print(f"⏰ ส่ง reminder นัดหมาย{when} {len(items)} รายการ: สำเร็จ {stats['sent']}, ล้มเหลว {stats['failed']}")
+
+    def _release(self, name):
+        try:
+            self.lease.release(name)
+        except Exception as e:
+            # lease หมดอายุเองภายใน REMINDER_SEND_LEASE_TTL
+            print(f"⚠️ ปล่อย lease {name} ไม่สำเร็จ: {e}")
+
+    def _complete(self, name, start):
+        try:
+            self.lease.complete(name, expire_at=start.astimezone(datetime.timezone.utc) + REMINDER_LEASE_RETENTION)
+        except Exception as e:
+            print(f"⚠️ บันทึกว่า reminder {name} ส่งแล้วไม่สำเร็จ: {e}")
@@ -1,70 +1,49 @@
-from datetime import datetime
+from services.common.circuit_breaker import CircuitOpenError
 from services.notification.notification_service import NotificationService
+from services.notification.staff_digest import get_staff_digest
+from services.notification.messages import (
+    doctor_display_name,
+    schedule_change_request_message,
+    schedule_request_submitted_message,
+)
 
 class ScheduleNotification:
-    def __init__(self, db, service_account_file):
+    def __init__(self, db, service_account_file, notification_service=None):
         self.db = db
-        self.notification_service = NotificationService(db, service_account_file)
+        self.notification_service = notification_service or NotificationService(db, service_account_file)
 
     def notify_staff_about_schedule_change_request(self, doctor_id, schedule_date, schedule_time, reason):
         """🔔 แจ้งเตือนเจ้าหน้าที่เมื่อแพทย์ส่งคำร้องขอเปลี่ยนตารางเวร"""
         try:
             # ✅ 1. ค้นหาชื่อแพทย์จาก User collection
-            doctor_doc = self.db.collection('User').document(doctor_id).get()
+            doctor_doc = self.notification_service.get_document('User', doctor_id)
             if not doctor_doc.exists:
                 print(f"⚠️ ไม่พบข้อมูลแพทย์สำหรับ doctor_id: {doctor_id}")
-                doctor_name = f"แพทย์ (รหัส: {doctor_id})"
+                doctor_name = doctor_display_name(None, doctor_id)
             else:
-                doctor_data = doctor_doc.to_dict()
-                first_name = doctor_data.get('first_name', 'ไม่ทราบชื่อ')
-                last_name = doctor_data.get('last_name', 'ไม่ทราบนามสกุล')
-                doctor_name = f"แพทย์ {first_name} {last_name}"
-
-            # ✅ 2. จัดรูปแบบวันที่
-            if isinstance(schedule_date, datetime):  # ✅ แก้ไขตรงนี้
-                formatted_date = schedule_date.strftime('%d %B %Y')  # ✅ เช่น "17 กุมภาพันธ์ 2025"
-            else:
-                formatted_date = 'ไม่ระบุวันที่'
-
-            formatted_time = schedule_time if schedule_time else "ไม่ระบุเวลา"
+                doctor_name = doctor_display_name(doctor_doc.to_dict(), doctor_id)
 
-            # ✅ 3. ดึง FCM Tokens ของเจ้าหน้าที่
-            staff_docs = self.db.collection('User').where('role', '==', 'Staff').stream()
-            tokens = []
-            for doc in staff_docs:
-                user_data = doc.to_dict()
-                tokens.extend(user_data.get('fcm_token', []))
+            # ✅ 2. ดึง FCM Tokens ของเจ้าหน้าที่
+            tokens = self.notification_service.get_staff_tokens()
 
             if not tokens:
                 print("⚠️ ไม่มี FCM token ของเจ้าหน้าที่")
                 return False
 
-            # ✅ 4. ปรับเนื้อหาแจ้งเตือนเป็นชื่อแพทย์
-            title = "📅 คำร้องขอเปลี่ยนตารางเวร"
-            body = (
-                f"{doctor_name} ขอเปลี่ยนตารางเวร "
-                f"วันที่ {formatted_date} เวลา {formatted_time} "
-                f"เหตุผล: {reason}"
+            # ✅ 3. ปรับเนื้อหาแจ้งเตือนเป็นชื่อแพทย์ (วันที่/เวลาจัดรูปแบบใน builder)
+            title, body, data = schedule_change_request_message(
+                doctor_name, schedule_date, schedule_time, reason, doctor_id=doctor_id
             )
 
-            # ✅ 5. ส่งแจ้งเตือนผ่าน FCM
-            self.notification_service.send_fcm_notification(
-                tokens,
-                title,
-                body,
-                {
-                    "type": "SCHEDULE_CHANGE_REQUEST",
-                    "doctor_name": doctor_name,
-                    "schedule_date": formatted_date,
-                    "schedule_time": formatted_time,
-                },
-                role="Staff",
-                recipient_id="all_staff"
-            )
+            # ✅ 4. ส่งแจ้งเตือนผ่าน FCM (topic ของเจ้าหน้าที่ ถ้าพร้อม) คำร้องที่เข้ามาถี่ ๆ จะถูกรวมเป็น digest
+            get_staff_digest(self.notification_service).submit("schedule_change_request", title, body, data)
 
             print("✅ แจ้งเตือนคำร้องขอเปลี่ยนตารางเวรสำเร็จ")
             return True
 
+        except CircuitOpenError:
+            # ให้ route ตอบ 503 / ให้ outbox เลื่อนงาน แทนการนับว่าแจ้งเตือนล้มเหลว
+            raise
         except Exception as e:
             print(f"❌ เกิดข้อผิดพลาดในการแจ้งเตือน: {e}")
             return False
@@ -73,37 +52,27 @@ class ScheduleNotification:
         """🔔 แจ้งเตือนแพทย์เมื่อส่งคำขอเปลี่ยนตารางเวรสำเร็จ"""
         try:
             # ✅ 1. ดึง FCM Token ของแพทย์
-            doctor_doc = self.db.collection('User').document(doctor_id).get()
+            doctor_doc = self.notification_service.get_document('User', doctor_id)
             if not doctor_doc.exists:
                 print(f"⚠️ ไม่พบข้อมูลแพทย์สำหรับ doctor_id: {doctor_id}")
                 return False
 
             doctor_data = doctor_doc.to_dict()
-            tokens = doctor_data.get('fcm_token', [])
+            tokens = self.notification_service.get_user_tokens(doctor_id, doctor_data)
 
             if not tokens:
                 print(f"⚠️ ไม่มี FCM token ของแพทย์ {doctor_id}")
                 return False
 
             # ✅ 2. สร้างข้อความแจ้งเตือน
-            title = "📨 คำขอเปลี่ยนตารางเวรถูกส่งแล้ว"
-            body = (
-                f"คำขอเปลี่ยนตารางเวรของคุณถูกส่งสำเร็จ "
-                f"วันที่ {schedule_date} เวลา {schedule_time} "
-                "กรุณารอการตรวจสอบจากเจ้าหน้าที่"
-            )
+            title, body, data = schedule_request_submitted_message(schedule_date, schedule_time)
 
             # ✅ 3. ส่งแจ้งเตือน FCM
             self.notification_service.send_fcm_notification(
                 tokens,
                 title,
                 body,
-                {
-                    "type": "SCHEDULE_REQUEST_SUBMITTED",
-                    "schedule_date": schedule_date,
-                    "schedule_time": schedule_time,
-                    "status": "pending"
-                },
+                data,
                 role="Doctor",
                 recipient_id=doctor_id
             )
@@ -122,6 +91,9 @@ class ScheduleNotification:
             print(f"✅ แจ้งเตือนแพทย์ {doctor_id} สำเร็จ")
             return True
 
+        except CircuitOpenError:
+            # ให้ route ตอบ 503 / ให้ outbox เลื่อนงาน แทนการนับว่าแจ้งเตือนล้มเหลว
+            raise
         except Exception as e:
             print(f"❌ แจ้งเตือนแพทย์ล้มเหลว: {e}")
             return False
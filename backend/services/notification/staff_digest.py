@@ -0,0 +1,347 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from services.common.circuit_breaker import CircuitOpenError
+from services.common.lease import default_owner_id
+from services.common.metrics import record_staff_digest, register_gauge
+from .messages import schedule_change_digest_message, staff_payment_digest_message
+from .outbox import OUTBOX_PATH
+
+# ช่วงเวลารวมแจ้งเตือน (วินาที) ต่อชนิด; 0 = ส่งทันทีทุกเหตุการณ์แบบเดิม
+DIGEST_WINDOWS = {
+    "staff_payment_upload": float(os.environ.get("STAFF_DIGEST_WINDOW_PAYMENT_UPLOAD", "30")),
+    "schedule_change_request": float(os.environ.get("STAFF_DIGEST_WINDOW_SCHEDULE_CHANGE", "60")),
+}
+# สร้างข้อความสรุปจาก data ของแต่ละเหตุการณ์
+DIGEST_BUILDERS = {
+    "staff_payment_upload": staff_payment_digest_message,
+    "schedule_change_request": schedule_change_digest_message,
+}
+# รวมได้สูงสุดเท่านี้ต่อ digest ถ้าครบก่อนหมดช่วงเวลาให้ส่งทันที
+DIGEST_MAX_EVENTS = int(os.environ.get("STAFF_DIGEST_MAX_EVENTS", "100"))
+# ส่ง digest ไม่สำเร็จแล้วลองใหม่ (backoff = DELAY * 2^(attempts-1)) จนครบ MAX_ATTEMPTS ครั้ง
+DIGEST_RETRY_DELAY = 30.0
+DIGEST_MAX_ATTEMPTS = 5
+# เหตุการณ์ที่รออยู่เก็บในไฟล์ SQLite เดียวกับ outbox พร้อม lease ของ process ที่ถือไว้
+# ถ้า process ตายก่อนส่ง process อื่น (หรือตัวใหม่หลังรีสตาร์ต) รับไปส่งต่อเมื่อ lease หมดอายุ
+DIGEST_LEASE_SECONDS = float(os.environ.get("STAFF_DIGEST_LEASE", "60"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS staff_digest_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    data TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS staff_digest_events_lease ON staff_digest_events (lease_expires_at);
+"""
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class _Window:
+    """ช่วงรวมแจ้งเตือนที่เปิดอยู่ของชนิดหนึ่ง: ส่งรอบถัดไปเมื่อถึง until"""
+
+    def __init__(self, until):
+        self.until = until
+        # (event_id, title, body, data, attempts)
+        self.events = []
+
+
+class DigestEventStore:
+    """💾 เก็บเหตุการณ์ที่รอรวมเป็น digest ลง SQLite ให้อยู่รอดแม้ process ตาย
+
+    แต่ละแถวผูกกับ owner ของ process ที่รับเหตุการณ์ไว้ และ lease ที่ต้อง renew เป็นระยะ
+    แถวที่ lease หมดอายุ (เจ้าของหายไป) ถูก process อื่นรับไปส่งต่อด้วย adopt
+    """
+
+    def __init__(self, path=OUTBOX_PATH, lease_seconds=DIGEST_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = max(1.0, float(lease_seconds))
+        self.owner = default_owner_id()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def add(self, kind, title, body, data):
+        """➕ บันทึกเหตุการณ์หนึ่งรายการ (process นี้ถือไว้) แล้วคืน event id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO staff_digest_events (kind, title, body, data, owner, lease_expires_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, title, body, json.dumps(data, ensure_ascii=False), self.owner, now + self.lease_seconds, now),
+            )
+        return cursor.lastrowid
+
+    def renew(self):
+        """🔁 ต่ออายุ lease ของทุกเหตุการณ์ที่ process นี้ถืออยู่"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE staff_digest_events SET lease_expires_at = ? WHERE owner = ?",
+                (time.time() + self.lease_seconds, self.owner),
+            )
+
+    def adopt(self):
+        """🤝 รับเหตุการณ์ที่ lease หมดอายุแล้ว (ของ process ที่ตายไป) -> [(kind, event), ...]"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, kind, title, body, data, attempts FROM staff_digest_events "
+                    "WHERE (lease_expires_at IS NULL OR lease_expires_at <= ?) AND (owner IS NULL OR owner != ?) "
+                    "ORDER BY id",
+                    (now, self.owner),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE staff_digest_events SET owner = ?, lease_expires_at = ? WHERE id = ?",
+                    [(self.owner, now + self.lease_seconds, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(kind, (event_id, title, body, json.loads(data), attempts))
+                for event_id, kind, title, body, data, attempts in rows]
+
+    def mark_failed(self, event_ids):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE staff_digest_events SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in event_ids]
+            )
+
+    def remove(self, event_ids):
+        """🗑️ ลบเหตุการณ์ที่ส่งแล้ว (หรือเลิกลองแล้ว)"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM staff_digest_events WHERE id = ?", [(i,) for i in event_ids])
+
+
+class StaffDigest:
+    """📬 รวมแจ้งเตือนเจ้าหน้าที่ที่เกิดถี่ ๆ (อัปโหลดสลิป / คำร้องขอเปลี่ยนตารางเวร) เป็น digest เดียวต่อช่วงเวลา
+
+    เหตุการณ์แรกหลังจากเงียบไปส่งทันทีและเปิดช่วงเวลาของชนิดนั้น เหตุการณ์ที่ตามมาในช่วงเดียวกันถูกเก็บไว้
+    เมื่อหมดช่วง: มีรายการเดียวส่งข้อความเดิม, หลายรายการส่งข้อความสรุป เช่น "มีสลิปชำระเงินใหม่ 5 รายการ"
+    แล้วเปิดช่วงใหม่ต่อ (ช่วงปิดเมื่อหมดเวลาโดยไม่มีเหตุการณ์ใหม่) จึงส่งไม่เกินหนึ่งครั้งต่อช่วงต่อชนิด
+    ทุกเหตุการณ์ยังมีบันทึกแจ้งเตือนของตัวเอง (data มี digest_id ของข้อความที่ส่งจริง)
+    เหตุการณ์ที่รออยู่ถูกบันทึกลง DigestEventStore ก่อนตอบรับ และลบออกเมื่อส่งสำเร็จเท่านั้น
+    ส่งไม่สำเร็จจะถูกเก็บกลับเข้าช่วงถัดไปแบบ backoff จนครบ DIGEST_MAX_ATTEMPTS ครั้ง
+    """
+
+    def __init__(self, notification_service, windows=None, store=None):
+        self.notification_service = notification_service
+        self.windows = dict(DIGEST_WINDOWS if windows is None else windows)
+        self.store = store or DigestEventStore()
+        self._open = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._next_renew = 0.0
+        register_gauge('medibridge_staff_digest_pending', 'Staff notification events waiting for their digest',
+                       self.pending)
+
+    def start(self):
+        """▶️ เริ่ม worker ที่ส่ง digest เมื่อหมดช่วงเวลา และรับเหตุการณ์ค้างจาก process ก่อนหน้า (เรียกซ้ำได้)"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._next_renew = 0.0
+            self._thread = threading.Thread(target=self._run, name="staff-digest", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """⏹️ หยุด worker แล้วส่งทุกเหตุการณ์ที่ยังรออยู่ทันที (ที่ส่งไม่สำเร็จยังอยู่ใน store ให้ process ถัดไป)"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+    def pending(self):
+        with self._cond:
+            return sum(len(window.events) for window in self._open.values())
+
+    def submit(self, kind, title, body, data=None):
+        """📨 แจ้งเตือนเจ้าหน้าที่หนึ่งเหตุการณ์: ส่งทันทีถ้าไม่มีช่วงเปิดอยู่ ไม่งั้นบันทึกลง store แล้วรอ digest
+
+        คืนผลการส่ง (ถ้าส่งทันที) หรือ True เมื่อรับเข้า digest แล้ว
+        raise CircuitOpenError จากการส่งทันที (ให้ route ตอบ 503 / ให้ outbox เลื่อนงาน)
+        """
+        window_seconds = self.windows.get(kind, 0)
+        if window_seconds <= 0:
+            record_staff_digest(kind, 'immediate')
+            return self.notification_service.send_staff_broadcast(title, body, data)
+
+        now = time.monotonic()
+        with self._cond:
+            window = self._open.get(kind)
+            if window is not None:
+                # บันทึกก่อนตอบรับ เหตุการณ์จึงไม่หายแม้ process ตายก่อนหมดช่วง
+                event_id = self.store.add(kind, title, body, data or {})
+                window.events.append((event_id, title, body, data or {}, 0))
+                if len(window.events) >= DIGEST_MAX_EVENTS:
+                    window.until = now
+                    self._cond.notify()
+                return True
+            # เปิดช่วงก่อนส่ง เพื่อให้เหตุการณ์ที่เข้ามาระหว่างนี้ถูกเก็บรอ
+            self._open[kind] = _Window(now + window_seconds)
+            self._cond.notify()
+        self.start()
+
+        record_staff_digest(kind, 'immediate')
+        return self.notification_service.send_staff_broadcast(title, body, data)
+
+    def flush(self, kind=None):
+        """🚿 ส่งเหตุการณ์ที่รออยู่ทันที (ทุกชนิด หรือเฉพาะ kind) และปิดช่วงเวลา"""
+        with self._cond:
+            kinds = [kind] if kind is not None else list(self._open)
+            batches = [(k, self._open.pop(k).events) for k in kinds if k in self._open]
+        for k, events in batches:
+            if not events:
+                continue
+            try:
+                self._send(k, events)
+            except CircuitOpenError as e:
+                print(f"⚠️ ส่ง digest {k} ไม่ได้ (circuit เปิดอยู่) เก็บไว้ {len(events)} รายการ: {e}")
+            except Exception as e:
+                print(f"❌ ส่ง digest {k} ไม่สำเร็จ เก็บไว้ {len(events)} รายการ: {e}")
+                self.store.mark_failed([event[0] for event in events])
+
+    def _send(self, kind, events):
+        """📢 ส่งเหตุการณ์ที่เก็บไว้ (รายการเดียว = ข้อความเดิม, หลายรายการ = digest) และลบออกจาก store เมื่อสำเร็จ
+
+        ส่งไม่สำเร็จ raise exception (CircuitOpenError หรืออื่น ๆ) เหตุการณ์ยังอยู่ใน store ให้ผู้เรียกเก็บไว้ลองใหม่
+        """
+        digest_id = uuid.uuid4().hex
+        if len(events) == 1:
+            _, title, body, data, _ = events[0]
+            records = None
+            data = dict(data, digest_id=digest_id)
+        else:
+            title, body, data = DIGEST_BUILDERS[kind]([event[3] for event in events])
+            data = dict(data, digest_id=digest_id)
+            records = [
+                {"title": event_title, "body": event_body, "data": dict(event_data, digest_id=digest_id)}
+                for _, event_title, event_body, event_data, _ in events
+            ]
+
+        if not self.notification_service.send_staff_broadcast(title, body, data, records=records):
+            raise RuntimeError("send_staff_broadcast returned False")
+        self.store.remove([event[0] for event in events])
+        record_staff_digest(kind, 'single' if len(events) == 1 else 'digest', len(events))
+        print(f"📬 ส่งแจ้งเตือนเจ้าหน้าที่ {kind} รวม {len(events)} รายการ")
+
+    def _requeue(self, kind, events, delay):
+        """🔁 เก็บเหตุการณ์กลับไว้หน้าคิวของช่วงถัดไป โดยเลื่อนออกไปอย่างน้อย delay วินาที"""
+        with self._cond:
+            window = self._open.setdefault(kind, _Window(0))
+            window.events[:0] = events
+            window.until = max(window.until, time.monotonic() + delay)
+            self._cond.notify()
+
+    def _retry_or_drop(self, kind, events, error):
+        """❌ นับความล้มเหลว แล้วคืนเหตุการณ์เข้าคิวแบบ backoff (ทิ้งเฉพาะที่ครบ DIGEST_MAX_ATTEMPTS แล้ว)"""
+        self.store.mark_failed([event[0] for event in events])
+        events = [(event_id, title, body, data, attempts + 1) for event_id, title, body, data, attempts in events]
+        retry = [event for event in events if event[4] < DIGEST_MAX_ATTEMPTS]
+        dropped = [event for event in events if event[4] >= DIGEST_MAX_ATTEMPTS]
+        if dropped:
+            self.store.remove([event[0] for event in dropped])
+            record_staff_digest(kind, 'dropped', len(dropped))
+            print(f"❌ ทิ้งแจ้งเตือนเจ้าหน้าที่ {kind} {len(dropped)} รายการหลังส่งไม่สำเร็จ {DIGEST_MAX_ATTEMPTS} ครั้ง: {error}")
+        if retry:
+            attempts = max(event[4] for event in retry)
+            delay = DIGEST_RETRY_DELAY * (2 ** (attempts - 1))
+            print(f"⚠️ ส่ง digest {kind} ไม่สำเร็จ ({len(retry)} รายการ) ลองใหม่ใน {delay:.0f} วินาที: {error}")
+            self._requeue(kind, retry, delay)
+
+    def _due(self, now):
+        """🕰️ ดึงเหตุการณ์ของช่วงที่หมดเวลาแล้ว (ปิดช่วงที่ไม่มีเหตุการณ์ ช่วงที่มีให้เปิดต่ออีกรอบ)"""
+        due = []
+        for kind, window in list(self._open.items()):
+            if window.until > now:
+                continue
+            if not window.events:
+                del self._open[kind]
+                continue
+            due.append((kind, window.events))
+            window.events = []
+            window.until = now + self.windows.get(kind, 0)
+        return due
+
+    def _maintain(self):
+        """🫀 ต่ออายุ lease ของเหตุการณ์ที่ถืออยู่ และรับเหตุการณ์ค้างของ process ที่ตายไปมาส่งต่อ"""
+        try:
+            self.store.renew()
+            adopted = self.store.adopt()
+        except Exception as e:
+            print(f"⚠️ อ่าน/ต่ออายุเหตุการณ์ digest ที่ค้างอยู่ไม่สำเร็จ: {e}")
+            return
+        if adopted:
+            print(f"♻️ รับแจ้งเตือนเจ้าหน้าที่ที่ค้างส่ง {len(adopted)} รายการมาส่งต่อ")
+        now = time.monotonic()
+        with self._cond:
+            for kind, event in adopted:
+                window = self._open.setdefault(kind, _Window(now))
+                window.events.append(event)
+                window.until = min(window.until, now)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    if now >= self._next_renew:
+                        self._next_renew = now + self.store.lease_seconds / 3
+                        due = None
+                        break
+                    due = self._due(now)
+                    if due:
+                        break
+                    deadlines = [window.until for window in self._open.values()] + [self._next_renew]
+                    self._cond.wait(max(0.0, min(deadlines) - now))
+
+            if due is None:
+                self._maintain()
+                continue
+            for kind, events in due:
+                try:
+                    self._send(kind, events)
+                except CircuitOpenError as e:
+                    # ไม่นับเป็นความพยายาม รอจน breaker พร้อมอีกครั้ง
+                    print(f"⚠️ ส่ง digest {kind} ไม่ได้ (circuit เปิดอยู่) ลองใหม่ใน {e.retry_after:.0f} วินาที")
+                    self._requeue(kind, events, e.retry_after)
+                except Exception as e:
+                    self._retry_or_drop(kind, events, e)
+
+
+def get_staff_digest(notification_service):
+    """♻️ คืน StaffDigest ตัวเดียวต่อ NotificationService ทั้ง process"""
+    digest = _digests.get(id(notification_service))
+    if digest is None:
+        with _digests_lock:
+            digest = _digests.get(id(notification_service))
+            if digest is None:
+                digest = StaffDigest(notification_service)
+                _digests[id(notification_service)] = digest
+    return digest
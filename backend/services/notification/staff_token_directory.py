@@ -0,0 +1,160 @@
+import os
+import threading
+
+from services.common.metrics import record_firestore
+from .token_index import TOKEN_INDEX_COLLECTION, get_token_index, is_stale, normalize_tokens
+
+# รอ snapshot แรกได้นานสุดเท่านี้ (วินาที) ก่อนจะอ่าน Firestore ตรงแทน
+INITIAL_SNAPSHOT_TIMEOUT = 5.0
+
+# แหล่ง token ของเจ้าหน้าที่: registry = ทะเบียน FcmTokens, user = User.fcm_token เดิม,
+# auto = ใช้ทะเบียนเมื่อมี token ของ Staff อยู่แล้ว (รัน backfill แล้ว) ไม่เช่นนั้นใช้ User
+STAFF_TOKEN_SOURCE = os.environ.get("STAFF_TOKEN_SOURCE", "auto")
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+class StaffTokenDirectory:
+    """👥 เก็บ FCM token ของเจ้าหน้าที่ไว้ในหน่วยความจำ อัปเดตทีละส่วนผ่าน snapshot listener ของทะเบียน FcmTokens"""
+
+    def __init__(self, db):
+        self.db = db
+        # token -> user_id ของเจ้าของ (เฉพาะ token ที่ยังไม่ stale)
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._watch_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._source = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """🔔 ลงทะเบียน callback(added_tokens, removed_tokens) ที่ถูกเรียกเมื่อชุด token ของเจ้าหน้าที่เปลี่ยน"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _resolve_source(self):
+        """🧭 เลือกแหล่ง token ตาม STAFF_TOKEN_SOURCE
+
+        โหมด auto ใช้ User.fcm_token ระหว่างที่ทะเบียนยังไม่มี token ของ Staff เลย (ยังไม่ได้ backfill)
+        เพื่อไม่ให้เจ้าหน้าที่ทุกคนหายไปจากการแจ้งเตือนระหว่าง migrate; หลัง backfill แล้วให้ restart
+        หรือตั้ง STAFF_TOKEN_SOURCE=registry
+        """
+        if STAFF_TOKEN_SOURCE in ('registry', 'user'):
+            return STAFF_TOKEN_SOURCE
+        probe = self.db.collection(TOKEN_INDEX_COLLECTION).where('role', '==', 'Staff').limit(1).select([])
+        found = list(probe.stream())
+        record_firestore(TOKEN_INDEX_COLLECTION, 'read')
+        if found:
+            return 'registry'
+        print("⚠️ ทะเบียน FcmTokens ยังไม่มี token ของ Staff ใช้ User.fcm_token แทน")
+        return 'user'
+
+    def _staff_query(self):
+        if self._source == 'user':
+            return self.db.collection('User').where('role', '==', 'Staff')
+        return self.db.collection(TOKEN_INDEX_COLLECTION).where('role', '==', 'Staff')
+
+    def _collection_name(self):
+        return 'User' if self._source == 'user' else TOKEN_INDEX_COLLECTION
+
+    def start(self):
+        """▶️ เริ่มฟังการเปลี่ยนแปลงของ token ที่เจ้าของเป็น Staff (เรียกซ้ำได้)"""
+        with self._watch_lock:
+            if self._watch is None:
+                if self._source is None:
+                    self._source = self._resolve_source()
+                # listener ส่งมาเฉพาะเอกสารที่เปลี่ยน จึงไม่ต้องสแกนใหม่ทั้งหมดทุกครั้ง
+                self._watch = self._staff_query().on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+                self._ready.clear()
+
+    def is_ready(self):
+        """✅ ได้รับ snapshot แรกแล้วหรือยัง (ถ้าแล้ว get_tokens จะไม่ block)"""
+        return self._ready.is_set()
+
+    def _apply_user_change_locked(self, change):
+        # โหมด user: เอกสารหนึ่งคือเจ้าหน้าที่หนึ่งคน แทนที่ token ทั้งหมดของคนนั้นด้วยค่าใหม่
+        user_id = change.document.id
+        for token in [t for t, owner in self._owners.items() if owner == user_id]:
+            del self._owners[token]
+        if change.type.name != 'REMOVED':
+            for token in normalize_tokens((change.document.to_dict() or {}).get('fcm_token')):
+                self._owners[token] = user_id
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # listener คิดค่า read เฉพาะเอกสารที่เปลี่ยน
+        record_firestore(self._collection_name(), 'read', len(changes))
+        with self._lock:
+            before = set(self._owners)
+            for change in changes:
+                if self._source == 'user':
+                    self._apply_user_change_locked(change)
+                    continue
+                token = change.document.id
+                data = change.document.to_dict() or {}
+                if change.type.name == 'REMOVED' or is_stale(data):
+                    # ลบออกเมื่อ token ถูกลบ, เจ้าของไม่ได้เป็น Staff แล้ว หรือ token ล้มเหลวต่อเนื่องจน stale
+                    self._owners.pop(token, None)
+                else:
+                    self._owners[token] = data.get('user_id')
+            after = set(self._owners)
+            listeners = list(self._listeners)
+        if self._source != 'user':
+            # token จาก snapshot ของทะเบียนมีเอกสารอยู่แล้ว บันทึกผลการส่งลงทะเบียนได้
+            get_token_index(self.db).remember(after - before)
+        self._ready.set()
+        print(f"👥 อัปเดตรายชื่อ token ของเจ้าหน้าที่: {len(changes)} รายการ")
+
+        # 🔔 แจ้งเฉพาะ token ที่เพิ่ม/หายไปจริง (ครอบคลุมทั้งการเปลี่ยน token และการเปลี่ยน role ของเจ้าของ)
+        added, removed = after - before, before - after
+        if added or removed:
+            for callback in listeners:
+                try:
+                    callback(added, removed)
+                except Exception as e:
+                    print(f"⚠️ Staff token listener ล้มเหลว: {e}")
+
+    def _load_projected(self):
+        """📥 อ่าน token ของ Staff ตรงจาก Firestore (ใช้เมื่อ listener ยังไม่พร้อม)"""
+        owners = {}
+        if self._source == 'user':
+            for doc in self._staff_query().select(['fcm_token']).stream():
+                record_firestore('User', 'read')
+                for token in normalize_tokens(doc.to_dict().get('fcm_token')):
+                    owners[token] = doc.id
+            return owners
+        docs = self._staff_query().select(['user_id', 'failure_count', 'last_success_at']).stream()
+        for doc in docs:
+            record_firestore(TOKEN_INDEX_COLLECTION, 'read')
+            data = doc.to_dict()
+            if not is_stale(data):
+                owners[doc.id] = data.get('user_id')
+        return owners
+
+    def get_tokens(self, timeout=INITIAL_SNAPSHOT_TIMEOUT):
+        """📨 คืน FCM token ของเจ้าหน้าที่ทุกคน (ไม่ซ้ำกัน) โดยไม่ต้องอ่าน Firestore"""
+        self.start()
+        if self._ready.wait(timeout):
+            with self._lock:
+                return list(self._owners)
+        print("⚠️ Staff token listener ยังไม่พร้อม อ่านจาก Firestore แทน")
+        return list(self._load_projected())
+
+
+def get_staff_token_directory(db):
+    """♻️ คืน StaffTokenDirectory ตัวเดียวต่อ Firestore client ทั้ง process"""
+    directory = _directories.get(id(db))
+    if directory is None:
+        with _directories_lock:
+            directory = _directories.get(id(db))
+            if directory is None:
+                directory = StaffTokenDirectory(db)
+                _directories[id(db)] = directory
+    return directory
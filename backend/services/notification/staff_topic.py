@@ -0,0 +1,170 @@
+import os
+import re
+import threading
+
+from firebase_admin import firestore, messaging
+
+from services.common.circuit_breaker import get_breaker
+from services.common.metrics import record_firestore
+from services.registry import FIRESTORE_TIMEOUT
+from .staff_token_directory import get_staff_token_directory
+
+# topic ที่เครื่องของเจ้าหน้าที่ทุกเครื่องถูก subscribe ไว้
+# ใครรู้ชื่อ topic ก็ subscribe รับข้อความได้ จึงไม่มีค่าเริ่มต้น ต้องตั้งเป็นค่าสุ่มยาว ๆ (เช่น secrets.token_urlsafe(32))
+STAFF_TOPIC = os.environ.get("STAFF_FCM_TOPIC", "")
+TOPIC_MIN_LENGTH = 32
+_TOPIC_NAME = re.compile(r'^[a-zA-Z0-9\-_.~%]+$')
+# Admin SDK รับได้สูงสุด 1000 token ต่อการ subscribe / unsubscribe หนึ่งครั้ง
+TOPIC_BATCH_SIZE = 1000
+# เก็บรายชื่อ token ที่ subscribe ไว้ เพื่อถอนคนที่ไม่ได้เป็น Staff แล้วแม้ระหว่างนั้น server จะรีสตาร์ต
+TOPIC_MEMBERS_COLLECTION = 'FcmTopics'
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+_subscriptions = {}
+_subscriptions_lock = threading.Lock()
+
+
+def topic_configured(topic=None):
+    """🔐 ตั้งชื่อ topic ที่เดาไม่ได้ไว้แล้วหรือยัง (ต้องผ่านก่อนจึงเปิดโหมด topic ได้)"""
+    topic = STAFF_TOPIC if topic is None else topic
+    return len(topic) >= TOPIC_MIN_LENGTH and bool(_TOPIC_NAME.match(topic))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class StaffTopicSubscriptions:
+    """📢 ทำให้สมาชิกของ topic เจ้าหน้าที่ตรงกับ token ใน StaffTokenDirectory เสมอ
+
+    ทุกครั้งที่ชุด token ของ Staff เปลี่ยน (เพิ่ม/ลบ token หรือเปลี่ยน role) worker จะเทียบ
+    กับรายชื่อที่ subscribe ไว้ แล้ว subscribe / unsubscribe เฉพาะส่วนต่างทีละ 1000 token
+    """
+
+    def __init__(self, db, directory=None, topic=None):
+        topic = STAFF_TOPIC if topic is None else topic
+        if not topic_configured(topic):
+            raise ValueError(f"STAFF_FCM_TOPIC must be a random name of at least {TOPIC_MIN_LENGTH} characters")
+        self.db = db
+        self.directory = directory or get_staff_token_directory(db)
+        self.topic = topic
+        self._members_ref = db.collection(TOPIC_MEMBERS_COLLECTION).document(topic)
+        self._breaker = get_breaker('firestore')
+        self._subscribed = set()
+        # token ที่ FCM ปฏิเสธ (ส่วนมากคือ token ที่ใช้ไม่ได้แล้ว) ไม่ต้องลองซ้ำทุกรอบ
+        self._rejected = set()
+        self._cond = threading.Condition()
+        self._dirty = True
+        self._synced = False
+        self._stopped = False
+        self._failures = 0
+        self._thread = None
+
+    def start(self):
+        """▶️ โหลดรายชื่อเดิม ลงทะเบียนกับ directory แล้วเริ่ม worker (เรียกซ้ำได้)"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="staff-topic", daemon=True)
+
+        self._load_members()
+        self.directory.add_listener(self._on_tokens_changed)
+        self.directory.start()
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def is_synced(self):
+        """✅ สมาชิกของ topic ตรงกับ token ของเจ้าหน้าที่ปัจจุบันแล้วหรือยัง"""
+        with self._cond:
+            return self._synced and not self._dirty and self.directory.is_ready()
+
+    def _on_tokens_changed(self, added, removed):
+        with self._cond:
+            self._dirty = True
+            self._synced = False
+            self._cond.notify()
+
+    def _load_members(self):
+        try:
+            snapshot = self._breaker.call(self._members_ref.get, timeout=FIRESTORE_TIMEOUT)
+            record_firestore(TOPIC_MEMBERS_COLLECTION, 'read')
+            if snapshot.exists:
+                self._subscribed = set(snapshot.to_dict().get('tokens', []))
+        except Exception as e:
+            print(f"⚠️ โหลดรายชื่อสมาชิก topic {self.topic} ไม่สำเร็จ: {e}")
+
+    def _save_members(self):
+        self._breaker.call(self._members_ref.set, {
+            "tokens": sorted(self._subscribed),
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }, timeout=FIRESTORE_TIMEOUT)
+        record_firestore(TOPIC_MEMBERS_COLLECTION, 'write')
+
+    def _reconcile(self):
+        desired = set(self.directory.get_tokens())
+        to_add = sorted(desired - self._subscribed - self._rejected)
+        to_remove = sorted(self._subscribed - desired)
+        self._rejected &= desired
+
+        try:
+            for chunk in _chunks(to_add, TOPIC_BATCH_SIZE):
+                response = messaging.subscribe_to_topic(chunk, self.topic)
+                failed = {chunk[error.index] for error in response.errors}
+                self._subscribed.update(set(chunk) - failed)
+                self._rejected.update(failed)
+
+            for chunk in _chunks(to_remove, TOPIC_BATCH_SIZE):
+                messaging.unsubscribe_from_topic(chunk, self.topic)
+                # token ที่ถอนไม่สำเร็จคือ token ที่ใช้ไม่ได้แล้ว ถือว่าไม่อยู่ใน topic
+                self._subscribed.difference_update(chunk)
+        finally:
+            if to_add or to_remove:
+                self._save_members()
+
+        if to_add or to_remove:
+            print(f"📢 topic {self.topic}: subscribe {len(to_add)} / unsubscribe {len(to_remove)} token")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._dirty = False
+
+            try:
+                self._reconcile()
+                self._failures = 0
+                with self._cond:
+                    self._synced = not self._dirty
+            except Exception as e:
+                self._failures += 1
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (self._failures - 1)))
+                print(f"⚠️ sync topic {self.topic} ล้มเหลว ({e}) ลองใหม่ใน {delay:.0f} วินาที")
+                with self._cond:
+                    self._dirty = True
+                    self._synced = False
+                    self._cond.wait(delay)
+
+
+def get_staff_topic_subscriptions(db):
+    """♻️ คืน StaffTopicSubscriptions ตัวเดียวต่อ Firestore client ทั้ง process"""
+    subscriptions = _subscriptions.get(id(db))
+    if subscriptions is None:
+        with _subscriptions_lock:
+            subscriptions = _subscriptions.get(id(db))
+            if subscriptions is None:
+                subscriptions = StaffTopicSubscriptions(db)
+                _subscriptions[id(db)] = subscriptions
+    return subscriptions
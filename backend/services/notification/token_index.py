@@ -0,0 +1,348 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from google.api_core import exceptions as api_exceptions
+
+from services.registry import FIRESTORE_TIMEOUT
+from services.common.circuit_breaker import get_breaker
+from services.common.metrics import record_firestore
+from services.common.ttl_cache import TTLCache
+
+# collection ทะเบียน token (document id = token) เก็บเจ้าของ บทบาท platform และผลการส่งล่าสุด
+TOKEN_INDEX_COLLECTION = 'FcmTokens'
+# Firestore รับได้สูงสุด 500 write ต่อ batch
+BATCH_WRITE_LIMIT = 500
+# จำนวนเอกสารต่อการเรียก get_all หนึ่งครั้ง
+GET_ALL_CHUNK_SIZE = 100
+# array_contains_any รับได้สูงสุด 30 ค่าต่อ query
+USER_QUERY_CHUNK_SIZE = 30
+
+# ข้าม token ที่ส่งไม่สำเร็จ (แบบที่ไม่ใช่ token หมดอายุ) ติดกันครบเท่านี้ และไม่ได้ส่งสำเร็จเลยในช่วง TOKEN_STALE_DAYS วัน
+TOKEN_MAX_FAILURES = int(os.environ.get("FCM_TOKEN_MAX_FAILURES", "3"))
+TOKEN_STALE_DAYS = int(os.environ.get("FCM_TOKEN_STALE_DAYS", "30"))
+# บันทึก last_success_at ของ token เดิมได้ไม่เกินหนึ่งครั้งต่อช่วงนี้ (วินาที) ต่อ process
+SUCCESS_WRITE_INTERVAL = 3600.0
+# อายุแคช token ของผู้ใช้ (วินาที) เท่ากับแคชเอกสาร User
+USER_TOKENS_TTL = 60.0
+# จำว่า token ใดมีเอกสารในทะเบียน (เห็นจากการอ่าน / ลงทะเบียน) เพื่อบันทึกผลการส่งเฉพาะ token เหล่านั้น
+KNOWN_TOKENS_MAXSIZE = 100000
+KNOWN_TOKENS_TTL = 3600.0
+
+_NOT_CACHED = object()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _indexable(token):
+    # document id ห้ามมี "/" และห้ามว่าง
+    return bool(token) and '/' not in token
+
+
+def normalize_tokens(value):
+    """🧾 fcm_token อาจเป็น list หรือ string ก็ได้ แปลงให้เป็น list เสมอ"""
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, list):
+        return [t for t in value if isinstance(t, str) and t.strip()]
+    return []
+
+
+def token_owner(data):
+    """👤 เจ้าของปัจจุบันของ token (ผู้ใช้ล่าสุดที่ลงทะเบียน token นี้ เมื่อหลายบัญชีใช้เครื่องเดียวกัน)"""
+    user_ids = data.get('user_ids') or []
+    return data.get('user_id') or (user_ids[-1] if user_ids else None)
+
+
+def is_stale(data, now=None):
+    """💤 token ที่ล้มเหลวติดกันหลายครั้งและไม่ได้ส่งสำเร็จมานานแล้ว (ข้ามไม่ต้องส่ง)"""
+    if TOKEN_MAX_FAILURES <= 0 or (data.get('failure_count') or 0) < TOKEN_MAX_FAILURES:
+        return False
+    last_success = data.get('last_success_at')
+    if not isinstance(last_success, datetime.datetime):
+        return True
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if last_success.tzinfo is None:
+        last_success = last_success.replace(tzinfo=datetime.timezone.utc)
+    return last_success < now - datetime.timedelta(days=TOKEN_STALE_DAYS)
+
+
+class TokenIndex:
+    """🗂️ ทะเบียน FCM token (FcmTokens) ที่ทุก sender ใช้หา token ของผู้รับ
+
+    เอกสารหนึ่งต่อ token: user_id (เจ้าของปัจจุบัน), user_ids (ทุกบัญชีที่เคยผูก), role, platform,
+    last_seen_at, last_success_at, failure_count
+    - หา token ของผู้ใช้ด้วย tokens_for_users (ผ่านแคช) แทนการอ่าน User.fcm_token
+    - หาเจ้าของจาก token ด้วย owners เพื่อลบ token ที่ใช้ไม่ได้โดยไม่ต้องสแกน User
+    ทะเบียนถูกอัปเดตโดย Cloud Function `syncFcmTokenIndex` ทุกครั้งที่ User.fcm_token / role เปลี่ยน
+    ฝั่ง backend ใช้ `register` เมื่อแอปส่ง token มาเอง และ `backfill` เป็น migration จาก User.fcm_token เดิม
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.collection(TOKEN_INDEX_COLLECTION)
+        self._breaker = get_breaker('firestore')
+        self._user_tokens = TTLCache(maxsize=4096, ttl=USER_TOKENS_TTL)
+        self._known = TTLCache(maxsize=KNOWN_TOKENS_MAXSIZE, ttl=KNOWN_TOKENS_TTL)
+        self._success_written = {}
+        self._success_lock = threading.Lock()
+        # เขียนผลการส่งนอก request path ทีละ batch
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-results")
+
+    def _commit(self, batch):
+        self._breaker.call(batch.commit, timeout=FIRESTORE_TIMEOUT)
+
+    def _commit_in_batches(self, writes):
+        """✍️ เขียนเป็น batch ละไม่เกิน 500 รายการ; writes คือ list ของ fn(batch)
+
+        batch ล้มทั้งก้อนถ้ามี update ไปยังเอกสารที่ถูกลบไปแล้ว (NotFound) กรณีนั้นเขียนทีละรายการและข้ามเฉพาะตัวที่หายไป
+        (เกิดได้เฉพาะเมื่อเอกสารถูกลบระหว่างทาง ผู้เรียกควรกรองให้เหลือเอกสารที่มีอยู่ก่อน)
+        error อื่น (รวมถึง CircuitOpenError) ถูก raise ต่อ
+        """
+        for chunk in _chunks(writes, BATCH_WRITE_LIMIT):
+            batch = self.db.batch()
+            for write in chunk:
+                write(batch)
+            try:
+                self._commit(batch)
+            except api_exceptions.NotFound as e:
+                skipped = 0
+                for write in chunk:
+                    single = self.db.batch()
+                    write(single)
+                    try:
+                        self._commit(single)
+                    except api_exceptions.NotFound:
+                        skipped += 1
+                print(f"⚠️ Batch มีเอกสารที่ไม่มีอยู่แล้ว เขียนทีละรายการและข้ามไป {skipped} รายการ: {e}")
+
+    def remember(self, tokens):
+        """📌 จำว่า token เหล่านี้มีเอกสารในทะเบียนแล้ว (เช่น จาก snapshot ของรายชื่อเจ้าหน้าที่)"""
+        for token in tokens:
+            self._known.set(token, True)
+
+    def is_known(self, token):
+        return self._known.get(token, False)
+
+    def register(self, user_id, tokens, role=None, platform=None):
+        """➕ ผูก token กับผู้ใช้ในทะเบียน (ผู้ใช้นี้เป็นเจ้าของปัจจุบันของ token)"""
+        fields = {
+            "user_id": user_id,
+            "user_ids": firestore.ArrayUnion([user_id]),
+            "last_seen_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        if role:
+            fields["role"] = role
+        if platform:
+            fields["platform"] = platform
+        writes = [
+            (lambda batch, t=token: batch.set(self.collection.document(t), fields, merge=True))
+            for token in normalize_tokens(tokens) if _indexable(token)
+        ]
+        self._commit_in_batches(writes)
+        record_firestore(TOKEN_INDEX_COLLECTION, 'write', len(writes))
+        self.remember(normalize_tokens(tokens))
+        self._user_tokens.pop(user_id)
+
+    def tokens_for_users(self, user_ids):
+        """🔑 คืน {user_id: [token, ...]} ของผู้ใช้ที่มีอยู่ในทะเบียน (ไม่รวม token ที่ is_stale)
+
+        ผู้ใช้ที่ไม่อยู่ในผลลัพธ์คือยังไม่เคยถูก migrate เข้าทะเบียน ผู้เรียกใช้ User.fcm_token แทนได้
+        token ที่ผู้ใช้หลายคนเคยผูกไว้จะคืนให้เฉพาะเจ้าของปัจจุบัน
+        """
+        result = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._user_tokens.get(user_id, _NOT_CACHED)
+            if cached is _NOT_CACHED:
+                missing.append(user_id)
+            elif cached is not None:
+                result[user_id] = cached
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for chunk in _chunks(missing, USER_QUERY_CHUNK_SIZE):
+            query = self.collection.where('user_ids', 'array_contains_any', chunk)
+            docs = self._breaker.call(lambda: list(query.stream(timeout=FIRESTORE_TIMEOUT)))
+            record_firestore(TOKEN_INDEX_COLLECTION, 'read', max(1, len(docs)))
+            found = {}
+            self.remember(doc.id for doc in docs)
+            for doc in docs:
+                data = doc.to_dict()
+                for user_id in data.get('user_ids') or []:
+                    found.setdefault(user_id, [])
+                owner = token_owner(data)
+                if owner in found and not is_stale(data, now):
+                    found[owner].append(doc.id)
+            for user_id in chunk:
+                tokens = found.get(user_id)
+                # None = ไม่อยู่ในทะเบียน (แคชไว้ด้วย จะได้ไม่ query ซ้ำ)
+                self._user_tokens.set(user_id, tokens)
+                if tokens is not None:
+                    result[user_id] = tokens
+        return result
+
+    def owners(self, tokens):
+        """🔎 คืน {token: [user_id, ...]} โดยอ่านทะเบียนด้วย get_all ทีละก้อน"""
+        result = {}
+        indexable = [t for t in dict.fromkeys(tokens) if _indexable(t)]
+        for chunk in _chunks(indexable, GET_ALL_CHUNK_SIZE):
+            refs = [self.collection.document(t) for t in chunk]
+            record_firestore(TOKEN_INDEX_COLLECTION, 'read', len(refs))
+            snapshots = self._breaker.call(lambda: list(self.db.get_all(refs, timeout=FIRESTORE_TIMEOUT)))
+            for snapshot in snapshots:
+                user_ids = list(snapshot.to_dict().get('user_ids', [])) if snapshot.exists else []
+                if user_ids:
+                    result[snapshot.id] = user_ids
+                if snapshot.exists:
+                    self._known.set(snapshot.id, True)
+
+        # token ที่ยังไม่อยู่ในทะเบียน (ยังไม่ได้ backfill) ค้นทีละ token แทน
+        for token in tokens:
+            if token in result:
+                continue
+            query = self.db.collection('User').where('fcm_token', 'array_contains', token).select([])
+            docs = self._breaker.call(lambda: list(query.stream(timeout=FIRESTORE_TIMEOUT)))
+            result[token] = [doc.id for doc in docs]
+            # query ที่ไม่เจอเอกสารก็ยังคิดเป็น 1 read
+            record_firestore('User', 'read', max(1, len(result[token])))
+        return result
+
+    def remove_tokens(self, tokens):
+        """🧹 ลบ token ออกจาก User.fcm_token ด้วย ArrayRemove แบบ batch และลบออกจากทะเบียน
+
+        คืนชุด user_id ที่ถูกแก้ไข
+        """
+        owners = self.owners(tokens)
+
+        tokens_by_user = {}
+        for token, user_ids in owners.items():
+            for user_id in user_ids:
+                tokens_by_user.setdefault(user_id, []).append(token)
+
+        writes = []
+        for user_id, user_tokens in tokens_by_user.items():
+            writes.append(lambda batch, u=user_id, ts=user_tokens: batch.update(
+                self.db.collection('User').document(u),
+                {"fcm_token": firestore.ArrayRemove(ts)},
+            ))
+        for token in owners:
+            if _indexable(token):
+                writes.append(lambda batch, t=token: batch.delete(self.collection.document(t)))
+                self._known.pop(token)
+
+        self._commit_in_batches(writes)
+        record_firestore('User', 'write', len(tokens_by_user))
+        record_firestore(TOKEN_INDEX_COLLECTION, 'write', len(writes) - len(tokens_by_user))
+        for user_id in tokens_by_user:
+            self._user_tokens.pop(user_id)
+            print(f"🧹 อัปเดต FCM Token สำหรับ User: {user_id}")
+        return set(tokens_by_user)
+
+    def record_results(self, sent_tokens, failed_tokens):
+        """📈 บันทึกผลการส่งลงทะเบียนแบบไม่รอ (last_success_at / failure_count)
+
+        token ที่ส่งสำเร็จบันทึกได้ไม่เกินหนึ่งครั้งต่อ SUCCESS_WRITE_INTERVAL เพื่อไม่ให้ทุกการส่งกลายเป็นการเขียน
+        failed คือผลที่ไม่ใช่ token หมดอายุและไม่ใช่ปัญหาชั่วคราว (เช่น SENDER_ID_MISMATCH)
+        บันทึกเฉพาะ token ที่รู้ว่ามีเอกสารในทะเบียนแล้ว (is_known) ด้วย update จึงไม่สร้างเอกสารที่ไม่มีเจ้าของ
+        และไม่ต้องยิง update ที่รู้อยู่แล้วว่าจะ NotFound ก่อน backfill / สำหรับ token ที่มาจาก User.fcm_token
+        """
+        now = time.monotonic()
+        with self._success_lock:
+            sent = [t for t in dict.fromkeys(sent_tokens)
+                    if _indexable(t) and self.is_known(t)
+                    and now - self._success_written.get(t, -SUCCESS_WRITE_INTERVAL) >= SUCCESS_WRITE_INTERVAL]
+            for token in sent:
+                self._success_written[token] = now
+            if len(self._success_written) > 100000:
+                self._success_written.clear()
+        failed = [t for t in dict.fromkeys(failed_tokens) if _indexable(t) and self.is_known(t)]
+        if not sent and not failed:
+            return
+
+        writes = [
+            (lambda batch, t=token: batch.update(
+                self.collection.document(t),
+                {"last_success_at": firestore.SERVER_TIMESTAMP, "failure_count": 0},
+            ))
+            for token in sent
+        ] + [
+            (lambda batch, t=token: batch.update(
+                self.collection.document(t),
+                {"last_failure_at": firestore.SERVER_TIMESTAMP, "failure_count": firestore.Increment(1)},
+            ))
+            for token in failed
+        ]
+
+        def write():
+            try:
+                self._commit_in_batches(writes)
+                record_firestore(TOKEN_INDEX_COLLECTION, 'write', len(writes))
+            except Exception as e:
+                print(f"⚠️ บันทึกผลการส่งลงทะเบียน token ไม่สำเร็จ: {e}")
+
+        self._writer.submit(write)
+
+    def backfill(self):
+        """🏗️ migration: สร้างทะเบียนจาก User.fcm_token ที่มีอยู่ทั้งหมด และแปลง fcm_token แบบ string เป็น list
+
+        รันซ้ำได้ (เขียนแบบ merge); token ที่หลายบัญชีใช้ร่วมกันจะมีเจ้าของเป็นบัญชีสุดท้ายที่อ่านเจอ
+        """
+        writes = []
+        registered = 0
+        for doc in self.db.collection('User').select(['fcm_token', 'role']).stream():
+            record_firestore('User', 'read')
+            data = doc.to_dict()
+            raw = data.get('fcm_token')
+            tokens = normalize_tokens(raw)
+            if raw is not None and raw != tokens:
+                writes.append(lambda batch, u=doc.id, ts=tokens: batch.update(
+                    self.db.collection('User').document(u), {"fcm_token": ts},
+                ))
+            for token in tokens:
+                if not _indexable(token):
+                    continue
+                fields = {
+                    "user_id": doc.id,
+                    "user_ids": firestore.ArrayUnion([doc.id]),
+                    "last_seen_at": firestore.SERVER_TIMESTAMP,
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                }
+                if data.get('role'):
+                    fields["role"] = data['role']
+                writes.append(lambda batch, t=token, f=fields: batch.set(self.collection.document(t), f, merge=True))
+                registered += 1
+        self._commit_in_batches(writes)
+        record_firestore(TOKEN_INDEX_COLLECTION, 'write', registered)
+        record_firestore('User', 'write', len(writes) - registered)
+        self._user_tokens.clear()
+        print(f"🏗️ สร้างทะเบียน FCM token แล้ว {registered} รายการ (แก้ fcm_token ของผู้ใช้ {len(writes) - registered} คน)")
+        return registered
+
+
+def get_token_index(db):
+    """♻️ คืน TokenIndex ตัวเดียวต่อ Firestore client ทั้ง process (ใช้แคช token ของผู้ใช้ร่วมกัน)"""
+    index = _indexes.get(id(db))
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(id(db))
+            if index is None:
+                index = TokenIndex(db)
+                _indexes[id(db)] = index
+    return index
+
+
+if __name__ == "__main__":
+    # 🏗️ รัน migration: python -m services.notification.token_index (จากโฟลเดอร์ backend)
+    from services import registry
+
+    get_token_index(registry.firestore_client()).backfill()
@@ -0,0 +1,101 @@
+import datetime
+import threading
+
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+from services import registry
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# รีเฟรชแบบรอผลเมื่อ token เหลืออายุน้อยกว่านี้ (วินาที)
+REFRESH_MARGIN_SECONDS = 60
+# เริ่มรีเฟรชเบื้องหลังเมื่อ token เหลืออายุน้อยกว่านี้ (วินาที)
+BACKGROUND_REFRESH_SECONDS = 300
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def _utcnow():
+    # google-auth เก็บ expiry เป็นเวลา UTC แบบไม่มี tzinfo
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class AccessTokenProvider:
+    """🔐 แคช OAuth access token ไว้จนใกล้หมดอายุ และรีเฟรชได้ทีละครั้งเท่านั้น"""
+
+    def __init__(self, service_account_file, scopes=SCOPES,
+                 refresh_margin=REFRESH_MARGIN_SECONDS,
+                 background_refresh=BACKGROUND_REFRESH_SECONDS,
+                 credentials=None, session=None):
+        self.service_account_file = service_account_file
+        # ✅ รับ credentials ที่โหลดไว้แล้วได้ (จาก registry) ไม่ต้องอ่านไฟล์ซ้ำ
+        self.credentials = credentials or service_account.Credentials.from_service_account_file(
+            service_account_file, scopes=scopes
+        )
+        self.session = session
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.background_refresh = datetime.timedelta(seconds=background_refresh)
+        self._token = None
+        self._expiry = None
+        self._refresh_lock = threading.Lock()
+
+    def _is_fresh(self, margin):
+        return self._token is not None and self._expiry is not None and _utcnow() < self._expiry - margin
+
+    def _refresh(self):
+        self.credentials.refresh(Request(session=self.session))
+        self._token = self.credentials.token
+        self._expiry = self.credentials.expiry
+        print(f"🔐 รีเฟรช Access Token แล้ว (หมดอายุ {self._expiry})")
+
+    def _refresh_in_background(self):
+        # ถ้ามีคนกำลังรีเฟรชอยู่แล้วก็ไม่ต้องเริ่มซ้ำ
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"⚠️ รีเฟรช Access Token เบื้องหลังล้มเหลว: {e}")
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, name="fcm-token-refresh", daemon=True).start()
+
+    def cached_token(self):
+        """⚡ คืน token ที่แคชไว้ถ้ายังใช้ได้ (ไม่เรียก network) ไม่เช่นนั้นคืน None"""
+        if self._is_fresh(self.refresh_margin):
+            if not self._is_fresh(self.background_refresh):
+                self._refresh_in_background()
+            return self._token
+        return None
+
+    def get_token(self):
+        """🔑 คืน access token ที่ยังใช้ได้ (เรียก token endpoint เฉพาะเมื่อจำเป็น)"""
+        token = self.cached_token()
+        if token is not None:
+            return token
+
+        with self._refresh_lock:
+            # อาจมี thread อื่นรีเฟรชเสร็จไปแล้วระหว่างรอ lock
+            if not self._is_fresh(self.refresh_margin):
+                self._refresh()
+            return self._token
+
+
+def get_token_provider(service_account_file):
+    """♻️ คืน AccessTokenProvider ตัวเดียวต่อ service account ทั้ง process"""
+    if service_account_file == registry.SERVICE_ACCOUNT_PATH:
+        # service account หลักใช้ credentials / HTTP session ชุดเดียวกับ Firebase app
+        return registry.token_provider()
+    provider = _providers.get(service_account_file)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(service_account_file)
+            if provider is None:
+                provider = AccessTokenProvider(service_account_file)
+                _providers[service_account_file] = provider
+    return provider
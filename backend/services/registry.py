@@ -0,0 +1,131 @@
+import contextlib
+import os
+import threading
+import time
+
+# 🗂️ ที่เดียวที่สร้าง Firebase app / Firestore client / credentials / HTTP session ของทั้ง process
+# ทุกอย่างสร้างเมื่อถูกเรียกใช้ครั้งแรก (lazy) แล้วใช้ร่วมกัน และจับเวลาไว้สำหรับรายงานตอน startup
+
+# โฟลเดอร์ backend/ ใช้เป็นฐานของ path แบบ relative ของไฟล์ข้อมูล (ไม่ขึ้นกับ cwd ที่ใช้รัน)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICE_ACCOUNT_PATH = os.environ.get(
+    "FIREBASE_SERVICE_ACCOUNT", "config/medi-bridge-app-firebase-adminsdk-iew3q-c1f0b31f28.json"
+)
+
+# timeout ของการเรียก Firestore บน request path (วินาที) ไม่ให้ thread ค้างเมื่อ Firestore ช้า
+FIRESTORE_TIMEOUT = float(os.environ.get("FIRESTORE_TIMEOUT", "5"))
+
+_STARTED_AT = time.perf_counter()
+_instances = {}
+_timings = []
+_lock = threading.RLock()
+
+
+def backend_path(path):
+    """📁 path แบบ relative ถูกอ้างจากโฟลเดอร์ backend/ ส่วน path แบบ absolute ใช้ตามเดิม"""
+    return os.path.join(BACKEND_DIR, path)
+
+
+def lazy(name, factory):
+    """💤 คืน instance ชื่อ name โดยเรียก factory() ครั้งแรกที่ถูกใช้เท่านั้น (thread-safe)"""
+    instance = _instances.get(name, _instances)
+    if instance is not _instances:
+        return instance
+    with _lock:
+        if name not in _instances:
+            started = time.perf_counter()
+            _instances[name] = factory()
+            _timings.append((name, time.perf_counter() - started))
+        return _instances[name]
+
+
+def override(name, value):
+    """🧪 แทนที่ instance (ใช้ตอน benchmark / ทดสอบกับของปลอม) ต้องเรียกก่อนถูกใช้ครั้งแรก"""
+    with _lock:
+        _instances[name] = value
+
+
+def credentials():
+    """🔐 credentials ของ service account (อ่านไฟล์ครั้งเดียว)"""
+    def load():
+        from firebase_admin import credentials as firebase_credentials
+        return firebase_credentials.Certificate(SERVICE_ACCOUNT_PATH)
+    return lazy("credentials", load)
+
+
+def firebase_app():
+    """🔥 Firebase app ตัวหลัก (ใช้ app ที่ initialize ไว้แล้วถ้ามี)"""
+    def load():
+        import firebase_admin
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app(credentials())
+    return lazy("firebase_app", load)
+
+
+def firestore_client():
+    """📚 Firestore client แบบ sync ตัวเดียวของทั้ง process"""
+    def load():
+        from firebase_admin import firestore
+        return firestore.client(firebase_app())
+    return lazy("firestore", load)
+
+
+def async_firestore_client():
+    """⚡ Firestore AsyncClient (ใช้ credentials ชุดเดียวกัน)"""
+    def load():
+        from google.cloud import firestore
+        google_credentials = credentials().get_credential()
+        return firestore.AsyncClient(project=credentials().project_id, credentials=google_credentials)
+    return lazy("async_firestore", load)
+
+
+def http_session():
+    """🔌 requests.Session แบบ keep-alive ที่ใช้ร่วมกัน (FCM และการรีเฟรช access token)"""
+    def load():
+        from services.notification.fcm_dispatcher import DEFAULT_MAX_CONCURRENCY, build_pooled_session
+        return build_pooled_session(DEFAULT_MAX_CONCURRENCY)
+    return lazy("http_session", load)
+
+
+def token_provider():
+    """🔑 AccessTokenProvider สำหรับ FCM v1 ที่ใช้ credentials ชุดเดียวกับ Firebase app"""
+    def load():
+        from services.notification.token_provider import AccessTokenProvider, SCOPES
+        return AccessTokenProvider(
+            SERVICE_ACCOUNT_PATH,
+            credentials=credentials().get_credential().with_scopes(SCOPES),
+            session=http_session(),
+        )
+    return lazy("token_provider", load)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """⏱️ จับเวลาขั้นตอน startup ที่ไม่ได้สร้างผ่าน registry (เช่นการสร้าง service)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _timings.append((name, time.perf_counter() - started))
+
+
+def startup_report():
+    """📋 รายงานเวลาที่ใช้ในแต่ละขั้นตอน startup (มิลลิวินาที)"""
+    with _lock:
+        steps = [(name, round(seconds * 1000, 1)) for name, seconds in _timings]
+    return {
+        "steps_ms": dict(steps),
+        "since_registry_import_ms": round((time.perf_counter() - _STARTED_AT) * 1000, 1),
+    }
+
+
+def print_startup_report():
+    report = startup_report()
+    print("🚀 Startup timing:")
+    for name, ms in report["steps_ms"].items():
+        print(f"   {name:<28} {ms:>9.1f} ms")
+    print(f"   {'total':<28} {report['since_registry_import_ms']:>9.1f} ms")
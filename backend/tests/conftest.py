@@ -0,0 +1,5 @@
+import os
+import sys
+
+# ให้ import services / benchmarks ได้เมื่อรัน pytest จากโฟลเดอร์ backend หรือ root ของ repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
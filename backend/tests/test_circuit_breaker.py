@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from services.common.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert 0 < error.value.retry_after <= 30
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_success()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_limited_probes_then_closes():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05, half_open_max_calls=1)
+    trip(breaker)
+    time.sleep(0.06)
+
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_half_open_failure_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened_count == 2
+
+
+def test_ignored_result_returns_the_probe_slot():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_ignored()
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+def test_call_counts_only_transient_errors():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+
+    def not_found():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        breaker.call(not_found)
+    assert breaker.state == CLOSED
+
+    def timeout():
+        raise TimeoutError("slow")
+
+    with pytest.raises(TimeoutError):
+        breaker.call(timeout)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "not called")
+
+
+def test_call_passes_arguments_and_returns_result():
+    breaker = CircuitBreaker("test")
+    assert breaker.call(lambda a, timeout=None: (a, timeout), 1, timeout=5) == (1, 5)
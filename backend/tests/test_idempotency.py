@@ -0,0 +1,136 @@
+import json
+
+import pytest
+from firebase_admin import firestore
+
+from benchmarks.fake_firestore import FakeFirestore, run_transactional
+from services.common.idempotency import (
+    IdempotencyConflict,
+    IdempotencyInProgress,
+    IdempotencyStore,
+    payload_fingerprint,
+)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(
+        firestore, "transactional",
+        lambda fn: (lambda transaction, *args: run_transactional(transaction, fn, *args)),
+    )
+    return FakeFirestore(latency=0)
+
+
+def body(**payload):
+    return json.dumps(payload).encode("utf-8")
+
+
+class Handler:
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {"success": True, "call": self.calls}, self.status
+
+
+def test_same_key_replays_first_result(db):
+    store = IdempotencyStore(db)
+    handler = Handler()
+    first = store.run("notify", "k1", body(patient_id="p1"), handler)
+    second = store.run("notify", "k1", body(patient_id="p1"), handler)
+    assert first == (({"success": True, "call": 1}, 200), False)
+    assert second == (({"success": True, "call": 1}, 200), True)
+    assert handler.calls == 1
+    assert store.stats()["replays"] == 1
+
+
+def test_replay_across_stores_reads_firestore(db):
+    handler = Handler()
+    IdempotencyStore(db).run("notify", "k1", body(patient_id="p1"), handler)
+    result, replayed = IdempotencyStore(db).run("notify", "k1", body(patient_id="p1"), handler)
+    assert replayed
+    assert result[1] == 200
+    assert handler.calls == 1
+
+
+def test_same_key_with_different_payload_conflicts(db):
+    store = IdempotencyStore(db)
+    store.run("notify", "k1", body(patient_id="p1"), Handler())
+    with pytest.raises(IdempotencyConflict):
+        store.run("notify", "k1", body(patient_id="p2"), Handler())
+    with pytest.raises(IdempotencyConflict):
+        IdempotencyStore(db).run("notify", "k1", body(patient_id="p2"), Handler())
+
+
+def test_scopes_do_not_share_keys(db):
+    store = IdempotencyStore(db)
+    handler = Handler()
+    store.run("notify", "k1", body(patient_id="p1"), handler)
+    _, replayed = store.run("payment", "k1", body(patient_id="p1"), handler)
+    assert not replayed
+    assert handler.calls == 2
+
+
+def test_fingerprint_ignores_key_order():
+    assert payload_fingerprint(b'{"a": 1, "b": 2}') == payload_fingerprint(b'{"b":2,"a":1}')
+    assert payload_fingerprint(b'{"a": 1}') != payload_fingerprint(b'{"a": 2}')
+
+
+def test_server_errors_are_not_cached(db):
+    store = IdempotencyStore(db)
+    failing = Handler(status=503)
+    result, replayed = store.run("notify", "k1", body(), failing)
+    assert (result[1], replayed) == (503, False)
+
+    handler = Handler()
+    result, replayed = store.run("notify", "k1", body(), handler)
+    assert (result[1], replayed) == (200, False)
+    assert handler.calls == 1
+
+
+def test_handler_exception_releases_key(db):
+    store = IdempotencyStore(db)
+
+    def boom():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        store.run("notify", "k1", body(), boom)
+    handler = Handler()
+    assert store.run("notify", "k1", body(), handler)[1] is False
+    assert handler.calls == 1
+
+
+def test_key_held_by_another_store_is_in_progress(db):
+    first, second = IdempotencyStore(db), IdempotencyStore(db)
+    errors = []
+
+    def handler():
+        try:
+            second.run("notify", "k1", body(), Handler())
+        except IdempotencyInProgress as e:
+            errors.append(e)
+        return {"success": True}, 200
+
+    first.run("notify", "k1", body(), handler)
+    assert len(errors) == 1
+    assert second.run("notify", "k1", body(), Handler())[1] is True
+
+
+def test_without_key_handler_runs_every_time(db):
+    store = IdempotencyStore(db)
+    handler = Handler()
+    store.run("notify", None, body(), handler)
+    _, replayed = store.run("notify", "", body(), handler)
+    assert not replayed
+    assert handler.calls == 2
+
+
+def test_expired_result_runs_again(db):
+    handler = Handler()
+    IdempotencyStore(db, ttl=-1).run("notify", "k1", body(), handler)
+    result, replayed = IdempotencyStore(db, ttl=-1).run("notify", "k1", body(), handler)
+    assert not replayed
+    assert result[0]["call"] == 2
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from services.common.circuit_breaker import CircuitOpenError
+from services.notification import outbox as outbox_module
+from services.notification.outbox import FAILED, PENDING, RUNNING, SUCCEEDED, NotificationOutbox
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "BASE_BACKOFF_SECONDS", 0)
+    return NotificationOutbox(path=str(tmp_path / "outbox.sqlite3"), workers=1, max_attempts=3, lease_seconds=1)
+
+
+def run_once(outbox):
+    row = outbox._claim()
+    assert row is not None
+    outbox._run_job(row)
+    return row["id"]
+
+
+def test_success_finishes_job(outbox):
+    outbox.register("send", lambda payload: ({"success": True, "to": payload["to"]}, 200))
+    job_id = outbox.enqueue("send", {"to": "p1"})
+    assert outbox.get(job_id)["status"] == PENDING
+
+    run_once(outbox)
+    job = outbox.get(job_id)
+    assert (job["status"], job["attempts"], job["http_status"]) == (SUCCEEDED, 1, 200)
+    assert job["result"] == {"success": True, "to": "p1"}
+    assert outbox.depth() == 0
+
+
+def test_client_error_fails_without_retry(outbox):
+    outbox.register("send", lambda payload: ({"error": "Patient not found"}, 404))
+    job_id = outbox.enqueue("send", {})
+    run_once(outbox)
+    job = outbox.get(job_id)
+    assert (job["status"], job["attempts"]) == (FAILED, 1)
+    assert outbox._claim() is None
+
+
+def test_server_error_retries_then_dead_letters(outbox):
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        return {"error": "FCM unavailable"}, 503
+
+    outbox.register("send", handler)
+    job_id = outbox.enqueue("send", {})
+    for attempt in range(1, 3):
+        run_once(outbox)
+        job = outbox.get(job_id)
+        assert (job["status"], job["attempts"]) == (PENDING, attempt)
+
+    run_once(outbox)
+    job = outbox.get(job_id)
+    assert (job["status"], job["attempts"], job["http_status"]) == (FAILED, 3, 503)
+    assert job["last_error"] == "FCM unavailable"
+    assert len(calls) == 3
+    assert outbox._claim() is None
+
+
+def test_exception_is_retried(outbox):
+    outcomes = [RuntimeError("boom"), ({"success": True}, 200)]
+
+    def handler(payload):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    outbox.register("send", handler)
+    job_id = outbox.enqueue("send", {})
+    run_once(outbox)
+    assert outbox.get(job_id)["last_error"] == "boom"
+    run_once(outbox)
+    job = outbox.get(job_id)
+    assert (job["status"], job["attempts"]) == (SUCCEEDED, 2)
+
+
+def test_open_circuit_defers_without_counting_attempt(outbox):
+    def handler(payload):
+        raise CircuitOpenError("fcm", 0.5)
+
+    outbox.register("send", handler)
+    job_id = outbox.enqueue("send", {})
+    run_once(outbox)
+    job = outbox.get(job_id)
+    assert (job["status"], job["attempts"]) == (PENDING, 0)
+    assert job["last_error"]
+    # เลื่อนไปอย่างน้อย 1 วินาที จึงยังไม่ถูกรับทันที
+    assert outbox._claim() is None
+
+
+def test_expired_lease_is_taken_over_and_old_owner_cannot_overwrite(outbox, tmp_path):
+    outbox.register("send", lambda payload: ({"success": True}, 200))
+    job_id = outbox.enqueue("send", {})
+    row = outbox._claim()
+    assert outbox.get(job_id)["status"] == RUNNING
+
+    other = NotificationOutbox(path=outbox.path, workers=1, max_attempts=3, lease_seconds=1)
+    other.owner = "other-host:1"
+    other.register("send", lambda payload: ({"error": "bad request"}, 400))
+    assert other._claim() is None
+
+    time.sleep(1.05)
+    taken = other._claim()
+    assert taken["id"] == job_id
+    other._run_job(taken)
+
+    outbox._run_job(row)
+    job = outbox.get(job_id)
+    assert (job["status"], job["http_status"], job["attempts"]) == (FAILED, 400, 2)
+
+
+def test_unknown_kind_and_job(outbox):
+    with pytest.raises(ValueError):
+        outbox.enqueue("missing", {})
+    assert outbox.get("no-such-job") is None
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from services.common.rate_limiter import (
+    IGNORED,
+    OVERLOADED,
+    SUCCESS,
+    AdaptiveRateLimiter,
+    RateLimitTimeout,
+)
+
+
+def test_success_grows_limit_additively():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=10, initial_concurrency=4)
+    limiter.acquire()
+    limiter.release(SUCCESS)
+    assert limiter.limit == pytest.approx(4.25)
+    assert limiter.in_flight == 0
+
+
+def test_limit_never_exceeds_max_concurrency():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=2, initial_concurrency=2)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(SUCCESS)
+    assert limiter.limit == 2
+
+
+def test_overload_halves_once_per_cooldown():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=16, decrease_cooldown=60)
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(OVERLOADED)
+    assert limiter.limit == 8
+    assert limiter.throttled == 3
+
+
+def test_overload_respects_min_concurrency():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=8, min_concurrency=3, decrease_cooldown=0)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(OVERLOADED)
+    assert limiter.limit == 3
+
+
+def test_ignored_outcome_keeps_limit():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=8, initial_concurrency=4)
+    limiter.acquire()
+    limiter.release(IGNORED)
+    assert limiter.limit == 4
+
+
+def test_concurrency_slot_times_out():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=1)
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.1)
+    limiter.release(SUCCESS)
+    limiter.acquire(timeout=0.1)
+
+
+def test_token_bucket_limits_rate():
+    limiter = AdaptiveRateLimiter(rate=1, burst=1)
+    limiter.acquire()
+    limiter.release(SUCCESS)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.1)
+
+
+def test_retry_after_pauses_all_senders():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(OVERLOADED, retry_after=0.3)
+    assert limiter.stats()["paused_for"] > 0.2
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.1)
+
+    started = time.monotonic()
+    limiter.acquire(timeout=1)
+    assert time.monotonic() - started >= 0.1
+
+
+def test_retry_after_is_clamped_to_max_pause():
+    limiter = AdaptiveRateLimiter(rate=0, max_pause=0.1)
+    limiter.acquire()
+    limiter.release(OVERLOADED, retry_after=3600)
+    assert limiter.stats()["paused_for"] <= 0.1
+    limiter.acquire(timeout=0.5)
+
+
+def test_acquire_async_waits_out_pause_and_times_out():
+    limiter = AdaptiveRateLimiter(rate=0, max_concurrency=4)
+    limiter.acquire()
+    limiter.release(OVERLOADED, retry_after=0.3)
+
+    with pytest.raises(RateLimitTimeout):
+        asyncio.run(limiter.acquire_async(timeout=0.1))
+    asyncio.run(limiter.acquire_async(timeout=1))
+    assert limiter.in_flight == 1
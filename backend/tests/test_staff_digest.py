@@ -0,0 +1,121 @@
+import sqlite3
+import time
+
+import pytest
+
+from services.common.circuit_breaker import CircuitOpenError
+from services.notification.staff_digest import DigestEventStore, StaffDigest
+
+KIND = "staff_payment_upload"
+
+
+class FakeService:
+    def __init__(self):
+        self.sent = []
+        self.fail_with = None
+
+    def send_staff_broadcast(self, title, body, data=None, tokens=None, records=None):
+        if isinstance(self.fail_with, Exception):
+            raise self.fail_with
+        if self.fail_with is False:
+            return False
+        self.sent.append({"title": title, "body": body, "data": data, "records": records})
+        return True
+
+
+def stored(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT title, attempts FROM staff_digest_events ORDER BY id").fetchall()
+
+
+def upload(name):
+    return f"สลิปของ {name}", f"{name} อัปโหลดสลิป", {"type": "PAYMENT_UPLOAD", "patient_name": name}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "digest.sqlite3")
+
+
+@pytest.fixture
+def service():
+    return FakeService()
+
+
+@pytest.fixture
+def digest(service, path):
+    digest = StaffDigest(service, windows={KIND: 60}, store=DigestEventStore(path))
+    yield digest
+    digest.stop()
+
+
+def test_zero_window_sends_every_event(service, path):
+    digest = StaffDigest(service, windows={KIND: 0}, store=DigestEventStore(path))
+    assert digest.submit(KIND, *upload("A"))
+    assert digest.submit(KIND, *upload("B"))
+    assert [message["title"] for message in service.sent] == ["สลิปของ A", "สลิปของ B"]
+    assert digest.pending() == 0
+
+
+def test_first_event_is_sent_and_later_events_are_held(digest, service, path):
+    assert digest.submit(KIND, *upload("A"))
+    assert digest.submit(KIND, *upload("B"))
+    assert digest.submit(KIND, *upload("C"))
+    assert [message["title"] for message in service.sent] == ["สลิปของ A"]
+    assert digest.pending() == 2
+    assert stored(path) == [("สลิปของ B", 0), ("สลิปของ C", 0)]
+
+
+def test_flush_sends_one_digest_with_records(digest, service, path):
+    for name in ("A", "B", "C"):
+        digest.submit(KIND, *upload(name))
+    digest.flush(KIND)
+
+    message = service.sent[-1]
+    assert len(service.sent) == 2
+    assert message["data"]["type"] == "PAYMENT_UPLOAD_DIGEST"
+    assert message["data"]["count"] == "2"
+    assert [record["title"] for record in message["records"]] == ["สลิปของ B", "สลิปของ C"]
+    assert {record["data"]["digest_id"] for record in message["records"]} == {message["data"]["digest_id"]}
+    assert stored(path) == []
+    assert digest.pending() == 0
+
+
+def test_single_held_event_keeps_its_message(digest, service):
+    digest.submit(KIND, *upload("A"))
+    digest.submit(KIND, *upload("B"))
+    digest.flush()
+
+    message = service.sent[-1]
+    assert message["title"] == "สลิปของ B"
+    assert message["records"] is None
+    assert message["data"]["patient_name"] == "B"
+    assert message["data"]["digest_id"]
+
+
+def test_failed_flush_keeps_events_and_counts_attempt(digest, service, path):
+    digest.submit(KIND, *upload("A"))
+    digest.submit(KIND, *upload("B"))
+    service.fail_with = False
+    digest.flush()
+    assert stored(path) == [("สลิปของ B", 1)]
+
+
+def test_open_circuit_keeps_events_without_counting(digest, service, path):
+    digest.submit(KIND, *upload("A"))
+    digest.submit(KIND, *upload("B"))
+    service.fail_with = CircuitOpenError("fcm", 5)
+    digest.flush()
+    assert stored(path) == [("สลิปของ B", 0)]
+
+
+def test_expired_events_of_another_owner_are_adopted(service, path):
+    old = DigestEventStore(path, lease_seconds=1)
+    old.add(KIND, *upload("A"))
+    new = DigestEventStore(path, lease_seconds=1)
+    assert new.adopt() == []
+
+    time.sleep(1.05)
+    adopted = new.adopt()
+    assert [(kind, event[1]) for kind, event in adopted] == [(KIND, "สลิปของ A")]
+    assert old.adopt() == []
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from services.common.ttl_cache import TTLCache
+
+
+def test_value_expires_after_ttl():
+    cache = TTLCache(maxsize=4, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a", "gone") == "gone"
+    assert cache.stats()["size"] == 0
+
+
+def test_per_key_ttl_overrides_default():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set("short", 1, ttl=0.05)
+    cache.set("long", 2)
+    time.sleep(0.06)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_stats_count_hits_and_misses():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_pop_and_clear():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_get_or_load_merges_concurrent_misses():
+    cache = TTLCache(maxsize=4, ttl=60)
+    calls = []
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(1)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 1
+    while cache.stats()["merged"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["value"] * 5
+    assert cache.stats()["merged"] == 4
+    assert cache.get_or_load("k", loader) == "value"
+    assert calls == [1]
+
+
+def test_get_or_load_does_not_cache_errors():
+    cache = TTLCache(maxsize=4, ttl=60)
+
+    def failing():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("k", failing)
+    assert cache.get_or_load("k", lambda: "ok") == "ok"
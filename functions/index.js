@@ -8,7 +8,17 @@
  */
 
 const {onRequest} = require("firebase-functions/v2/https");
+const {onDocumentWritten} = require("firebase-functions/v2/firestore");
 const logger = require("firebase-functions/logger");
+const {initializeApp} = require("firebase-admin/app");
+const {getFirestore, FieldValue} = require("firebase-admin/firestore");
+
+initializeApp();
+
+// ทะเบียน token (document id = token) -> เจ้าของ, role, platform และผลการส่งล่าสุด ที่ backend ใช้หาผู้รับ
+const TOKEN_INDEX_COLLECTION = "FcmTokens";
+// Firestore รับได้สูงสุด 500 write ต่อ batch
+const BATCH_WRITE_LIMIT = 500;
 
 // Create and deploy your first functions
 // https://firebase.google.com/docs/functions/get-started
@@ -17,3 +27,102 @@ const logger = require("firebase-functions/logger");
 //   logger.info("Hello logs!", {structuredData: true});
 //   response.send("Hello from Firebase!");
 // });
+
+/**
+ * fcm_token อาจเป็น array หรือ string ก็ได้ แปลงให้เป็น array เสมอ
+ * @param {object|undefined} data ข้อมูลเอกสาร User
+ * @return {string[]} รายการ token
+ */
+function tokensOf(data) {
+  const value = data ? data.fcm_token : undefined;
+  const tokens = typeof value === "string" ? [value] : (value || []);
+  return tokens.filter((t) => typeof t === "string" && t.trim() && !t.includes("/"));
+}
+
+/**
+ * เขียนรายการ write เป็น batch ละไม่เกิน BATCH_WRITE_LIMIT
+ * @param {FirebaseFirestore.Firestore} db Firestore
+ * @param {Function[]} writes ฟังก์ชัน (batch) => void
+ */
+async function commitInBatches(db, writes) {
+  for (let i = 0; i < writes.length; i += BATCH_WRITE_LIMIT) {
+    const batch = db.batch();
+    writes.slice(i, i + BATCH_WRITE_LIMIT).forEach((write) => write(batch));
+    await batch.commit();
+  }
+}
+
+/**
+ * ถอดผู้ใช้ออกจาก token หนึ่งตัว: ถ้าไม่เหลือใครใช้ token แล้วให้ลบทิ้ง
+ * ถ้าผู้ใช้นี้เป็นเจ้าของปัจจุบัน ให้ย้ายความเป็นเจ้าของไปยังบัญชีล่าสุดที่เหลือ (พร้อม role ของบัญชีนั้น)
+ * @param {FirebaseFirestore.Firestore} db Firestore
+ * @param {string} token FCM token
+ * @param {string} userId ผู้ใช้ที่เอา token ออก
+ */
+async function releaseToken(db, token, userId) {
+  const ref = db.collection(TOKEN_INDEX_COLLECTION).doc(token);
+  await db.runTransaction(async (tx) => {
+    const snapshot = await tx.get(ref);
+    if (!snapshot.exists) {
+      return;
+    }
+    const data = snapshot.data();
+    const remaining = (data.user_ids || []).filter((id) => id !== userId);
+    if (remaining.length === 0) {
+      tx.delete(ref);
+      return;
+    }
+    const update = {user_ids: remaining, updated_at: FieldValue.serverTimestamp()};
+    if (data.user_id === userId || !data.user_id) {
+      const owner = remaining[remaining.length - 1];
+      const ownerDoc = await tx.get(db.collection("User").doc(owner));
+      update.user_id = owner;
+      update.role = ownerDoc.exists ? (ownerDoc.data().role || null) : null;
+    }
+    tx.update(ref, update);
+  });
+}
+
+// 🗂️ อัปเดตทะเบียน FcmTokens ทุกครั้งที่ User.fcm_token หรือ role เปลี่ยน
+exports.syncFcmTokenIndex = onDocumentWritten("User/{userId}", async (event) => {
+  const userId = event.params.userId;
+  const beforeData = event.data.before.data();
+  const afterData = event.data.after.data();
+  const before = new Set(tokensOf(beforeData));
+  const after = new Set(tokensOf(afterData));
+  const role = afterData ? (afterData.role || null) : null;
+  const roleChanged = Boolean(beforeData && afterData) && (beforeData.role || null) !== role;
+
+  const added = [...after].filter((t) => !before.has(t));
+  const removed = [...before].filter((t) => !after.has(t));
+  if (added.length === 0 && removed.length === 0 && !roleChanged) {
+    return;
+  }
+
+  const db = getFirestore();
+  // token ที่เพิ่มเข้ามา: ผู้ใช้นี้เป็นเจ้าของปัจจุบัน (เครื่องเดียวกันล็อกอินบัญชีใหม่)
+  await commitInBatches(db, added.map((t) => (batch) => batch.set(
+      db.collection(TOKEN_INDEX_COLLECTION).doc(t),
+      {
+        user_id: userId,
+        user_ids: FieldValue.arrayUnion(userId),
+        role,
+        last_seen_at: FieldValue.serverTimestamp(),
+        updated_at: FieldValue.serverTimestamp(),
+      },
+      {merge: true},
+  )));
+
+  for (const t of removed) {
+    await releaseToken(db, t, userId);
+  }
+
+  // role เปลี่ยน: อัปเดต token ที่ผู้ใช้นี้เป็นเจ้าของอยู่ (StaffTokenDirectory ฟังจาก role ในทะเบียน)
+  if (roleChanged) {
+    const owned = await db.collection(TOKEN_INDEX_COLLECTION).where("user_id", "==", userId).get();
+    await commitInBatches(db, owned.docs
+        .filter((doc) => !added.includes(doc.id))
+        .map((doc) => (batch) => batch.update(doc.ref, {role, updated_at: FieldValue.serverTimestamp()})));
+  }
+  logger.info("synced fcm token index", {userId, added: added.length, removed: removed.length, roleChanged});
+});